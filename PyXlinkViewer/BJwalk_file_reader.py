@@ -11,7 +11,22 @@ for xlinks, and:
 
    <resid>|<chain>|
 
-for mono-links.  The parser deals with the cases where the user has added additional
+for mono-links. Ambiguous sites can be given as a list of candidate residues (and/or chains)
+separated by semicolons, optionally prefixed by the residue letter, e.g.:
+
+   K12;K15|A|40|A|
+
+Mono-links can have a quantitative value (e.g. the extent of modification from a footprinting
+(FPOP) experiment) in a third column:
+
+   <resid>|<chain>|<value>|
+
+and xlinks can have any number of quantitative values (e.g. the intensity in each condition of a
+differential experiment) in further columns:
+
+   <resid1>|<chain1>|<resid2>|<chain2>|<value1>|<value2>|
+
+The parser deals with the cases where the user has added additional
 whitespace at the end of a line, or added empty lines, however these will need to be
 edited to remove if the file is to be used with jwalk.
 
@@ -35,10 +50,49 @@ b.schiffrin@leeds.ac.uk
 
 '''
 
+import re
+
 from Obs_xlink import Obs_xlink
 from Obs_mono import Obs_mono
 
 
+def parse_sites(resids, chains):
+    '''
+    Returns the list of candidate (chain, resid) sites for an xlink end. Each field can contain several candidates
+    separated by semicolons, and residue numbers can be prefixed by the residue letter (e.g. K12)
+    '''
+
+    resid_list = [re.sub(r'^[A-Za-z]+(?=-?\d)', '', r.strip()) for r in resids.split(';') if r.strip()]
+    chain_list = [c.strip() for c in chains.split(';') if c.strip()]
+
+    return [(c, r) for c in chain_list for r in resid_list]
+
+
+def parse_end(resids, chains, line_num, filename):
+    '''
+    Returns the candidate sites of an end of an xlink or a mono-link on a line of a file (see parse_sites), raising a
+    ValueError giving the line if the residue or chain field is empty
+    '''
+
+    sites = parse_sites(resids, chains)
+
+    if not sites:
+        raise ValueError('Line {0} of {1} has an empty residue or chain field'.format(line_num, filename))
+
+    return sites
+
+
+def parse_value(text):
+    '''
+    Returns a quantitative column as a float, or None if it is empty or not a number
+    '''
+
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
 class BJwalk_file_reader:
     def __init__(self, filename) :
 
@@ -53,7 +107,7 @@ class BJwalk_file_reader:
 
         with open(self.filename, 'r') as f:
 
-            for line in f:
+            for line_num, line in enumerate(f, 1):
 
                 #deal with case where user has left some trailing whitespace at the end of a line 
                 line = line.strip()
@@ -63,29 +117,42 @@ class BJwalk_file_reader:
                     # deal with case that user has added extra spaces
                     data = [x.strip() for x in line.split('|')]
 
+                    # remove the empty field after a trailing separator, so that the number of fields tells the
+                    # line types apart
+                    if len(data) > 2 and data[-1] == '':
+                        data.pop()
 
                     if len(data) == 3 or len(data) == 2:
 
                         mono = Obs_mono()
-                        mono.resid = data[0]
-                        mono.chain = data[1]
+                        mono.chain, mono.resid = parse_end(data[0], data[1], line_num, self.filename)[0]
+
+                        if len(data) == 3:
+                            mono.value = parse_value(data[2])
                         mono.obj_name = mono.chain + '_' + mono.resid
 
                         if self.mono_already_in_list(mono) == False:
                             self.monos.append(mono)
 
-                    elif len(data) == 5 or len(data) == 4:
+                    elif len(data) >= 4:
                         xl = Obs_xlink()
-                        xl.resid1 = data[0]
-                        xl.chain1 = data[1]
-                        xl.resid2 = data[2]
-                        xl.chain2 = data[3]
-                        xl.obj_name = xl.chain1 + '_' + xl.resid1 + '-' + xl.chain2 + '_' + xl.resid2
+                        xl.sites1 = parse_end(data[0], data[1], line_num, self.filename)
+                        xl.sites2 = parse_end(data[2], data[3], line_num, self.filename)
+
+                        # use the first candidate sites until the xlink is resolved by the viewer
+                        xl.chain1, xl.resid1 = xl.sites1[0]
+                        xl.chain2, xl.resid2 = xl.sites2[0]
+
+                        # PyMOL object names can't contain semicolons, so separate candidate sites with dots
+                        xl.obj_name = (data[1] + '_' + data[0] + '-' + data[3] + '_' + data[2]).replace(';', '.').replace(' ', '')
+
+                        # any further columns are quantitative values, e.g. the intensity in each condition
+                        xl.intensities = [parse_value(x) for x in data[4:]]
 
                         if self.xlink_already_in_list(xl) == False:
                             self.xlinks.append(xl)
                     else:
-                        return None
+                        raise ValueError('Line {0} of {1} is not an xlink or a mono-link'.format(line_num, self.filename))
 
                 
         return self.xlinks, self.monos
@@ -24,13 +24,30 @@ b.schiffrin@leeds.ac.uk
 
 '''
 
-from pymol import cmd
+import os
+
+from pymol import cmd, CmdException
 from pymol.cgo import *
-import math
+import numpy as np
 
 from Obs_xlink import Obs_xlink
 from Obs_mono import Obs_mono
 from BJwalk_file_reader import BJwalk_file_reader
+from Xlink_network import Xlink_network
+from Xlink_index import Xlink_index, parse_query
+from Coord_index import Coord_index, DISTANCE_MODES
+import Xlink_geometry
+import Xlink_session
+import Xlink_store
+import Xlink_restraints
+from Coord_watcher import Coord_watcher
+from Xlink_comparison import Xlink_comparison
+from Residue_mapping import Residue_mapping, read_fasta
+from Missing_residues import Missing_residues
+from Interface_index import Interface_index, INTERFACE_LABELS
+import Xlink_columns
+import Xlink_confidence
+from Xlink_confidence import UNCERTAINTY_MODES
 
 
 class BXlink_viewer():
@@ -58,9 +75,19 @@ class BXlink_viewer():
         # set the default radius of the cylinder
         self.radius = 0.5
 
-        # only use C-alpha carbon distances for distance calculations - easily extendable for other atoms 
+        # C-alpha atoms are used to check residues are present and to draw mono-links
         self.atom_type = 'ca'
 
+        # the points between which xlink distances are measured - one of the keys of DISTANCE_MODES
+        self.distance_mode = 'ca'
+
+        # groups of equivalent chains (e.g. the identical chains of a homo-oligomer) stored as chain -> list of
+        # chains
+        self.chain_equivalence = {}
+
+        # maximum number of candidate site pairs expanded at once when resolving ambiguous xlinks
+        self.max_candidate_pairs = 1000000
+
         # initialise colours
         self.satisfied_colour = [0. ,0. ,1.]  # initialise to blue
         self.violated_colour = [1. ,0. , 0.]  # initialise to red
@@ -77,6 +104,99 @@ class BXlink_viewer():
         self.num_sat = 0
         self.mum_viol = 0
 
+        # level of detail used to draw the xlinks - 'auto' draws individual cylinders until the number of xlinks
+        # exceeds lod_link_limit, then draws an overview of lines with cylinders only for the xlinks in view
+        self.lod_mode = 'auto'
+        self.lod_link_limit = 500
+
+        # if set, xlinks outside the current view (clipping slab and field of view) are not drawn
+        self.cull_to_view = False
+
+        # names of the merged PyMOL objects used when drawing large numbers of xlinks
+        self.lod_cylinder_obj = 'xlinks_detail'
+        self.lod_line_obj = 'xlinks_overview'
+        self.bMerged_lod = False
+
+        # how mono-links are drawn - 'fixed' draws spheres of the mono-link colour and size, 'gradient' draws spheres
+        # coloured from mono_low_colour to mono_colour and sized by their values, and 'bfactor' writes the values into
+        # the B-factor column of the residues and colours them with cmd.spectrum using mono_palette
+        self.mono_mode = 'fixed'
+        self.mono_low_colour = [1., 1., 1.]
+        self.mono_palette = 'blue_white_red'
+
+        # names of the merged mono-link object, and of the selection of mono-link residues used by the 'bfactor' mode
+        self.mono_obj = 'monolinks'
+        self.mono_sele = 'monolink_sites'
+
+        # B-factors and colours of the mono-link residue atoms before they were changed by the 'bfactor' mode
+        self.saved_atom_props = None
+
+        # detects changes to the coordinates of the PyMOL object so that only the affected distances are recalculated
+        self.watcher = Coord_watcher(self)
+
+        # graph of residues (nodes) and xlinks (edges) used for the chain pair and residue hub analysis
+        self.network = Xlink_network()
+
+        # NumPy index of the atoms of the selected PyMOL object - built when first needed, or in the background
+        # when an object is selected (see prebuild_coord_index). index_build is the (object, future) of the latest
+        # background build
+        self.coord_index = None
+        self.index_executor = None
+        self.index_build = None
+
+        # reference sequences (chain -> [sequence, start]) the xlink residue numbers are given against, if they are
+        # numbered differently from the structure, and the cached alignments of the sequences to the chains
+        self.reference_sequences = {}
+        self.residue_mapping = Residue_mapping()
+
+        # residues of the xlinks and mono-links which weren't found in the PyMOL object when the distances were last
+        # calculated
+        self.missing_residues = Missing_residues()
+
+        # residues at and near the interfaces between the chains of the PyMOL object, used to label each inter-chain
+        # xlink as 'interface', 'near-interface' or 'distal' (see Interface_index). Residues with an atom within
+        # interface_cutoff of another chain are at its interface, and those with a CA within near_interface_cutoff of
+        # one of its CAs are near it. interface_filter is the label of the inter-chain xlinks shown, or 'all'
+        self.interface_index = Interface_index()
+        self.interface_cutoff = 5.0
+        self.near_interface_cutoff = 12.0
+        self.interface_filter = 'all'
+
+        # what the B-factor column of the PyMOL object holds - 'bfactor' or 'plddt' (see Xlink_confidence) - used to
+        # give each distance an uncertainty and each xlink a probability of being satisfied, or 'off' to treat the
+        # coordinates as exact. Xlinks whose satisfied or violated call is less likely than min_confidence aren't
+        # shown, and the others are faded towards uncertain_colour as the confidence in their call falls
+        self.uncertainty_mode = 'off'
+        self.min_confidence = 0.0
+        self.uncertain_colour = [0.7, 0.7, 0.7]  # initialise to grey
+
+        # residue indexes used to query the xlinks, and the result of the current query (None shows all xlinks)
+        self.xlink_index = Xlink_index()
+        self.query_result = None
+        self.query_text = ''
+
+        # xlinks joined across two or more conditions, if several files or quantitative columns have been loaded
+        self.comparison = None
+
+        # if set, xlinks are coloured by the direction of their fold-change and their width scaled by its size,
+        # rather than coloured by whether they are satisfied. Xlinks whose absolute log2 fold-change is below
+        # fc_threshold are drawn thin in unchanged_colour, and widths stop increasing at a log2 fold-change of fc_cap
+        self.show_fold_change = False
+        self.fc_threshold = 1.0
+        self.fc_cap = 4.0
+        self.up_colour = [1., 0.5, 0.]  # initialise to orange
+        self.down_colour = [0., 0.6, 1.]  # initialise to light blue
+        self.unchanged_colour = [0.7, 0.7, 0.7]  # initialise to grey
+
+        # memory budget in MB. If set, xlink files are read into columns of NumPy arrays (see Xlink_columns) rather
+        # than obs_xlinks, and the xlinks are read, resolved, measured and drawn a chunk at a time, the chunks sized
+        # to fit the budget. The table rows are then made when they are shown. 0 keeps an Obs_xlink per xlink
+        self.memory_budget = 0
+        self.columns = None
+
+        # names of the CGO objects each holding a chunk of the xlinks drawn from the columns
+        self.chunk_objs = []
+
 
   
 #------------------------------------------------------------------------------------
@@ -119,7 +239,14 @@ class BXlink_viewer():
 
 #---------------------------------
     def set_threshold(self, dist):
+        bChanged = dist != self.threshold
+
         self.threshold = dist
+        self.network.set_threshold(dist)
+
+        # the probabilities of the xlinks being satisfied only need recalculating when the threshold changes
+        if bChanged:
+            self.calculate_probabilities()
 
     def set_radius(self, width):
         self.radius = width
@@ -127,6 +254,118 @@ class BXlink_viewer():
     def set_mono_size(self, size):
         self.mono_size = size
 
+    def set_mono_mode(self, mode):
+        self.mono_mode = mode
+
+    def set_lod_mode(self, mode):
+        self.lod_mode = mode
+
+    def set_lod_link_limit(self, num):
+        self.lod_link_limit = num
+
+    def set_cull_to_view(self, bool_cull):
+        self.cull_to_view = bool_cull
+
+    def set_chain_equivalence(self, groups):
+        '''
+        Sets the groups of equivalent chains, either as a list of lists of chains or a string such as 'A=B=C,D=E'
+        '''
+
+        if isinstance(groups, str):
+            groups = [g.split('=') for g in groups.replace(' ', '').split(',') if g]
+
+        self.chain_equivalence = {}
+        for group in groups:
+            for chain in group:
+                self.chain_equivalence[chain] = list(group)
+
+    def set_show_fold_change(self, bool_fc):
+        self.show_fold_change = bool_fc and self.comparison is not None
+
+    def set_fold_change_threshold(self, fc):
+        '''
+        Sets the absolute log2 fold-change threshold and returns the xlinks which have changed state, so that only
+        they need to be redrawn
+        '''
+
+        self.fc_threshold = fc
+
+        if self.comparison is None:
+            return []
+
+        return self.comparison.set_threshold(fc)
+
+    def set_comparison_conditions(self, reference, test):
+        if self.comparison is not None:
+            self.comparison.set_conditions(reference, test)
+
+    def set_reference_sequences(self, sequences):
+        '''
+        Sets the reference sequences the xlink residue numbers are given against, as a dictionary of chain ->
+        [sequence, start] (see Residue_mapping.read_fasta). An empty dictionary uses the structure's numbering
+        '''
+
+        self.reference_sequences = sequences
+
+        if self.coord_index is not None:
+            self.attach_residue_map(self.coord_index)
+
+    def load_sequence_file(self, filename):
+        self.set_reference_sequences(read_fasta(filename))
+
+    def residue_mapping_report(self):
+        '''
+        Returns a line of text for each chain whose residue numbers are mapped from a reference sequence
+        '''
+
+        self.get_coord_index()
+
+        return ['Chain {0}: {1} of {2} reference sequence residues aligned to the {3} residues of the structure'.format(
+                    chain, *self.residue_mapping.summary[chain]) for chain in sorted(self.residue_mapping.summary)]
+
+    def set_interface_filter(self, label):
+        if label != 'all' and label not in INTERFACE_LABELS:
+            raise ValueError('Unknown interface label: ' + label)
+        self.interface_filter = label
+
+    def set_interface_cutoffs(self, interface_cutoff, near_cutoff):
+        self.interface_cutoff = float(interface_cutoff)
+        self.near_interface_cutoff = float(near_cutoff)
+
+    def set_uncertainty_mode(self, mode):
+        if mode not in UNCERTAINTY_MODES:
+            raise ValueError('Unknown uncertainty mode: ' + mode)
+        self.uncertainty_mode = mode
+
+    def set_min_confidence(self, conf):
+        if not 0 <= conf <= 1:
+            raise ValueError('The minimum confidence must be between 0 and 1')
+        self.min_confidence = conf
+
+    def set_memory_budget(self, budget):
+        '''
+        Sets the memory budget in MB (0 for none), which applies from the next xlink file loaded
+        '''
+
+        if budget < 0:
+            raise ValueError('The memory budget can not be negative')
+
+        self.memory_budget = budget
+
+
+    def chunk_size(self):
+        # xlinks opened as columns from a store without a memory budget are processed in the default chunks
+        if not self.memory_budget and self.columns is not None:
+            return Xlink_columns.DEFAULT_CHUNK_ROWS
+
+        return Xlink_columns.chunk_rows(self.memory_budget)
+
+
+    def set_distance_mode(self, mode):
+        if mode not in DISTANCE_MODES:
+            raise ValueError('Unknown distance mode: ' + mode)
+        self.distance_mode = mode
+
 #---------------------------------
     
     def set_num_sat(self, num):
@@ -144,95 +383,481 @@ class BXlink_viewer():
         files supported at the present time to allow maximum user flexibility
         '''
 
+        self.query_result = None
+        self.query_text = ''
+
+        # with a memory budget the xlinks are only held as columns
+        if self.memory_budget:
+            self.columns, self.obs_monos = Xlink_columns.read_jwalk(self.xlink_file, self.chunk_size())
+            self.obs_xlinks = []
+            self.comparison = None
+            self.show_fold_change = False
+            self.xlink_index.build(self.obs_xlinks)
+            return
+
+        self.columns = None
+
         if self.xlink_file_type == 'jwalk':
             reader = BJwalk_file_reader(self.xlink_file)
             self.obs_xlinks, self.obs_monos = reader.read()
 
+        # a file with two or more quantitative columns is compared column by column
+        num_columns = max([len(xl.intensities) for xl in self.obs_xlinks] + [0])
+
+        if num_columns >= 2:
+            self.comparison = Xlink_comparison()
+            for column in range(num_columns):
+                self.comparison.add_condition('Column ' + str(column + 1), self.obs_xlinks, column)
+            self.obs_xlinks = self.start_comparison()
+        else:
+            self.comparison = None
+            self.show_fold_change = False
+
+        self.xlink_index.build(self.obs_xlinks)
+        self.query_result = None
+        self.query_text = ''
+
+
+    def parse_comparison_files(self, files):
+        '''
+        Extract the xlinks from several files, one per condition, and join them by residue pair. Files with more than
+        one quantitative column give a condition per column. The mono-links are taken from the first file. Raises a
+        ValueError, leaving the viewer unchanged, if the files give fewer than two conditions
+        '''
+
+        conditions = []
+        monos = []
+
+        for i, filename in enumerate(files):
+
+            if self.xlink_file_type == 'jwalk':
+                xlinks, file_monos = BJwalk_file_reader(filename).read()
+
+            if i == 0:
+                monos = file_monos
+
+            name = os.path.splitext(os.path.basename(filename))[0]
+            num_columns = max([len(xl.intensities) for xl in xlinks] + [1])
+
+            for column in range(num_columns):
+                conditions.append((name if num_columns == 1 else name + ':' + str(column + 1), xlinks, column))
+
+        if len(conditions) < 2:
+            raise ValueError('A comparison needs at least two conditions - choose two or more files, or a file with '
+                             'two or more quantitative columns')
+
+        # the conditions are joined from Obs_xlink objects, so comparisons don't use the memory budget
+        if self.memory_budget:
+            print('PyXlinkViewer: comparisons are not memory-bounded, the xlinks are held in full')
+
+        self.comparison = Xlink_comparison()
+        self.columns = None
+        self.obs_monos = monos
+
+        for name, xlinks, column in conditions:
+            self.comparison.add_condition(name, xlinks, column)
+
+        self.xlink_file = files[0]
+        self.obs_xlinks = self.start_comparison()
+
+        self.xlink_index.build(self.obs_xlinks)
+        self.query_result = None
+        self.query_text = ''
+
+
+    def start_comparison(self):
+        '''
+        Joins the conditions of the comparison and shows the fold-changes, returning the joined xlinks
+        '''
+
+        xlinks = self.comparison.join()
+        self.comparison.set_threshold(self.fc_threshold)
+        self.show_fold_change = True
+
+        return xlinks
+
+
+    def query(self, chain1=None, resid_range1=None, chain2=None, resid_range2=None, dist_range=None):
+        '''
+        Returns the xlinks matching chain, residue range and distance range predicates. See Xlink_index.query
+        '''
+
+        return self.xlink_index.query(chain1, resid_range1, chain2, resid_range2, dist_range)
+
+
+    def set_query(self, text):
+        '''
+        Restricts the displayed xlinks to those matching a query string (see Xlink_index.parse_query). An
+        empty string removes the restriction
+        '''
+
+        if not text.strip():
+            self.query_result = None
+        elif self.columns is not None:
+            self.query_result = self.columns.query(**parse_query(text))
+        else:
+            self.query_result = self.query(**parse_query(text))
+
+        self.query_text = text
+
+
+    def get_xlinks(self):
+        '''
+        Returns the xlinks which can currently be displayed, i.e. the result of the current query if there is one
+        '''
+
+        if self.query_result is not None:
+            return self.query_result
+
+        return self.obs_xlinks
+
+
+    def get_rows(self):
+        '''
+        Returns the rows of the xlinks held as columns which can currently be displayed, or None for all of them
+        '''
+
+        return self.query_result
+
+
+    def num_xlinks(self):
+        '''
+        Returns the number of xlinks loaded, whether held as columns or as Obs_xlink objects
+        '''
+
+        return len(self.columns) if self.columns is not None else len(self.obs_xlinks)
+
 
 #------------------------------------------------------------------------------------
 
 
-    def get_dist(self,sele1, sele2) :
+    def get_coord_index(self):
         '''
-        Arguments are PyMOL selection strings for the two atoms for which the distance is required
-        Returns the euclidean distance between them
+        Returns the coordinate index for the selected PyMOL object, building it the first time it is needed
         '''
-        
+
+        if self.coord_index is None or self.coord_index.obj != self.obj:
+            self.coord_index = self.attach_residue_map(self.take_prebuilt_index(self.obj) or Coord_index(self.obj))
+
+        return self.coord_index
+
+
+    def attach_residue_map(self, index):
+        '''
+        Sets the residue map of a coordinate index from the reference sequences, so that xlink residue numbers are
+        mapped to the structure's numbers when they are looked up. The sequences are only aligned to chains whose
+        residues haven't been aligned before
+        '''
+
+        index.set_residue_map(self.residue_mapping.lookups(index, self.reference_sequences))
+
+        return index
+
+
+    def prebuild_coord_index(self, obj):
+        '''
+        Starts building the coordinate index of a PyMOL object in a background thread, e.g. when the object is
+        selected in the dialog, so that the index is ready when an xlink file is opened. PyMOL's API lock serialises
+        the calls made by the thread with those of the main thread. A build which hasn't started yet is cancelled when
+        another object is selected
+        '''
+
+        if (self.coord_index is not None and self.coord_index.obj == obj) or (self.index_build and self.index_build[0] == obj):
+            return
+
+        if self.index_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self.index_executor = ThreadPoolExecutor(max_workers=1)
+
+        if self.index_build is not None:
+            self.index_build[1].cancel()
+
+        self.index_build = (obj, self.index_executor.submit(Coord_index, obj))
+
+
+    def take_prebuilt_index(self, obj):
+        '''
+        Returns the index built in the background for an object, waiting for the build to finish if necessary, or
+        None if there isn't one. The coordinates are refreshed in case the object has been moved since
+        '''
+
+        if self.index_build is None or self.index_build[0] != obj:
+            return None
+
+        future = self.index_build[1]
+        self.index_build = None
+
         try:
-            #first get a model for each selection
-            model1 = cmd.get_model(sele1)
-            model2 = cmd.get_model(sele2)
+            index = future.result()
+        except CmdException:
+            # e.g. the object was deleted while the index was being built
+            return None
+
+        return index if index.refresh_coords() else None
+
+
+    def refresh_coord_index(self):
+        '''
+        Makes sure the coordinate index holds the current coordinates of the selected PyMOL object, rebuilding it if
+        the atoms of the object have changed
+        '''
 
-            #create variables initialised to zero to hold the sum of our coordinates
-            x1,y1,z1,x2,y2,z2=0.,0.,0.,0.,0.,0.
+        index = self.get_coord_index()
 
-            #loop through each atom in the model and sum them in variables x,y and z
-            for a in model1.atom:
-                x1+= a.coord[0]
-                y1+= a.coord[1]
-                z1+= a.coord[2]
+        if not index.refresh_coords():
+            self.coord_index = self.attach_residue_map(Coord_index(self.obj))
 
-            for a in model2.atom:
-                x2+= a.coord[0]
-                y2+= a.coord[1]
-                z2+= a.coord[2]
+        return self.coord_index
 
-            #calculate the difference vector between them
-            diff_vector = [x1-x2, y1-y2, z1-z2]
 
-            #calculate magnitude of the vector
-            dist = math.sqrt((diff_vector[0]**2) + (diff_vector[1]**2) + (diff_vector[2]**2))
+    def get_dist(self,sele1, sele2) :
+        '''
+        Arguments are PyMOL selection strings for the two atoms for which the distance is required
+        Returns the euclidean distance between them. If a selection contains more than one atom, its centroid is used
+        '''
         
-        except:
-            # if fails just return the the distance as zero. This will occur when one or both residues involved are missing in the structure
-            dist = 0.0
+        #get the coordinates of each selection
+        xyz1 = cmd.get_coords(sele1)
+        xyz2 = cmd.get_coords(sele2)
+
+        # if either selection is empty just return the the distance as zero. This will occur when one or both residues
+        # involved are missing in the structure
+        if xyz1 is None or xyz2 is None:
+            return 0.0
 
+        #take the centroid of the atoms in each selection and calculate the distance between them
+        dist = Xlink_geometry.distances(xyz1.mean(axis=0, keepdims=True), xyz2.mean(axis=0, keepdims=True))[0]
 
-        return dist
+        return float(dist)
 
 #------------------------------------------------------------------------------------
 
+    def get_xlink_coords(self, xlinks):
+        '''
+        Returns (n, 3) arrays of the points at each end of a list of xlinks for the current distance mode, and boolean
+        arrays of whether each residue is present in the PyMOL object
+        '''
+
+        index = self.get_coord_index()
+
+        keys1 = [(xl.chain1, xl.resid1) for xl in xlinks]
+        keys2 = [(xl.chain2, xl.resid2) for xl in xlinks]
+
+        return index.get_end_points(keys1, keys2, self.distance_mode)
+
 
     def draw_xlink(self, xl, bSatisfied):
         '''
-        This takes in a xlink (Obs_xlink object) and draws it as a cylinder between the two ca atoms. The bSatisfied 
+        This takes in a xlink (Obs_xlink object) and draws it as a cylinder between the two points used to measure its
+        distance (the ca atoms by default). The bSatisfied 
         argument is a boolean which gives whether the distance between the residues is under the threshold set.
         '''
 
-        #make text for selection of the ca atom of both residues in xlink
-        s1 = "obj " + self.obj + " and chain " + xl.chain1 + " and resi " + xl.resid1 + " and name " + self.atom_type
-        s2 = "obj " + self.obj + " and chain " + xl.chain2 + " and resi " + xl.resid2 + " and name " + self.atom_type
- 
+        xyz1, xyz2, found1, found2 = self.get_xlink_coords([xl])
 
-        #get a model for each of the selections
-        model1 = cmd.get_model(s1)
-        model2 = cmd.get_model(s2)
+        #set the rgb values and radius of the cylinder
+        rgb, radius = self.get_link_styles([xl], [bSatisfied])
 
-        #get x,y,z coordinates of each ca atom 
-        x1 = model1.atom[0].coord[0]
-        y1 = model1.atom[0].coord[1]
-        z1 = model1.atom[0].coord[2]
-        x2 = model2.atom[0].coord[0]
-        y2 = model2.atom[0].coord[1]
-        z2 = model2.atom[0].coord[2]
+        # create the object and draw the cylinder - radius of the cylinder defined by the user
+        obj = Xlink_geometry.cylinder_cgo(xyz1, xyz2, radius, rgb)
+        cmd.load_cgo(obj, xl.obj_name)
 
 
-        #set the rgb values of the cylinder
-        if bSatisfied == True:
-            r1 = self.satisfied_colour[0]; r2 = self.satisfied_colour[0] 
-            g1 = self.satisfied_colour[1]; g2 = self.satisfied_colour[1] 
-            b1 = self.satisfied_colour[2]; b2 = self.satisfied_colour[2] 
-        elif bSatisfied == False:
-            r1 = self.violated_colour[0]; r2 = self.violated_colour[0] 
-            g1 = self.violated_colour[1]; g2 = self.violated_colour[1] 
-            b1 = self.violated_colour[2]; b2 = self.violated_colour[2] 
+    def get_link_styles(self, xlinks, sat):
+        '''
+        Returns an (n, 3) array of the colour and an array of the cylinder radius of each xlink. Xlinks are coloured by
+        whether they are satisfied - faded by the confidence in the call if there is an uncertainty mode - or if
+        fold-changes are shown by the direction of their fold-change with the radius scaled by its size
+        '''
 
+        sat = np.asarray(sat, dtype=bool)
+        n = len(xlinks)
 
-        # create the object and draw the cylinder - radius of the cylinder defined by the user
-        obj = [ CYLINDER, x1, y1, z1, x2, y2, z2, self.radius, r1, g1, b1, r2, g2, b2 ]
-        cmd.load_cgo(obj, xl.obj_name)
+        if not self.show_fold_change or self.comparison is None:
+            rgb = np.where(sat[:, None], self.satisfied_colour, self.violated_colour)
+
+            if self.uncertainty_mode != 'off':
+                prob = np.array([np.nan if xl.probability is None else xl.probability for xl in xlinks], dtype=float)
+                rgb = Xlink_confidence.shade(rgb, prob, self.uncertain_colour)
+
+            return rgb, np.full(n, float(self.radius))
+
+        fc = np.array([np.nan if xl.fold_change is None else xl.fold_change for xl in xlinks], dtype=float)
+        bChanged = np.abs(fc) >= self.fc_threshold
+
+        rgb = np.tile(np.asarray(self.unchanged_colour, dtype=float), (n, 1))
+        rgb[bChanged & (fc > 0)] = self.up_colour
+        rgb[bChanged & (fc < 0)] = self.down_colour
+
+        radius = np.full(n, 0.5 * self.radius)
+        scale = np.minimum(np.abs(fc[bChanged]), self.fc_cap) / self.fc_cap
+        radius[bChanged] = self.radius * (0.5 + 1.5 * scale)
+
+        return rgb, radius
 
         
+#------------------------------------------------------------------------------
+
+    def draw_xlinks(self, to_draw):
+        '''
+        Draws a list of (xlink, bSatisfied) tuples using the current level of detail. Small sets of xlinks are
+        drawn as an individual cylinder object for each xlink. Large sets are drawn as two merged CGO objects:
+        an overview of lines, and cylinders for the xlinks in the current view if there are few enough of them
+        '''
+
+        bLines = self.lod_mode == 'lines' or (self.lod_mode == 'auto' and len(to_draw) > self.lod_link_limit)
+
+        # remember whether the merged objects are used, as then single xlinks can't be redrawn on their own
+        self.bMerged_lod = bLines
+
+        if not bLines and not self.cull_to_view:
+            for xl, bSatisfied in to_draw:
+                self.draw_xlink(xl, bSatisfied)
+            return
+
+        if not to_draw:
+            return
+
+        xlinks = [xl for xl, bSatisfied in to_draw]
+        sat = np.array([bSatisfied for xl, bSatisfied in to_draw], dtype=bool)
+
+        # fetch the coordinates of all xlinks at once rather than two selections per xlink
+        xyz1, xyz2, found1, found2 = self.get_xlink_coords(xlinks)
+        keep = found1 & found2
+
+        # an xlink is in view if either end is in view
+        n = len(xlinks)
+        in_view = Xlink_geometry.in_view(np.vstack([xyz1, xyz2]), cmd.get_view(), cmd.get_viewport(), cmd.get('field_of_view'))
+        bIn_view = in_view[:n] | in_view[n:]
+
+        if self.cull_to_view:
+            keep &= bIn_view
+
+        if not bLines:
+            for i in np.flatnonzero(keep):
+                self.draw_xlink(xlinks[i], sat[i])
+            return
+
+        # only draw cylinders for the xlinks in view if there are few enough of them, otherwise draw everything as lines
+        cylinders = keep & bIn_view
+
+        if self.lod_mode != 'auto' or cylinders.sum() > self.lod_link_limit:
+            cylinders[:] = False
+
+        lines = keep & ~cylinders
+
+        rgb, radius = self.get_link_styles(xlinks, sat)
+
+        if cylinders.any():
+            obj = Xlink_geometry.cylinder_cgo(xyz1[cylinders], xyz2[cylinders], radius[cylinders], rgb[cylinders])
+            cmd.load_cgo(obj, self.lod_cylinder_obj)
+
+        if lines.any():
+            # scale the line width with the cylinder radius so that the overview keeps the user's setting
+            obj = Xlink_geometry.line_cgo(xyz1[lines], xyz2[lines], rgb[lines], max(1.0, 4.0 * self.radius))
+            cmd.load_cgo(obj, self.lod_line_obj)
+
+
+    def column_shown(self, columns):
+        '''
+        Returns boolean arrays of which xlinks held as columns should be shown based on user selections, as get_to_draw,
+        and which are satisfied
+        '''
+
+        sat = columns.distance <= self.threshold
+        inter = columns.is_inter()
+
+        shown = (columns.distance != 0) & np.where(sat, self.show_satisied, self.show_violated)
+
+        bInterface = self.interface_filter == 'all'
+        if not bInterface:
+            bInterface = columns.interface == INTERFACE_LABELS.index(self.interface_filter)
+
+        shown &= np.where(inter, self.show_inter & bInterface, self.show_intra)
+
+        if self.uncertainty_mode != 'off':
+            shown &= Xlink_confidence.confident(columns.probability, self.min_confidence)
+
+        return shown, sat
+
+
+    def column_colours(self, columns, sat, rows):
+        '''
+        Returns an (n, 3) array of the colours of some rows of xlinks held as columns, as get_link_styles
+        '''
+
+        rgb = np.where(sat[rows, None], self.satisfied_colour, self.violated_colour)
+
+        if self.uncertainty_mode != 'off':
+            rgb = Xlink_confidence.shade(rgb, columns.probability[rows], self.uncertain_colour)
+
+        return rgb
+
+
+    def draw_columns(self, rows=None):
+        '''
+        Draws the xlinks held as columns (only the given rows if there are any), as an overview of lines - or cylinders
+        in the 'cylinders' level of detail - a chunk at a time, with a CGO object for each chunk grouped under the
+        overview name. In the 'auto' level of detail the xlinks in view are also drawn as cylinders if there are few
+        enough of them
+        '''
+
+        columns = self.columns if rows is None else self.columns.take(rows)
+        index = self.get_coord_index()
+
+        shown, sat = self.column_shown(columns)
+        shown = np.flatnonzero(shown)
+
+        bCylinders = self.lod_mode == 'cylinders'
+        view = (cmd.get_view(), cmd.get_viewport(), cmd.get('field_of_view'))
+
+        # rows of the xlinks in view, until there are too many to draw as cylinders
+        detail = []
+        num_in_view = 0
+
+        for chunk in Xlink_columns.chunks(len(shown), self.chunk_size()):
+
+            chunk_rows = shown[chunk]
+            xyz1, xyz2, found1, found2 = columns.end_points(index, self.distance_mode, chunk_rows)
+            rgb = self.column_colours(columns, sat, chunk_rows)
+
+            # an xlink is in view if either end is in view
+            n = len(chunk_rows)
+            in_view = Xlink_geometry.in_view(np.vstack([xyz1, xyz2]), *view)
+            bIn_view = in_view[:n] | in_view[n:]
+
+            keep = np.ones(n, dtype=bool)
+            if self.cull_to_view:
+                keep = bIn_view
+
+            if self.lod_mode == 'auto' and num_in_view <= self.lod_link_limit:
+                num_in_view += np.count_nonzero(bIn_view)
+                detail.append(chunk_rows[bIn_view])
+
+            if not keep.any():
+                continue
+
+            if bCylinders:
+                obj = Xlink_geometry.cylinder_cgo(xyz1[keep], xyz2[keep], self.radius, rgb[keep])
+            else:
+                obj = Xlink_geometry.line_cgo(xyz1[keep], xyz2[keep], rgb[keep], max(1.0, 4.0 * self.radius))
+
+            name = '{0}_{1}'.format(self.lod_line_obj, len(self.chunk_objs) + 1)
+            cmd.load_cgo(obj, name)
+            self.chunk_objs.append(name)
+
+        if self.chunk_objs:
+            cmd.group(self.lod_line_obj, ' '.join(self.chunk_objs))
+
+        # the merged objects can't be changed one xlink at a time
+        self.bMerged_lod = True
+
+        if detail and 0 < num_in_view <= self.lod_link_limit:
+            detail = np.concatenate(detail)
+            xyz1, xyz2, found1, found2 = columns.end_points(index, self.distance_mode, detail)
+            rgb = self.column_colours(columns, sat, detail)
+            cmd.load_cgo(Xlink_geometry.cylinder_cgo(xyz1, xyz2, self.radius, rgb), self.lod_cylinder_obj)
+
 #------------------------------------------------------------------------------
 
     def draw_mono(self, mono):
@@ -240,91 +865,548 @@ class BXlink_viewer():
         This takes in a mono-link (Obs_mono object) and draws it as a sphere at the ca atom position in the residue.
         '''
         
-        s1 = "obj " + self.obj + " and chain " + mono.chain + " and resi " + mono.resid + " and name " + self.atom_type
+        xyz, found = self.get_coord_index().get_coords([(mono.chain, mono.resid)], self.atom_type)
 
         # only draw monolinks which are present in the PyMOL object
-        if cmd.count_atoms(s1) != 0:
-
-            model1 = cmd.get_model(s1)
-
-            #get x,y,z coordinates of each ca atom 
-            x1 = model1.atom[0].coord[0]
-            y1 = model1.atom[0].coord[1]
-            z1 = model1.atom[0].coord[2]
+        if found[0]:
 
             #Create and draw the GCO sphere
-            obj = [COLOR] + self.mono_colour + [SPHERE, x1, y1, z1, self.mono_size]
+            obj = Xlink_geometry.sphere_cgo(xyz, self.mono_size, self.mono_colour)
             cmd.load_cgo(obj, mono.obj_name)
 
 
+    def draw_monos(self, monos):
+        '''
+        Draws a list of mono-links using the current mono-link mode. In the 'fixed' mode small numbers of mono-links are
+        drawn as an object per mono-link, otherwise all of the mono-links are drawn in bulk as a single merged CGO
+        object, or as B-factor colouring of the residues
+        '''
+
+        if self.mono_mode == 'bfactor':
+            self.colour_monos_by_value(monos)
+            return
+
+        if self.mono_mode == 'fixed' and len(monos) <= self.lod_link_limit:
+            for mono in monos:
+                self.draw_mono(mono)
+            return
+
+        xyz, found = self.get_coord_index().get_coords([(mono.chain, mono.resid) for mono in monos], self.atom_type)
+
+        rgb = np.tile(np.asarray(self.mono_colour, dtype=float), (len(monos), 1))
+        radius = np.full(len(monos), float(self.mono_size))
+
+        if self.mono_mode == 'gradient':
+            frac = self.normalised_mono_values(monos)
+            has_value = ~np.isnan(frac)
+
+            low = np.asarray(self.mono_low_colour, dtype=float)
+            high = np.asarray(self.mono_colour, dtype=float)
+
+            rgb[has_value] = low + frac[has_value, None] * (high - low)
+            radius[has_value] = self.mono_size * (0.5 + frac[has_value])
+
+        if found.any():
+            obj = Xlink_geometry.sphere_cgo(xyz[found], radius[found], rgb[found])
+            cmd.load_cgo(obj, self.mono_obj)
+
+
+    def normalised_mono_values(self, monos):
+        '''
+        Returns an array of the mono-link values scaled to lie between 0 and 1, NaN for mono-links without a value
+        '''
+
+        values = np.array([np.nan if mono.value is None else mono.value for mono in monos], dtype=float)
+
+        if np.isnan(values).all():
+            return values
+
+        lo = np.nanmin(values)
+        hi = np.nanmax(values)
+
+        if hi == lo:
+            return np.where(np.isnan(values), np.nan, 1.0)
+
+        return (values - lo) / (hi - lo)
+
+
+    def colour_monos_by_value(self, monos):
+        '''
+        Writes the mono-link values into the B-factor column of the mono-link residues with a single cmd.alter, and
+        colours them with a single cmd.spectrum. The original B-factors and colours are saved so that they can be
+        restored by restore_mono_residues
+        '''
+
+        # the residues are selected in PyMOL, so they are numbered as in the structure
+        monos = [mono for mono in monos if mono.value is not None]
+        keys = self.get_coord_index().map_keys([(mono.chain, mono.resid) for mono in monos])
+        values = dict((key, mono.value) for key, mono in zip(keys, monos) if key[1] is not None)
+
+        if not values:
+            return
+
+        # build one selection of all the mono-link residues, grouping the residues of each chain
+        chain_resids = {}
+        for chain, resid in values:
+            chain_resids.setdefault(chain, []).append(resid)
+
+        sele = " or ".join("(chain " + chain + " and resi " + "+".join(resids) + ")" for chain, resids in chain_resids.items())
+        cmd.select(self.mono_sele, "obj " + self.obj + " and (" + sele + ")", enable=0)
+
+        if self.saved_atom_props is None:
+            self.saved_atom_props = {}
+            cmd.iterate(self.mono_sele, 'props[(chain, resi, name)] = (b, color)', space={'props': self.saved_atom_props})
+
+        cmd.alter(self.mono_sele, 'b = values[(chain, resi)]', space={'values': values})
+        cmd.spectrum('b', self.mono_palette, self.mono_sele, min(values.values()), max(values.values()))
+
+
+    def restore_mono_residues(self):
+        '''
+        Restores the B-factors and colours of residues changed by colour_monos_by_value
+        '''
+
+        if self.saved_atom_props is None:
+            return
+
+        cmd.alter(self.mono_sele, 'b, color = props.get((chain, resi, name), (b, color))', space={'props': self.saved_atom_props})
+        cmd.recolor()
+        cmd.delete(self.mono_sele)
+
+        self.saved_atom_props = None
+
 #------------------------------------------------------------------------------
 
-    def calculate_distances(self):
+    def resolve_ambiguous_xlinks(self, xlinks):
         '''
-        Calculates distances between each observed xlink. Only called once after xlink file is opened
+        Chooses the candidate site pair with the shortest distance for each xlink with more than one candidate pair,
+        i.e. ambiguous sites or chains with equivalent chains. The candidate pairs are expanded lazily, a chunk of
+        xlinks at a time, into flat arrays of keys so that all of their distances are calculated in one pass without
+        creating an Obs_xlink for each candidate
         '''
 
-        # fill each obs_link distance so do this only once
-        for xl in self.obs_xlinks:
+        equivalence = self.chain_equivalence
+        index = self.get_coord_index()
+
+        ambiguous = []
+        for xl in xlinks:
+
+            # keep the reported sites, as chain1/resid1 and chain2/resid2 are overwritten by the chosen pair
+            if not xl.sites1:
+                xl.sites1 = [(xl.chain1, xl.resid1)]
+                xl.sites2 = [(xl.chain2, xl.resid2)]
+
+            num_pairs = xl.num_candidate_pairs(equivalence)
+
+            if num_pairs > 1:
+                ambiguous.append((xl, num_pairs))
+
+        start = 0
+        while start < len(ambiguous):
+
+            # take as many xlinks as fit within the maximum number of candidate pairs (at least one)
+            end = start + 1
+            total = ambiguous[start][1]
+            while end < len(ambiguous) and total + ambiguous[end][1] <= self.max_candidate_pairs:
+                total += ambiguous[end][1]
+                end += 1
+
+            chunk = ambiguous[start:end]
+            start = end
+
+            keys1 = []
+            keys2 = []
+            for xl, num_pairs in chunk:
+                for site1, site2 in xl.candidate_pairs(equivalence):
+                    keys1.append(site1)
+                    keys2.append(site2)
+
+            xyz1, xyz2, found1, found2 = index.get_end_points(keys1, keys2, self.distance_mode)
+            dists = Xlink_geometry.distances(xyz1, xyz2)
+
+            # candidate pairs with a missing residue, or which link a residue to itself, can't be chosen
+            same = np.array([k1 == k2 for k1, k2 in zip(keys1, keys2)], dtype=bool)
+            dists[~(found1 & found2) | same] = np.inf
+
+            # find the shortest candidate of each xlink - sorting by xlink then distance puts it first in each segment
+            counts = np.array([num_pairs for xl, num_pairs in chunk])
+            offsets = np.r_[0, np.cumsum(counts)[:-1]]
+            segment = np.repeat(np.arange(len(chunk)), counts)
+            best = np.lexsort((dists, segment))[offsets]
+
+            for i, (xl, num_pairs) in enumerate(chunk):
+
+                if np.isfinite(dists[best[i]]):
+                    (xl.chain1, xl.resid1), (xl.chain2, xl.resid2) = keys1[best[i]], keys2[best[i]]
+                else:
+                    (xl.chain1, xl.resid1), (xl.chain2, xl.resid2) = xl.sites1[0], xl.sites2[0]
+
+
+    def calculate_distances(self, xlinks=None):
+        '''
+        Calculates distances between each observed xlink. Called once after xlink file is opened, and again if the
+        distance mode is changed. If a list of xlinks is given only their distances are recalculated, using the
+        coordinate index as it is (e.g. after the coordinate watcher has refreshed it)
+        '''
+
+        if self.columns is not None:
+            self.calculate_column_distances()
+            return
+
+        bAll_xlinks = xlinks is None
+
+        if bAll_xlinks:
+            xlinks = self.obs_xlinks
+            self.refresh_coord_index()
+
+            # remember the coordinates the distances were calculated from
+            self.watcher.reset()
+
+        self.resolve_ambiguous_xlinks(xlinks)
+
+        # fetch the coordinates of both ends of every xlink and calculate all of the distances in one pass
+        xyz1, xyz2, found1, found2 = self.get_xlink_coords(xlinks)
+        dists = Xlink_geometry.distances(xyz1, xyz2)
+
+        bBoth = found1 & found2
+
+        for i, xl in enumerate(xlinks):
+            xl.bRes1_in_obj = bool(found1[i])
+            xl.bRes2_in_obj = bool(found2[i])
+
+            # xlinks with at least one residue missing in the structure have no distance
+            xl.distance = float(dists[i]) if bBoth[i] else 0.0
+
+        self.calculate_uncertainties(xlinks)
+
+        # report the missing residues once, as a summary per chain, when all of the distances are calculated
+        if bAll_xlinks:
+            self.missing_residues.find_xlinks(self.get_coord_index(), xlinks, found1, found2)
+            self.print_missing_residues()
+
+        # the chosen sites of ambiguous xlinks may have changed, so update the query indexes and the interface labels -
+        # only those of the xlinks given, if not all of them were calculated
+        if bAll_xlinks:
+            self.xlink_index.build(self.obs_xlinks)
+        else:
+            self.xlink_index.update(xlinks)
+
+        # the recalculated xlinks may have started or stopped matching the query (e.g. a distance range), so it is run
+        # again before they are redrawn
+        self.set_query(self.query_text)
+
+        self.label_interfaces(None if bAll_xlinks else xlinks)
+
+
+    def calculate_column_distances(self):
+        '''
+        Calculates the distances of all of the xlinks held as columns, resolving the ambiguous xlinks and measuring the
+        distances a chunk at a time, then reports the missing residues and the memory used
+        '''
+
+        index = self.refresh_coord_index()
+        self.watcher.reset()
+
+        # every xlink can have more than one candidate pair if chains are equivalent
+        self.columns.resolve(self.resolve_ambiguous_xlinks, bool(self.chain_equivalence), self.chunk_size())
+        self.columns.calculate_distances(index, self.distance_mode, self.chunk_size())
+        self.calculate_uncertainties()
+
+        self.missing_residues.find_xlink_columns(index, self.columns)
+        self.print_missing_residues()
+
+        # the chosen sites may have changed, so the query is run again
+        self.set_query(self.query_text)
+        self.label_interfaces()
+
+        print('PyXlinkViewer: ' + '\n'.join(self.memory_report()))
+
 
-            #first make the selections
-            s1 = "obj " + self.obj + " and chain " + xl.chain1 + " and resi " + xl.resid1 + " and name " + self.atom_type
-            s2 = "obj " + self.obj + " and chain " + xl.chain2 + " and resi " + xl.resid2 + " and name " + self.atom_type
+    def calculate_uncertainties(self, xlinks=None):
+        '''
+        Sets the standard deviation of the distance of each xlink (only those in a list, if one is given) from the
+        B-factor column values of the points its distance is measured between (see Xlink_confidence), then the
+        probabilities of the xlinks being satisfied. If there is no uncertainty mode the distances are taken as exact
+        '''
+
+        if self.columns is not None:
+            if self.uncertainty_mode == 'off':
+                self.columns.clear_probabilities()
+            else:
+                self.columns.calculate_uncertainties(self.get_coord_index(), self.distance_mode, self.uncertainty_mode, self.chunk_size())
+                self.calculate_probabilities()
+            return
+
+        if xlinks is None:
+            xlinks = self.obs_xlinks
+
+        if self.uncertainty_mode == 'off':
+            for xl in xlinks:
+                xl.sigma = 0.0
+                xl.probability = None
+            return
+
+        index = self.get_coord_index()
+
+        b1 = index.get_b_factors([(xl.chain1, xl.resid1) for xl in xlinks], self.distance_mode)
+        b2 = index.get_b_factors([(xl.chain2, xl.resid2) for xl in xlinks], self.distance_mode)
+
+        for xl, sigma in zip(xlinks, Xlink_confidence.distance_error(b1, b2, self.uncertainty_mode)):
+            xl.sigma = float(sigma)
+
+        self.calculate_probabilities(xlinks)
+
+
+    def calculate_probabilities(self, xlinks=None):
+        '''
+        Sets the probability of each xlink (only those in a list, if one is given) being satisfied at the current
+        threshold, from its distance and the standard deviation of its distance, in one pass over all of the xlinks
+        '''
+
+        if self.uncertainty_mode == 'off':
+            return
+
+        if self.columns is not None:
+            self.columns.calculate_probabilities(self.threshold, self.chunk_size())
+            return
 
-            # deal with case where at least one residue is missing in the structure
-            #test that are residues are in structure
-            if cmd.count_atoms(s1) == 0 or cmd.count_atoms(s2) == 0:
+        if xlinks is None:
+            xlinks = self.obs_xlinks
 
-                if cmd.count_atoms(s1) == 0 and cmd.count_atoms(s2) != 0:
-                    xl.bRes1_in_obj = False
-                    print('\nWarning: Residue {0} in chain {1} is not present in the selected PyMOL object, so the {1}_{0}-{3}_{2} xlink will not be displayed'.format(xl.resid1, xl.chain1, xl.resid2, xl.chain2))
+        prob = Xlink_confidence.satisfaction_probability([xl.distance for xl in xlinks], [xl.sigma for xl in xlinks], self.threshold)
 
-                elif cmd.count_atoms(s1) != 0 and cmd.count_atoms(s2) == 0:
-                    xl.bRes2_in_obj = False
-                    print('\nWarning: Residue {2} in chain {3} is not present in the selected PyMOL object, so the {1}_{0}-{3}_{2} xlink will not be displayed'.format(xl.resid1, xl.chain1, xl.resid2, xl.chain2))
+        for xl, p in zip(xlinks, prob):
+            xl.probability = None if np.isnan(p) else float(p)
 
 
-                elif cmd.count_atoms(s1) == 0 and cmd.count_atoms(s2) == 0:
-                    xl.bRes1_in_obj = False
-                    xl.bRes2_in_obj = False
-                    print('\nWarning: Residue {0} in chain {1} and residue {2} in chain {3} are both not present in the selected PyMOL object, so the {1}_{0}-{3}_{2} xlink will not be displayed'.format(xl.resid1, xl.chain1, xl.resid2, xl.chain2))
+    def label_interfaces(self, xlinks=None):
+        '''
+        Labels each inter-chain xlink (only those in a list, if one is given) by whether its residues are at the
+        interface between its chains (see Interface_index). The interfaces are only found again if the coordinates or
+        cutoffs have changed since they were last found, and the xlinks are then labelled in one pass. Intra-chain
+        xlinks, and those with a residue missing from the structure, have an empty label
+        '''
+
+        index = self.get_coord_index()
+
+        if not self.interface_index.is_current(index, self.interface_cutoff, self.near_interface_cutoff):
+            self.interface_index.build(index, self.interface_cutoff, self.near_interface_cutoff)
+
+        if self.columns is not None:
+            self.columns.label_interfaces(self.interface_index, index, self.chunk_size())
+            return
+
+        if xlinks is None:
+            xlinks = self.obs_xlinks
+
+        keys1 = [(xl.chain1, xl.resid1) for xl in xlinks]
+        keys2 = [(xl.chain2, xl.resid2) for xl in xlinks]
+
+        for xl, level in zip(xlinks, self.interface_index.link_levels(index, keys1, keys2)):
+            xl.interface = INTERFACE_LABELS[level] if level >= 0 else ''
 
-            else: 
-                xl.distance = self.get_dist(s1,s2)
+
+    def interface_shown(self, xl):
+        '''
+        Returns whether an xlink passes the interface filter, which only applies to inter-chain xlinks
+        '''
+
+        return self.interface_filter == 'all' or xl.chain1 == xl.chain2 or xl.interface == self.interface_filter
+
+
+    def confidence_shown(self, xl):
+        '''
+        Returns whether an xlink passes the minimum confidence filter, which only applies if there is an uncertainty mode
+        '''
+
+        return self.uncertainty_mode == 'off' or bool(Xlink_confidence.confident(xl.probability, self.min_confidence))
+
+
+    def memory_report(self):
+        '''
+        Returns lines describing the memory used - the memory budget and the size of the columns if there is one, and
+        the peak resident memory of PyMOL
+        '''
+
+        if self.memory_budget:
+            lines = ['memory budget {0} MB, xlinks processed in chunks of {1}'.format(self.memory_budget, self.chunk_size())]
+        elif self.columns is not None:
+            lines = ['no memory budget, xlinks held as columns from a store and processed in chunks of {0}'.format(self.chunk_size())]
+        else:
+            lines = ['no memory budget, an object is kept per xlink']
+
+        if self.columns is not None:
+            lines.append('{0} xlinks held in {1:.1f} MB of columns'.format(len(self.columns), self.columns.nbytes() / 2. ** 20))
+
+        peak = Xlink_columns.peak_memory()
+
+        if peak is None:
+            lines.append('peak resident memory not available on this platform')
+        else:
+            over = self.memory_budget and peak > self.memory_budget * 2 ** 20
+            lines.append('peak resident memory {0:.0f} MB{1}'.format(peak / 2. ** 20, ' (over the budget)' if over else ''))
+
+        return lines
+
+
+    def uncertainty_report(self):
+        '''
+        Returns lines describing the uncertainties of the distances - how many xlinks have a probability of being
+        satisfied, and how many of them are called satisfied or violated with at least the minimum confidence
+        '''
+
+        if self.uncertainty_mode == 'off':
+            return ['no uncertainty mode, the coordinates are treated as exact']
+
+        if self.columns is not None:
+            prob = self.columns.probability.astype(float)
+            sigma = self.columns.sigma.astype(float)
+        else:
+            prob = np.array([np.nan if xl.probability is None else xl.probability for xl in self.obs_xlinks], dtype=float)
+            sigma = np.array([xl.sigma for xl in self.obs_xlinks], dtype=float)
+
+        known = ~np.isnan(prob)
+        conf = Xlink_confidence.confidence(prob[known])
+
+        lines = ['distance uncertainties from the {0} of {1}'.format(UNCERTAINTY_MODES[self.uncertainty_mode], self.obj),
+                 '{0} of {1} xlinks have a probability of being satisfied at {2} A'.format(int(known.sum()), len(prob), self.threshold)]
+
+        if known.any():
+            lines.append('median distance uncertainty {0:.1f} A, {1} xlinks called with at least {2:.2f} confidence'.format(
+                float(np.median(sigma[known])), int(np.count_nonzero(conf >= self.min_confidence)), self.min_confidence))
+
+        return lines
 
 
     def test_monos_in_obj(self):
         '''
         This function tests to see if any of the monolink residues in the xlink file are not present in the and PyMOL object and 
-        prints a warning message to PyMOL display if not. NB. Monolink residues not in the object are still detailed in the dialog table
+        prints a summary of them to PyMOL display if not. NB. Monolink residues not in the object are still detailed in the dialog table
         '''
- 
-         # fill each obs_link distance so do this only once
-        for mono in self.obs_monos:
 
-            #first make the selections
-            s1 = "obj " + self.obj + " and chain " + mono.chain + " and resi " + mono.resid + " and name " + self.atom_type
+        index = self.get_coord_index()
+        xyz, found = index.get_coords([(mono.chain, mono.resid) for mono in self.obs_monos], self.atom_type)
+
+        self.missing_residues.find_monos(index, self.obs_monos, found)
+        self.print_missing_residues(bMonos=True)
+
+
+    def print_missing_residues(self, bMonos=False):
+        '''
+        Prints the summary of the xlinks (or mono-links) with residues not found in the PyMOL object, if there are any
+        '''
+
+        lines = self.missing_residues.report(bMonos)
+
+        if lines:
+            print('\nWarning: ' + '\n'.join(lines))
 
-            #test that residue is in structure
-            if cmd.count_atoms(s1) == 0:
-                print('\nWarning: Residue {0} in chain {1} is not present in the selected PyMOL object, so the {1}_{0} monolink will not be displayed'.format(mono.resid, mono.chain))
+
+    def export_missing_residues(self, filename):
+        '''
+        Saves the residues of the xlinks and mono-links which aren't found in the PyMOL object in csv format
+        '''
+
+        self.missing_residues.export(filename)
+
+
+    def build_network(self):
+        '''
+        Builds the graph of residues and xlinks. Called once the distances have been calculated, after which
+        the network is updated incrementally whenever the threshold is changed
+        '''
+
+        self.network.build(self.obs_xlinks, self.threshold)
 
 
 
 #------------------------------------------------------------------------------
 
-    def display(self):
+    def restraint_score(self, force_constant=1.0):
         '''
-        This function decides which xlinks should be shown based on user selections, and draws and an xlink if required.
-        Also, draws all mono-links if user has checked the show_monos checkbox
+        Returns the restraint score of the model - the sum of flat-bottom penalties of the distances of the current
+        xlinks beyond the threshold. Xlinks with a residue missing from the structure are not scored
+        '''
+
+        if self.columns is not None:
+            columns = self.columns.take(self.get_rows())
+            dists = columns.distance[columns.found1 & columns.found2 & (columns.distance != 0)].astype(float)
+        else:
+            dists = [xl.distance for xl in self.get_xlinks() if xl.bRes1_in_obj and xl.bRes2_in_obj and xl.distance != 0]
+
+        return Xlink_restraints.restraint_score(dists, self.threshold, force_constant)
+
+
+    def check_chain_placement(self, fixed_chain, moving_chain, **kwargs):
+        '''
+        Searches for a rigid-body move of one chain relative to another which reduces the restraint score of the
+        xlinks between them (see Xlink_restraints.search_placement for the keyword arguments). The moving chain is
+        rotated about the centroid of its CA atoms. Returns the result dictionary, or None if the chains have no
+        xlinks between them
+        '''
+
+        index = self.refresh_coord_index()
+
+        keys_fixed = []
+        keys_moving = []
+        for xl in self.get_xlinks():
+            if not (xl.bRes1_in_obj and xl.bRes2_in_obj):
+                continue
+
+            if xl.chain1 == fixed_chain and xl.chain2 == moving_chain:
+                keys_fixed.append((xl.chain1, xl.resid1))
+                keys_moving.append((xl.chain2, xl.resid2))
+            elif xl.chain1 == moving_chain and xl.chain2 == fixed_chain:
+                keys_fixed.append((xl.chain2, xl.resid2))
+                keys_moving.append((xl.chain1, xl.resid1))
+
+        if not keys_fixed:
+            return None
+
+        # the closest atoms change as the chain moves, so the CA atoms are used in that mode
+        mode = 'ca' if self.distance_mode == 'closest' else self.distance_mode
+
+        fixed, found_fixed = index.get_points(keys_fixed, mode)
+        moving, found_moving = index.get_points(keys_moving, mode)
+        found = found_fixed & found_moving
+
+        rows = index.chain_rows.get(moving_chain, np.zeros(0, dtype=int))
+        ca_rows = rows[np.array([n.upper() == 'CA' for n in index.names[rows]], dtype=bool)] if len(rows) else rows
+        centre = index.xyz[ca_rows if len(ca_rows) else rows].mean(axis=0)
+
+        return Xlink_restraints.search_placement(fixed[found], moving[found], centre, self.threshold, **kwargs)
+
+
+    def apply_chain_placement(self, moving_chain, result):
+        '''
+        Moves a chain of the PyMOL object by a placement found by check_chain_placement, and updates the distances
+        of the xlinks involving it
+        '''
+
+        cmd.transform_selection("obj " + self.obj + " and chain " + moving_chain, result['matrix'], homogenous=1)
+
+        return self.check_coords()
+
+#------------------------------------------------------------------------------
+
+    def get_to_draw(self, xlinks):
+        '''
+        Returns a list of (xlink, bSatisfied) tuples for the xlinks in a list which should be shown based on user selections
         '''
 
-        # get the current view in viewer 
-        current_view = cmd.get_view()
-        
         colour = ""
 
-        for xl in self.obs_xlinks:
+        to_draw = []
+
+        for xl in xlinks:
+
+            # inter-chain xlinks which don't match the interface filter aren't drawn
+            if not self.interface_shown(xl):
+                continue
+
+            # nor are xlinks whose satisfied or violated call is too uncertain
+            if not self.confidence_shown(xl):
+                continue
 
             if xl.distance != 0:  # test for case where one or both residues missing from structure in which case xlink not drawn
 
@@ -390,14 +1472,31 @@ class BXlink_viewer():
                     colour = ""
 
                 if colour:
-                    self.draw_xlink(xl, bSatisfied)
+                    to_draw.append((xl, bSatisfied))
+
+        return to_draw
+
+
+    def display(self):
+        '''
+        This function decides which xlinks should be shown based on user selections, and draws and an xlink if required.
+        Also, draws all mono-links if user has checked the show_monos checkbox
+        '''
+
+        # get the current view in viewer 
+        current_view = cmd.get_view()
         
+        if self.columns is not None:
+            self.draw_columns(self.get_rows())
+        else:
+            # collect the xlinks to be drawn, along with whether they are satisfied, so they can be drawn together
+            to_draw = self.get_to_draw(self.get_xlinks())
+
+            self.draw_xlinks(to_draw)
 
         # now display mono-links if selected to be displayed user
         if self.show_mono == True:
-
-            for mono in self.obs_monos:
-                self.draw_mono(mono)
+            self.draw_monos(self.obs_monos)
 
         #return to the original view
         cmd.set_view(current_view)
@@ -415,6 +1514,84 @@ class BXlink_viewer():
         self.delete_objects()
         self.display()
 
+#------------------------------------------------------------------------------
+
+    def redraw_xlinks(self, xlinks, monos=[]):
+        '''
+        Redraw only the given xlinks and mono-links, e.g. after their distances have changed. If the merged level of
+        detail objects are in use everything is redrawn, as the merged objects can't be changed one xlink at a time
+        '''
+
+        if self.bMerged_lod or self.cull_to_view:
+            self.update()
+            return
+
+        for xl in xlinks:
+            cmd.delete(xl.obj_name)
+
+        for mono in monos:
+            cmd.delete(mono.obj_name)
+
+        # only draw the xlinks that are part of the current query
+        shown = set(id(xl) for xl in self.get_xlinks())
+
+        current_view = cmd.get_view()
+
+        for xl, bSatisfied in self.get_to_draw([xl for xl in xlinks if id(xl) in shown]):
+            self.draw_xlink(xl, bSatisfied)
+
+        # mono-links which aren't drawn as an object each are all redrawn together
+        if monos and self.show_mono == True:
+            if self.mono_mode == 'fixed' and len(self.obs_monos) <= self.lod_link_limit:
+                for mono in monos:
+                    self.draw_mono(mono)
+            else:
+                cmd.delete(self.mono_obj)
+                self.draw_monos(self.obs_monos)
+
+        cmd.set_view(current_view)
+
+
+    def check_coords(self):
+        '''
+        Checks whether the coordinates of the PyMOL object have changed (e.g. a domain has been moved, the object
+        aligned, or the state changed). If so, recalculates the distances of only the xlinks with a residue in a
+        changed chain, and redraws them. Returns the set of changed chains
+        '''
+
+        chains = self.watcher.changed_chains()
+
+        if chains:
+            self.update_chains(chains)
+
+        return chains
+
+
+    def update_chains(self, chains):
+        '''
+        Recalculates the distances and redraws the xlinks and mono-links involving any of the given chains
+        '''
+
+        def touches(xl):
+            for chain, resid in xl.get_sites(1) + xl.get_sites(2):
+                for equiv_chain in self.chain_equivalence.get(chain, [chain]):
+                    if equiv_chain in chains:
+                        return True
+            return False
+
+        # the xlinks held as columns are all measured and drawn again, a chunk at a time
+        if self.columns is not None:
+            self.calculate_distances()
+            self.update()
+            return
+
+        xlinks = [xl for xl in self.obs_xlinks if touches(xl)]
+        monos = [mono for mono in self.obs_monos if mono.chain in chains]
+
+        self.calculate_distances(xlinks)
+        self.network.update(xlinks)
+        self.redraw_xlinks(xlinks, monos)
+
 #------------------------------------------------------------------------------
 
     def delete_objects(self):
@@ -428,6 +1605,71 @@ class BXlink_viewer():
         for mono in self.obs_monos:
             cmd.delete(mono.obj_name)
 
+        for name in self.chunk_objs:
+            cmd.delete(name)
+        self.chunk_objs = []
+
+        cmd.delete(self.lod_cylinder_obj)
+        cmd.delete(self.lod_line_obj)
+        cmd.delete(self.mono_obj)
+        self.restore_mono_residues()
+
+##-----------------------------------------------------------------------------
+
+
+    def save_state(self, filename):
+        '''
+        Saves the xlinks, distances and display settings to a sidecar file (.npz format) which can be restored
+        with load_state without recalculating the distances
+        '''
+
+        Xlink_session.save_state(self, filename)
+
+
+    def load_state(self, filename):
+        '''
+        Restores the xlinks, distances and display settings saved with save_state and redraws them
+        '''
+
+        Xlink_session.load_state(self, filename)
+        self.update()
+
+
+    def save_store(self, filename):
+        '''
+        Saves the xlinks, distances and display settings to a memory-mapped binary columnar file (see Xlink_store),
+        which can be opened by load_store much faster than re-parsing the xlink file, or read by other scripts
+        '''
+
+        Xlink_store.write_store(filename, Xlink_session.state_to_arrays(self))
+
+
+    def load_store(self, filename, obj='', distance_mode=''):
+        '''
+        Restores the xlinks, distances and display settings saved with save_store and redraws them. An object or
+        distance mode, if given, replaces the one the store was saved with and the distances are recalculated. The
+        xlinks are kept as columns mapped from the file, unless they are the conditions of a comparison
+        '''
+
+        store = Xlink_store.Xlink_store(filename)
+
+        if store.get_settings().get('conditions'):
+            Xlink_session.arrays_to_state(self, store.to_arrays())
+        else:
+            Xlink_session.arrays_to_state(self, store.to_arrays(bXlinks=False), Xlink_session.store_to_columns(store))
+
+        if obj or distance_mode:
+            if obj:
+                self.set_obj(obj)
+            if distance_mode:
+                self.set_distance_mode(distance_mode)
+
+            self.calculate_distances()
+            self.test_monos_in_obj()
+            self.build_network()
+
+        self.update()
+
 ##-----------------------------------------------------------------------------
 
 
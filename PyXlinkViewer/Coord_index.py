@@ -0,0 +1,460 @@
+'''
+Coord_index.py
+
+This class holds the atoms of a PyMOL object as NumPy arrays, grouped by residue - used by the
+PyXlinkViewer PyMOL plugin so that the coordinates of many (chain, resid, atom) keys can be looked
+up at once, rather than making a PyMOL selection for every atom of every xlink.
+
+The atom identifiers are fetched with a single cmd.iterate and the coordinates with a single
+cmd.get_coords, so the coordinates can be refreshed cheaply if the structure is moved.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+from pymol import cmd
+import hashlib
+
+import numpy as np
+
+
+# the atom used for each residue type by the 'reactive' distance mode - the atom which reacts with common
+# crosslinkers (e.g. the NZ of lysine for DSSO/BS3). Residue types not listed use the CA atom
+REACTIVE_ATOMS = {
+    'LYS': 'NZ',
+    'SER': 'OG',
+    'THR': 'OG1',
+    'TYR': 'OH',
+    'CYS': 'SG',
+    'ASP': 'CG',
+    'GLU': 'CD',
+    'ARG': 'CZ',
+    'HIS': 'NE2',
+}
+
+# main chain atoms, which are excluded from the side chain centroid
+MAIN_CHAIN_ATOMS = set(['N', 'CA', 'C', 'O', 'OXT'])
+
+# distance modes and the text used to describe them in the dialog table
+DISTANCE_MODES = {
+    'ca': 'CA distance',
+    'cb': 'CB distance',
+    'reactive': 'Reactive atom distance',
+    'centroid': 'Side chain centroid distance',
+    'closest': 'Closest atom distance',
+}
+
+
+class Coord_index():
+
+    def __init__(self, obj, atom_names=None, state=-1):
+
+        # the PyMOL object, the state to take coordinates from, and optionally the only atom names to index
+        self.obj = obj
+        self.state = state
+        self.atom_names = atom_names
+
+        # per-atom arrays, ordered so that the atoms of each residue are contiguous
+        self.chains = np.array([], dtype=object)
+        self.resids = np.array([], dtype=object)
+        self.resns = np.array([], dtype=object)
+        self.names = np.array([], dtype=object)
+        self.xyz = np.zeros((0, 3))
+        self.b = np.zeros(0)
+
+        # residue (chain, resid) keys, the first atom of each residue, and the residue of each atom
+        self.res_keys = []
+        self.res_start = np.zeros(0, dtype=int)
+        self.atom_res = np.zeros(0, dtype=int)
+        self.res_index = {}
+
+        # (chain, resid, NAME) -> atom row
+        self.atom_index = {}
+
+        # order used to put the atoms returned by PyMOL into residue order
+        self.order = np.zeros(0, dtype=int)
+
+        # side chain centroid of each residue, calculated when first needed after the coordinates change
+        self.centroids = None
+
+        # (atom rows, first position, number of atoms) of the heavy atoms of each polymer residue, found when the
+        # closest atoms are first looked for (see heavy_atom_table)
+        self.heavy_atoms = None
+
+        self.chain_rows = {}
+
+        # chain -> (start, lookup array) mapping the residue numbers of a reference sequence to those of the
+        # structure, for chains which are numbered differently (see Residue_mapping and map_keys)
+        self.residue_map = {}
+
+        self.build()
+
+
+    def selection(self):
+        '''
+        Returns the PyMOL selection string for the indexed atoms
+        '''
+
+        sele = "obj " + self.obj
+
+        if self.atom_names:
+            sele += " and name " + "+".join(self.atom_names)
+
+        return sele
+
+
+    def build(self):
+        '''
+        Fetch the atoms of the object from PyMOL and build the indexes
+        '''
+
+        atoms = []
+        cmd.iterate(self.selection(), 'atoms.append((chain, resi, resn, name, b))', space={'atoms': atoms})
+
+        if not atoms:
+            return
+
+        chains, resids, resns, names, b = zip(*atoms)
+
+        # put the atoms in residue order - PyMOL normally stores them this way already, in which case the order
+        # is unchanged because the sort is stable
+        first_seen = {}
+        res_ids = np.array([first_seen.setdefault((c, r), len(first_seen)) for c, r in zip(chains, resids)])
+        self.order = np.argsort(res_ids, kind='stable')
+
+        self.chains = np.array(chains, dtype=object)[self.order]
+        self.resids = np.array(resids, dtype=object)[self.order]
+        self.resns = np.array(resns, dtype=object)[self.order]
+        self.names = np.array(names, dtype=object)[self.order]
+        self.b = np.array(b, dtype=float)[self.order]
+
+        self.atom_res = res_ids[self.order]
+        self.res_start = np.flatnonzero(np.r_[True, self.atom_res[1:] != self.atom_res[:-1]])
+        self.res_keys = list(first_seen)
+        self.res_index = first_seen
+
+        self.atom_index = dict(((c, r, n.upper()), i) for i, (c, r, n) in enumerate(zip(self.chains, self.resids, self.names)))
+        self.heavy_atoms = None
+
+        # atom rows of each chain, used to checksum the coordinates chain by chain
+        self.chain_rows = {}
+        for chain in set(self.chains):
+            self.chain_rows[chain] = np.flatnonzero(self.chains == chain)
+
+        self.refresh_coords()
+
+
+    def refresh_coords(self):
+        '''
+        Fetch the current coordinates of the indexed atoms. Returns False if the atoms have changed, in which
+        case the index should be rebuilt
+        '''
+
+        xyz = cmd.get_coords(self.selection(), self.state)
+
+        if xyz is None or len(xyz) != len(self.order):
+            return False
+
+        self.xyz = np.asarray(xyz, dtype=float)[self.order]
+        self.centroids = None
+
+        return True
+
+
+#------------------------------------------------------------------------------------
+
+    def chain_checksums(self):
+        '''
+        Returns a dictionary of chain -> checksum of the current coordinates of the chain
+        '''
+
+        return dict((chain, hashlib.sha1(self.xyz[rows].tobytes()).hexdigest()) for chain, rows in self.chain_rows.items())
+
+
+    def set_residue_map(self, residue_map):
+        self.residue_map = residue_map
+
+
+    def map_key(self, chain, resid):
+        '''
+        Returns the (chain, resid) key of a residue numbered against the reference sequence of its chain, as numbered
+        in the structure. The resid is None if the residue isn't in the structure
+        '''
+
+        start, lookup = self.residue_map[chain]
+
+        try:
+            position = int(resid) - start
+        except ValueError:
+            return (chain, None)
+
+        return (chain, lookup[position] if 0 <= position < len(lookup) else None)
+
+
+    def map_keys(self, keys):
+        '''
+        Returns a list of (chain, resid) keys mapped through the lookup arrays of the residue map. Keys of chains
+        without a lookup array are unchanged. All of the public lookups of the index map their keys, so this is only
+        needed to make PyMOL selections of the residues
+        '''
+
+        if not self.residue_map:
+            return keys
+
+        residue_map = self.residue_map
+
+        return [self.map_key(c, r) if c in residue_map else (c, r) for c, r in keys]
+
+
+    def has_residue(self, chain, resid):
+        return self.map_keys([(chain, resid)])[0] in self.res_index
+
+
+    def atom_rows(self, keys, atom_name):
+        '''
+        Returns an array of the atom row of the named atom in each (chain, resid) key, -1 where not present
+        '''
+
+        name = atom_name.upper()
+
+        return np.array([self.atom_index.get((c, r, name), -1) for c, r in self.map_keys(keys)], dtype=int)
+
+
+    def get_coords(self, keys, atom_name):
+        '''
+        Returns an (n, 3) array of the coordinates of the named atom in each (chain, resid) key, and a boolean
+        array of whether the atom was found. Coordinates of atoms not found are NaN
+        '''
+
+        rows = self.atom_rows(keys, atom_name)
+        found = rows >= 0
+
+        xyz = np.full((len(rows), 3), np.nan)
+        xyz[found] = self.xyz[rows[found]]
+
+        return xyz, found
+
+
+    def residue_rows(self, keys):
+        '''
+        Returns an array of the residue number (position in res_keys) of each (chain, resid) key, -1 where not present
+        '''
+
+        return np.array([self.res_index.get(key, -1) for key in self.map_keys(keys)], dtype=int)
+
+
+    def get_centroids(self):
+        '''
+        Returns an (n, 3) array of the side chain centroid of every residue, calculated in one pass by summing the
+        side chain atoms of each residue with np.add.reduceat. Residues without side chain atoms (e.g. glycine)
+        use the CA atom, or the centroid of all of their atoms if they have no CA atom
+        '''
+
+        if self.centroids is not None:
+            return self.centroids
+
+        names = np.array([n.upper() for n in self.names], dtype=object)
+        side_chain = np.array([n not in MAIN_CHAIN_ATOMS and not n.startswith('H') for n in names], dtype=float)
+
+        sums = np.add.reduceat(self.xyz * side_chain[:, None], self.res_start, axis=0)
+        counts = np.add.reduceat(side_chain, self.res_start)
+
+        all_sums = np.add.reduceat(self.xyz, self.res_start, axis=0)
+        all_counts = np.diff(np.r_[self.res_start, len(self.xyz)])
+
+        centroids = all_sums / all_counts[:, None]
+
+        # the index's own keys are already numbered as in the structure, so they aren't mapped
+        ca_rows = np.array([self.atom_index.get(key + ('CA',), -1) for key in self.res_keys], dtype=int)
+        has_ca = ca_rows >= 0
+        centroids[has_ca] = self.xyz[ca_rows[has_ca]]
+
+        has_side_chain = counts > 0
+        centroids[has_side_chain] = sums[has_side_chain] / counts[has_side_chain, None]
+
+        self.centroids = centroids
+
+        return centroids
+
+
+    def get_points(self, keys, mode):
+        '''
+        Returns an (n, 3) array of the point used to represent each (chain, resid) key in a distance mode, and a
+        boolean array of whether it was found. The 'cb' and 'reactive' modes use the CA atom of residues without
+        the atom (e.g. glycine, or truncated side chains)
+        '''
+
+        if mode == 'centroid':
+            rows = self.residue_rows(keys)
+            found = rows >= 0
+
+            xyz = np.full((len(rows), 3), np.nan)
+            xyz[found] = self.get_centroids()[rows[found]]
+
+            return xyz, found
+
+        rows = self.point_rows(keys, mode)
+        found = rows >= 0
+
+        xyz = np.full((len(rows), 3), np.nan)
+        xyz[found] = self.xyz[rows[found]]
+
+        return xyz, found
+
+
+    def point_rows(self, keys, mode):
+        '''
+        Returns an array of the atom row of the atom used to represent each (chain, resid) key in the 'ca', 'cb' or
+        'reactive' distance modes, -1 where not present. The 'cb' and 'reactive' modes fall back to the CA atom
+        '''
+
+        if mode == 'cb':
+            rows = self.atom_rows(keys, 'CB')
+        elif mode == 'reactive':
+            mapped = self.map_keys(keys)
+
+            names = []
+            for key in mapped:
+                row = self.atom_index.get(key + ('CA',), -1)
+                names.append(REACTIVE_ATOMS.get(self.resns[row], 'CA') if row >= 0 else 'CA')
+
+            rows = np.array([self.atom_index.get(key + (name,), -1) for key, name in zip(mapped, names)], dtype=int)
+        else:
+            return self.atom_rows(keys, 'CA')
+
+        # fall back to the CA atom
+        missing = np.flatnonzero(rows < 0)
+        if len(missing):
+            rows[missing] = self.atom_rows([keys[i] for i in missing], 'CA')
+
+        return rows
+
+
+    def get_b_factors(self, keys, mode):
+        '''
+        Returns an array of the B-factor column value (a B-factor, or the pLDDT of a predicted model) of the point used
+        to represent each (chain, resid) key in a distance mode, NaN where not found. The 'centroid' and 'closest' modes
+        use the mean over the atoms of the residue, found in one pass with np.add.reduceat
+        '''
+
+        if mode in ('centroid', 'closest'):
+            rows = self.residue_rows(keys)
+            values = np.add.reduceat(self.b, self.res_start) / np.diff(np.r_[self.res_start, len(self.b)]) if len(self.b) else self.b
+        else:
+            rows = self.point_rows(keys, mode)
+            values = self.b
+
+        found = rows >= 0
+
+        b = np.full(len(rows), np.nan)
+        b[found] = values[rows[found]]
+
+        return b
+
+
+    def heavy_atom_table(self):
+        '''
+        Returns an array of the rows of the heavy atoms of the polymer residues (protein or nucleic acid), in residue
+        order, and arrays of the position of the first of them and the number of them for each residue. Ligands, ions
+        and waters have no atoms in the table, so they can't be the closest atoms of an xlink
+        '''
+
+        if self.heavy_atoms is None:
+
+            polymer = set()
+            cmd.iterate(self.selection() + ' and polymer', 'polymer.add((chain, resi))', space={'polymer': polymer})
+
+            bPolymer = np.array([key in polymer for key in self.res_keys], dtype=bool)
+            heavy = np.array([not n.upper().startswith('H') for n in self.names], dtype=bool)
+
+            rows = np.flatnonzero(heavy & bPolymer[self.atom_res]) if len(self.names) else np.zeros(0, dtype=int)
+            counts = np.bincount(self.atom_res[rows], minlength=len(self.res_keys))
+
+            self.heavy_atoms = (rows, np.r_[0, np.cumsum(counts)[:-1]].astype(int), counts)
+
+        return self.heavy_atoms
+
+
+    def closest_atoms(self, keys1, keys2, chunk_size=10000):
+        '''
+        Returns the coordinates of the closest pair of heavy atoms between each pair of polymer residues, and boolean
+        arrays of whether each residue was found. The pairs are sorted by the sizes of their residues and taken a chunk
+        at a time, and the atoms of the residues of a chunk are padded to the largest of them, so that all of the atom
+        pair distances of the chunk are calculated in a single array operation
+        '''
+
+        rows1 = self.residue_rows(keys1)
+        rows2 = self.residue_rows(keys2)
+        found1 = rows1 >= 0
+        found2 = rows2 >= 0
+
+        xyz1 = np.full((len(rows1), 3), np.nan)
+        xyz2 = np.full((len(rows2), 3), np.nan)
+
+        if not len(self.res_start):
+            return xyz1, xyz2, found1, found2
+
+        heavy_rows, heavy_start, heavy_count = self.heavy_atom_table()
+
+        both = np.flatnonzero(found1 & found2)
+        both = both[np.argsort(np.maximum(heavy_count[rows1[both]], heavy_count[rows2[both]]), kind='stable')]
+
+        def padded_atoms(rows):
+            # the coordinates of the heavy atoms of some residues, padded with NaN to the largest of them
+            counts = heavy_count[rows]
+            width = max(1, int(counts.max()))
+            valid = np.arange(width)[None, :] < counts[:, None]
+            atoms = heavy_rows[np.where(valid, heavy_start[rows][:, None] + np.arange(width)[None, :], 0)]
+            return np.where(valid[..., None], self.xyz[atoms], np.nan), width
+
+        for start in range(0, len(both) if len(heavy_rows) else 0, chunk_size):
+            pairs = both[start:start + chunk_size]
+
+            a1, width1 = padded_atoms(rows1[pairs])
+            a2, width2 = padded_atoms(rows2[pairs])
+
+            d = np.sqrt(((a1[:, :, None, :] - a2[:, None, :, :]) ** 2).sum(axis=3))
+            d = np.where(np.isnan(d), np.inf, d).reshape(len(pairs), -1)
+
+            best = d.argmin(axis=1)
+            i1, i2 = np.divmod(best, width2)
+
+            xyz1[pairs] = a1[np.arange(len(pairs)), i1]
+            xyz2[pairs] = a2[np.arange(len(pairs)), i2]
+
+        # residues without any heavy atoms, or outside a polymer, can't be used
+        found1 &= ~np.isnan(xyz1).any(axis=1) | ~found2
+        found2 &= ~np.isnan(xyz2).any(axis=1) | ~found1
+
+        return xyz1, xyz2, found1, found2
+
+
+    def get_end_points(self, keys1, keys2, mode):
+        '''
+        Returns the points between which the distance of each (key1, key2) residue pair is measured in a distance mode,
+        and boolean arrays of whether each residue was found
+        '''
+
+        if mode == 'closest':
+            return self.closest_atoms(keys1, keys2)
+
+        xyz1, found1 = self.get_points(keys1, mode)
+        xyz2, found2 = self.get_points(keys2, mode)
+
+        return xyz1, xyz2, found1, found2
@@ -0,0 +1,72 @@
+'''
+Coord_watcher.py
+
+This class detects changes to the coordinates of the PyMOL object used by a BXlink_viewer - used by
+the PyXlinkViewer PyMOL plugin so that xlink distances are kept up to date if the user moves a
+domain, aligns or sculpts the structure, or changes state. A checksum of the coordinates of each
+chain is kept, so that only the xlinks involving changed chains need to be recalculated.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+
+class Coord_watcher():
+
+    def __init__(self, viewer):
+
+        self.viewer = viewer
+
+        # chain -> checksum of the coordinates the current distances were calculated from
+        self.checksums = {}
+
+
+    def reset(self):
+        '''
+        Record the current coordinates of the viewer's coordinate index as unchanged
+        '''
+
+        self.checksums = self.viewer.get_coord_index().chain_checksums()
+
+
+    def changed_chains(self):
+        '''
+        Fetches the current coordinates and returns the set of chains whose coordinates have changed since the last
+        call (or reset). If the atoms of the object have changed the index is rebuilt and every chain is returned.
+        If there are no previous checksums (e.g. the state was restored from a session) the current coordinates
+        are taken as unchanged
+        '''
+
+        if not self.checksums:
+            self.reset()
+            return set()
+
+        old_index = self.viewer.get_coord_index()
+        index = self.viewer.refresh_coord_index()
+
+        checksums = index.chain_checksums()
+
+        if index is not old_index:
+            changed = set(checksums) | set(self.checksums)
+        else:
+            changed = set(chain for chain in checksums if checksums[chain] != self.checksums.get(chain))
+
+        self.checksums = checksums
+
+        return changed
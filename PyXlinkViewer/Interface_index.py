@@ -0,0 +1,229 @@
+'''
+Interface_index.py
+
+Functions and a class used by the PyXlinkViewer PyMOL plugin to find the residues at the interfaces
+between the chains of a PyMOL object, and to classify the inter-chain xlinks by whether they map
+onto an existing interface.
+
+A residue is at the interface with another chain if any of its heavy atoms is within the interface
+cutoff of an atom of that chain, and near the interface if its CA is within the near cutoff of a CA
+of that chain. The close pairs are found with a spatial grid - the points are binned into cubic
+cells the size of the cutoff, so only points in neighbouring cells need comparing. An inter-chain
+xlink is labelled by its end furthest from the other chain: 'interface' if both of its residues
+are at the interface between the two chains, 'near-interface' if both are at least near it, and
+otherwise 'distal'. The index is built once per object, and only rebuilt when the coordinates
+change.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import itertools
+
+import numpy as np
+
+
+# the labels of the inter-chain xlinks, indexed by their level
+INTERFACE_LABELS = ['interface', 'near-interface', 'distal']
+
+# offsets of a grid cell's neighbours - only half of them, as the pairs of points are found from both cells of each pair
+# of neighbouring cells at once - followed by the cell itself
+NEIGHBOUR_CELLS = np.array([offset for offset in itertools.product([-1, 0, 1], repeat=3) if offset > (0, 0, 0)] + [(0, 0, 0)])
+
+
+def close_pairs(xyz, groups, cutoff, max_pairs=2000000):
+    '''
+    Returns arrays (i, j) of the pairs of points in different groups (e.g. chains) within cutoff of each other. The
+    points are binned into a grid of cells of the cutoff size, and the points of each cell are compared with those of
+    its neighbouring cells, at most max_pairs at a time. Pairs of cells whose points are all in the same group (e.g.
+    the inside of a chain) are skipped. Each pair is returned in both orders
+    '''
+
+    xyz = np.asarray(xyz, dtype=float)
+    groups = np.asarray(groups)
+
+    found_i = [np.zeros(0, dtype=int)]
+    found_j = [np.zeros(0, dtype=int)]
+
+    if not len(xyz):
+        return found_i[0], found_j[0]
+
+    # cell of each point, offset by one so that the neighbours of every cell have valid cell numbers
+    cells = np.floor((xyz - xyz.min(axis=0)) / cutoff).astype(np.int64) + 1
+    dims = cells.max(axis=0) + 2
+    cell_ids = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+    order = np.argsort(cell_ids, kind='stable')
+    ids, starts, counts = np.unique(cell_ids[order], return_index=True, return_counts=True)
+
+    # the group of the points of each cell, or -1 if they are in more than one group
+    sorted_groups = groups[order]
+    low = np.minimum.reduceat(sorted_groups, starts)
+    cell_groups = np.where(low == np.maximum.reduceat(sorted_groups, starts), low, -1)
+
+    for offset in NEIGHBOUR_CELLS:
+
+        bSelf = not offset.any()
+
+        neighbours = ids + (offset[0] * dims[1] + offset[1]) * dims[2] + offset[2]
+        pos = np.minimum(np.searchsorted(ids, neighbours), len(ids) - 1)
+
+        cells_a = np.flatnonzero((ids[pos] == neighbours) & ((cell_groups < 0) | (cell_groups != cell_groups[pos])))
+        cells_b = pos[cells_a]
+
+        # every point of cell a is paired with every point of cell b, a chunk of cell pairs at a time
+        num = counts[cells_a] * counts[cells_b]
+        ends = np.cumsum(num)
+
+        start = 0
+        while start < len(num):
+            base = ends[start - 1] if start else 0
+            end = max(int(np.searchsorted(ends, base + max_pairs, side='right')), start + 1)
+
+            chunk = np.arange(start, end)
+            pair_cell = np.repeat(chunk, num[chunk])
+            k = np.arange(len(pair_cell)) - np.repeat(ends[chunk] - num[chunk] - base, num[chunk])
+
+            size_b = counts[cells_b[pair_cell]]
+            pos_a, pos_b = np.divmod(k, size_b)
+
+            # within a cell each pair is taken once
+            if bSelf:
+                keep = pos_a < pos_b
+                pair_cell, pos_a, pos_b = pair_cell[keep], pos_a[keep], pos_b[keep]
+
+            i = order[starts[cells_a[pair_cell]] + pos_a]
+            j = order[starts[cells_b[pair_cell]] + pos_b]
+
+            keep = groups[i] != groups[j]
+            i = i[keep]
+            j = j[keep]
+
+            close = ((xyz[i] - xyz[j]) ** 2).sum(axis=1) <= cutoff * cutoff
+            found_i.append(i[close])
+            found_j.append(j[close])
+
+            start = end
+
+    i = np.concatenate(found_i)
+    j = np.concatenate(found_j)
+
+    return np.r_[i, j], np.r_[j, i]
+
+
+class Interface_index():
+
+    def __init__(self):
+
+        # the object, cutoffs and chain checksums (see Coord_index.chain_checksums) the index was built with
+        self.obj = None
+        self.interface_cutoff = None
+        self.near_cutoff = None
+        self.checksums = None
+
+        # chain -> chain number
+        self.chain_codes = {}
+
+        # sorted codes (residue row * number of chains + chain number) of the residues at, and near, the interface with
+        # each other chain
+        self.contacts = np.zeros(0, dtype=np.int64)
+        self.near = np.zeros(0, dtype=np.int64)
+
+
+    def is_current(self, index, interface_cutoff, near_cutoff):
+        '''
+        Returns whether the index was built from the current coordinates of a coordinate index with the same cutoffs
+        '''
+
+        return (self.obj == index.obj and self.interface_cutoff == interface_cutoff and self.near_cutoff == near_cutoff
+                and self.checksums == index.chain_checksums())
+
+
+    def build(self, index, interface_cutoff=5.0, near_cutoff=12.0):
+        '''
+        Finds the residues of a coordinate index at and near the interfaces between its chains
+        '''
+
+        self.obj = index.obj
+        self.interface_cutoff = interface_cutoff
+        self.near_cutoff = near_cutoff
+        self.checksums = index.chain_checksums()
+
+        self.chain_codes = dict((chain, i) for i, chain in enumerate(sorted(set(index.chains))))
+        num_chains = len(self.chain_codes)
+
+        atom_chains = np.array([self.chain_codes[chain] for chain in index.chains], dtype=np.int64)
+
+        # heavy atoms within the interface cutoff of an atom of another chain
+        heavy = np.flatnonzero([not name.upper().startswith('H') for name in index.names])
+        i, j = close_pairs(index.xyz[heavy], atom_chains[heavy], interface_cutoff)
+        self.contacts = np.unique(index.atom_res[heavy[i]] * num_chains + atom_chains[heavy[j]])
+
+        # CA atoms (or the first atom of residues without one) within the near cutoff of a CA of another chain. NB. the
+        # index's own keys are already numbered as in the structure, so they aren't mapped
+        ca_rows = np.array([index.atom_index.get(key + ('CA',), -1) for key in index.res_keys], dtype=int)
+        ca_rows = np.where(ca_rows >= 0, ca_rows, index.res_start)
+
+        res_chains = atom_chains[ca_rows]
+        i, j = close_pairs(index.xyz[ca_rows], res_chains, near_cutoff)
+        self.near = np.unique(i * num_chains + res_chains[j])
+
+
+    def residue_levels(self, rows, partners):
+        '''
+        Returns the level (an index of INTERFACE_LABELS) of each residue row relative to a partner chain number, -1
+        where either is missing
+        '''
+
+        codes = rows * len(self.chain_codes) + partners
+
+        levels = np.full(len(codes), 2, dtype=int)
+        levels[np.isin(codes, self.near)] = 1
+        levels[np.isin(codes, self.contacts)] = 0
+        levels[(rows < 0) | (partners < 0)] = -1
+
+        return levels
+
+
+    def pair_levels(self, rows1, chains1, rows2, chains2):
+        '''
+        Returns the level (an index of INTERFACE_LABELS) of each pair of residues given by their residue rows and chain
+        numbers - the level of the end furthest from the other end's chain. Intra-chain pairs, and pairs with a residue
+        missing from the structure, are -1
+        '''
+
+        levels1 = self.residue_levels(rows1, chains2)
+        levels2 = self.residue_levels(rows2, chains1)
+
+        levels = np.maximum(levels1, levels2)
+        levels[(levels1 < 0) | (levels2 < 0) | (chains1 == chains2)] = -1
+
+        return levels
+
+
+    def link_levels(self, index, keys1, keys2):
+        '''
+        Returns the level (an index of INTERFACE_LABELS) of each pair of (chain, resid) keys of a coordinate index (see
+        pair_levels)
+        '''
+
+        chains1 = np.array([self.chain_codes.get(chain, -1) for chain, resid in keys1], dtype=np.int64)
+        chains2 = np.array([self.chain_codes.get(chain, -1) for chain, resid in keys2], dtype=np.int64)
+
+        return self.pair_levels(index.residue_rows(keys1), chains1, index.residue_rows(keys2), chains2)
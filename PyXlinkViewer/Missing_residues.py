@@ -0,0 +1,223 @@
+'''
+Missing_residues.py
+
+This class is used by the PyXlinkViewer PyMOL plugin to find the xlink and mono-link residues
+which aren't present in the selected PyMOL object (e.g. a partial model, or disordered loops
+missing from a crystal structure), and to report them as a summary per chain rather than as a
+warning per xlink.
+
+The residues missing from the object are found in one pass - the set of residues at the ends of
+the xlinks (mapped to the structure's numbering if there are reference sequences) less the
+residues of the coordinate index. Residues which are present but lack the atoms the distances
+are measured between (e.g. no CA atom) are reported separately.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import re
+
+import numpy as np
+
+
+# the largest number of residue ranges listed for a chain in the summary
+MAX_RANGES = 20
+
+
+def residue_order(resid):
+    '''
+    Sort key for residue numbers which may have insertion codes, e.g. 100 < 100A < 101
+    '''
+
+    match = re.match(r'-?\d+', resid)
+
+    return (int(match.group()) if match else 0, resid)
+
+
+def residue_ranges(resids):
+    '''
+    Returns a list of residue numbers as text, with runs of consecutive numbers joined into ranges, e.g. '25-30, 45'
+    '''
+
+    ranges = []
+
+    for resid in sorted(resids, key=residue_order):
+        try:
+            number = int(resid)
+        except ValueError:
+            ranges.append([resid, None, None])
+            continue
+
+        if ranges and ranges[-1][2] is not None and number == ranges[-1][2] + 1:
+            ranges[-1][2] = number
+        else:
+            ranges.append([resid, number, number])
+
+    text = [first if last is None or last == start else '{0}-{1}'.format(start, last) for first, start, last in ranges]
+
+    if len(text) > MAX_RANGES:
+        text = text[:MAX_RANGES] + ['... ({0} more)'.format(len(text) - MAX_RANGES)]
+
+    return ', '.join(text)
+
+
+class Missing_residues():
+
+    def __init__(self):
+
+        self.obj = ''
+
+        # (chain, resid) -> number of xlinks (or mono-links) which can't be displayed because of the residue - either
+        # it isn't in the object at all, or it's present but lacks the atoms the distance is measured between
+        self.xlink_residues = {}
+        self.xlink_incomplete = {}
+        self.mono_residues = {}
+        self.mono_incomplete = {}
+
+        # numbers of xlinks and mono-links which can't be displayed, and the totals
+        self.num_xlinks = 0
+        self.num_monos = 0
+        self.total_xlinks = 0
+        self.total_monos = 0
+
+
+    def find_missing(self, index, keys, found):
+        '''
+        Returns two dictionaries of (chain, resid) -> count for the keys which weren't found in a coordinate index - the
+        residues which aren't in the index, found by a single set difference against its residues, and the residues
+        which are in it but weren't found (e.g. they have no CA atom)
+        '''
+
+        mapped = index.map_keys(keys)
+        absent = set(mapped) - set(index.res_index)
+
+        missing = {}
+        incomplete = {}
+
+        for key, mapped_key, bFound in zip(keys, mapped, found):
+            if not bFound:
+                counts = missing if mapped_key in absent else incomplete
+                counts[key] = counts.get(key, 0) + 1
+
+        return missing, incomplete
+
+
+    def find_xlinks(self, index, xlinks, found1, found2):
+        '''
+        Finds the residues of a list of xlinks which weren't found in the coordinate index. found1 and found2 are
+        whether each end of each xlink was found (see Coord_index.get_end_points)
+        '''
+
+        self.obj = index.obj
+        self.total_xlinks = len(xlinks)
+        self.num_xlinks = int(np.count_nonzero(~(np.asarray(found1, dtype=bool) & np.asarray(found2, dtype=bool))))
+
+        keys = [(xl.chain1, xl.resid1) for xl in xlinks] + [(xl.chain2, xl.resid2) for xl in xlinks]
+
+        self.xlink_residues, self.xlink_incomplete = self.find_missing(index, keys, np.r_[found1, found2])
+
+
+    def find_xlink_columns(self, index, columns):
+        '''
+        Finds the residues of xlinks held as columns (see Xlink_columns) which weren't found in the coordinate index.
+        Only the keys of the ends which weren't found are listed
+        '''
+
+        self.obj = index.obj
+        self.total_xlinks = len(columns)
+        self.num_xlinks = int(np.count_nonzero(~(columns.found1 & columns.found2)))
+
+        codes = np.r_[columns.site1[~columns.found1], columns.site2[~columns.found2]]
+        keys = [columns.keys[code] for code in codes]
+
+        self.xlink_residues, self.xlink_incomplete = self.find_missing(index, keys, np.zeros(len(keys), dtype=bool))
+
+
+    def find_monos(self, index, monos, found):
+        '''
+        Finds the residues of a list of mono-links which weren't found in the coordinate index
+        '''
+
+        self.obj = index.obj
+        self.total_monos = len(monos)
+        self.num_monos = int(np.count_nonzero(~np.asarray(found, dtype=bool)))
+
+        keys = [(mono.chain, mono.resid) for mono in monos]
+
+        self.mono_residues, self.mono_incomplete = self.find_missing(index, keys, found)
+
+#------------------------------------------------------------------------------
+
+    def chain_summary(self, residues):
+        '''
+        Returns a list of (chain, number of residues, residue ranges) for a dictionary of missing residues
+        '''
+
+        chains = {}
+        for chain, resid in residues:
+            chains.setdefault(chain, []).append(resid)
+
+        return [(chain, len(chains[chain]), residue_ranges(chains[chain])) for chain in sorted(chains)]
+
+
+    def report(self, bMonos=False):
+        '''
+        Returns the lines of the summary of the xlinks (or mono-links) which can't be displayed, with the residues
+        responsible per chain, or an empty list if all of them can be displayed
+        '''
+
+        if bMonos:
+            num, total, name = self.num_monos, self.total_monos, 'mono-links'
+            residues, incomplete = self.mono_residues, self.mono_incomplete
+        else:
+            num, total, name = self.num_xlinks, self.total_xlinks, 'xlinks'
+            residues, incomplete = self.xlink_residues, self.xlink_incomplete
+
+        if not num:
+            return []
+
+        lines = ['{0} of {1} {2} have residues not found in {3}, so will not be displayed:'.format(num, total, name, self.obj)]
+
+        for chain, num_res, ranges in self.chain_summary(residues):
+            lines.append('  chain {0}: {1} residue{2} not present ({3})'.format(chain, num_res, '' if num_res == 1 else 's', ranges))
+
+        for chain, num_res, ranges in self.chain_summary(incomplete):
+            lines.append('  chain {0}: {1} residue{2} without the atoms used ({3})'.format(chain, num_res, '' if num_res == 1 else 's', ranges))
+
+        return lines
+
+
+    def export(self, filename):
+        '''
+        Saves the residues in csv format, with whether each is missing from the object or lacks the atoms used, and the
+        numbers of xlinks and mono-links it prevents being displayed
+        '''
+
+        rows = {}
+        for status, xlink_counts, mono_counts in [('not present', self.xlink_residues, self.mono_residues),
+                                                  ('no atoms', self.xlink_incomplete, self.mono_incomplete)]:
+            for key in set(xlink_counts) | set(mono_counts):
+                rows[key] = (status, xlink_counts.get(key, 0), mono_counts.get(key, 0))
+
+        with open(filename, 'w') as f:
+
+            f.write('Chain,Residue,Status,Xlinks,Mono-links\n')
+
+            for key in sorted(rows, key=lambda key: (key[0], residue_order(key[1]))):
+                f.write('{0},{1},{2},{3},{4}\n'.format(key[0], key[1], *rows[key]))
@@ -35,6 +35,9 @@ class Obs_mono():
         #name of the pymol object associated with drawn xlink
         self.obj_name = ""
 
+        # optional quantitative value, e.g. the extent of modification measured by footprinting (FPOP)
+        self.value = None
+
 
     def __eq__(self,other) :
         '''
@@ -40,6 +40,11 @@ class Obs_xlink():
         self.resanme2 = ""
 
         self.distance = 0.0
+
+        # standard deviation of the distance from the uncertainty of the coordinates, and the probability that the
+        # xlink is satisfied at the current threshold - None unless an uncertainty mode is set (see Xlink_confidence)
+        self.sigma = 0.0
+        self.probability = None
         
         #name of the pymol object associated with drawn xlink
         self.obj_name = ""
@@ -48,18 +53,84 @@ class Obs_xlink():
         self.bRes1_in_obj = True
         self.bRes2_in_obj = True
 
+        # candidate (chain, resid) sites for each end of the xlink, as reported by the search engine, e.g. 'K12;K15'.
+        # chain1/resid1 and chain2/resid2 hold the candidate pair chosen when the distances are calculated
+        self.sites1 = []
+        self.sites2 = []
+
+        # quantitative values (e.g. intensities) from any extra columns of the xlink file - None where a column is
+        # empty - and the log2 fold-change between two conditions if the xlink is part of a comparison
+        self.intensities = []
+        self.fold_change = None
+
+        # for inter-chain xlinks, whether the residues are at the 'interface' between their chains, 'near-interface'
+        # or 'distal' (see Interface_index)
+        self.interface = ''
+
     
     def __eq__(self,other) :
         '''
         Overloaded equality operator in order to remove duplicates in input XL file
         '''
-        if self.resid1 == other.resid1 and self.resid2 == other.resid2 and self.chain1 == other.chain1 and self.chain2 == other.chain2:
+        if self.resid1 == other.resid1 and self.resid2 == other.resid2 and self.chain1 == other.chain1 and self.chain2 == other.chain2 \
+                and self.sites1 == other.sites1 and self.sites2 == other.sites2:
             return True
         else:
             return False
 
 
 
+    def get_sites(self, end):
+        '''
+        Returns the list of candidate (chain, resid) sites for one end (1 or 2) of the xlink
+        '''
+
+        sites = self.sites1 if end == 1 else self.sites2
+
+        if not sites:
+            sites = [(self.chain1, self.resid1)] if end == 1 else [(self.chain2, self.resid2)]
+
+        return sites
+
+
+    def candidate_sites(self, end, equivalence):
+        '''
+        Generator of the candidate sites of one end of the xlink, with each chain expanded to its equivalent chains
+        (e.g. the identical chains of a homo-oligomer). equivalence is a dictionary of chain -> list of chains
+        '''
+
+        seen = set()
+
+        for chain, resid in self.get_sites(end):
+            for equiv_chain in equivalence.get(chain, [chain]):
+
+                # the same site can be reached from more than one reported chain
+                if (equiv_chain, resid) not in seen:
+                    seen.add((equiv_chain, resid))
+                    yield (equiv_chain, resid)
+
+
+    def num_candidate_pairs(self, equivalence):
+        '''
+        Returns the number of candidate site pairs, without expanding the pairs
+        '''
+
+        num1 = sum(1 for site in self.candidate_sites(1, equivalence))
+        num2 = sum(1 for site in self.candidate_sites(2, equivalence))
+
+        return num1 * num2
+
+
+    def candidate_pairs(self, equivalence):
+        '''
+        Generator of all ((chain1, resid1), (chain2, resid2)) candidate site pairs, expanded lazily
+        '''
+
+        for site1 in self.candidate_sites(1, equivalence):
+            for site2 in self.candidate_sites(2, equivalence):
+                yield site1, site2
+
+
     def output(self):
         '''
         Outputs the data for the observed xlink. Used for debugging purposes
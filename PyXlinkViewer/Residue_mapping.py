@@ -0,0 +1,212 @@
+'''
+Residue_mapping.py
+
+Functions and a class used by the PyXlinkViewer PyMOL plugin to map residue numbers taken from
+a reference (e.g. search database) sequence onto the residue numbers of a structure, which often
+has an offset, gaps, or a different numbering scheme.
+
+The reference sequence is aligned once to the sequence of each chain of the structure with
+difflib, and the alignment is turned into a lookup array from reference position to structure
+residue number. The xlink residue numbers are then mapped through the lookup arrays when the
+coordinate index looks them up (see Coord_index.map_keys). Alignments are cached by hashes of the
+reference sequence and of the chain's residues, so they are only recalculated if either changes.
+Chains whose residue numbers already match the reference are left unmapped.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import difflib
+import hashlib
+
+import numpy as np
+
+
+# one letter codes of the residue types - other residue types are 'X'
+ONE_LETTER = {
+    'ALA': 'A', 'ARG': 'R', 'ASN': 'N', 'ASP': 'D', 'CYS': 'C', 'GLN': 'Q', 'GLU': 'E', 'GLY': 'G', 'HIS': 'H',
+    'ILE': 'I', 'LEU': 'L', 'LYS': 'K', 'MET': 'M', 'PHE': 'F', 'PRO': 'P', 'SER': 'S', 'THR': 'T', 'TRP': 'W',
+    'TYR': 'Y', 'VAL': 'V', 'MSE': 'M', 'SEC': 'U', 'PYL': 'O',
+}
+
+# key of a reference sequence used for every chain which doesn't have a sequence of its own
+ALL_CHAINS = '*'
+
+
+def read_fasta(filename):
+    '''
+    Reads the reference sequences from a FASTA file. The first word of each header is the chain (or comma separated
+    chains) the sequence is numbered for, and an optional start=N word gives the number of its first residue (1 by
+    default). A file containing a single sequence is used for every chain, e.g.
+
+    >A,B start=1
+    MKVLAAG...
+
+    Returns a dictionary of chain -> [sequence, start]
+    '''
+
+    records = []
+
+    with open(filename) as f:
+        for line in f:
+            line = line.strip()
+
+            if line.startswith('>'):
+                records.append([line[1:].split(), []])
+            elif line and records:
+                records[-1][1].append(line.replace(' ', '').upper())
+
+    sequences = {}
+
+    for words, lines in records:
+
+        start = 1
+        for word in words[1:]:
+            if word.lower().startswith('start='):
+                start = int(word.split('=', 1)[1])
+
+        chains = words[0].split(',') if words else []
+
+        # a single sequence (e.g. from UniProt, whose header doesn't name a chain) is used for every chain
+        if len(records) == 1:
+            chains.append(ALL_CHAINS)
+
+        for chain in chains:
+            sequences[chain] = [''.join(lines), start]
+
+    return sequences
+
+
+def sequence_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def to_number(resid):
+    '''
+    Returns a residue number as an integer, or None if it isn't one (e.g. it has an insertion code)
+    '''
+
+    try:
+        return int(resid)
+    except ValueError:
+        return None
+
+
+def align(reference, structure):
+    '''
+    Aligns a reference sequence to the sequence of a chain of a structure, and returns an array of the position in
+    the structure sequence of each reference position (-1 if it isn't aligned to a residue of the structure)
+    '''
+
+    positions = np.full(len(reference), -1, dtype=int)
+
+    matcher = difflib.SequenceMatcher(None, reference, structure, autojunk=False)
+
+    for ref_start, struct_start, size in matcher.get_matching_blocks():
+        positions[ref_start:ref_start + size] = np.arange(struct_start, struct_start + size)
+
+    return positions
+
+
+def chain_residues(index):
+    '''
+    Returns a dictionary of chain -> (list of residue numbers, one letter sequence) of the residues of a coordinate
+    index, in the order they are stored
+    '''
+
+    residues = {}
+
+    resns = index.resns[index.res_start] if len(index.res_start) else []
+
+    for (chain, resid), resn in zip(index.res_keys, resns):
+        entry = residues.setdefault(chain, ([], []))
+        entry[0].append(resid)
+        entry[1].append(ONE_LETTER.get(str(resn).upper(), 'X'))
+
+    return dict((chain, (resids, ''.join(letters))) for chain, (resids, letters) in residues.items())
+
+
+class Residue_mapping():
+
+    def __init__(self):
+
+        # (reference hash, start, structure hash) -> lookup array, or None if the chain needs no mapping
+        self.alignments = {}
+
+        # chain -> (residues matched, reference length, chain length) of the last lookups made
+        self.summary = {}
+
+
+    def lookup(self, sequence, start, resids, chain_sequence):
+        '''
+        Returns the lookup array of a chain - the structure residue number of each reference position, or None
+        where the reference residue isn't in the structure. Returns None if the residue numbers of the chain already
+        match the reference sequence
+        '''
+
+        key = (sequence_hash(sequence), start, sequence_hash(' '.join(resids) + chain_sequence))
+
+        if key in self.alignments:
+            return self.alignments[key]
+
+        # if the chain's own numbers put its residues on the same residue types of the reference, no mapping is needed
+        numbers = [to_number(resid) for resid in resids]
+        bIdentity = all(n is not None and 0 <= n - start < len(sequence) and sequence[n - start] in (letter, 'X')
+                        for n, letter in zip(numbers, chain_sequence) if letter != 'X')
+
+        if bIdentity:
+            lookup = None
+        else:
+            positions = align(sequence, chain_sequence)
+            lookup = np.full(len(sequence), None, dtype=object)
+            aligned = positions >= 0
+            lookup[aligned] = np.array(resids, dtype=object)[positions[aligned]]
+
+        self.alignments[key] = lookup
+
+        return lookup
+
+
+    def lookups(self, index, sequences):
+        '''
+        Returns a dictionary of chain -> (start, lookup array) for the chains of a coordinate index which need their
+        residue numbers mapping from the reference sequences (chain -> [sequence, start], see read_fasta)
+        '''
+
+        self.summary = {}
+
+        if not sequences:
+            return {}
+
+        lookups = {}
+
+        for chain, (resids, chain_sequence) in chain_residues(index).items():
+
+            entry = sequences.get(chain) or sequences.get(ALL_CHAINS)
+            if not entry:
+                continue
+
+            sequence, start = entry[0], int(entry[1])
+            lookup = self.lookup(sequence, start, resids, chain_sequence)
+
+            if lookup is not None:
+                lookups[chain] = (start, lookup)
+                self.summary[chain] = (int(sum(1 for r in lookup if r is not None)), len(sequence), len(resids))
+
+        return lookups
@@ -0,0 +1,175 @@
+'''
+Threshold_plot.py
+
+A Qt widget used by the PyXlinkViewer PyMOL plugin dialog to plot the fraction of xlinks satisfied
+against the threshold distance, for all, intra-chain and inter-chain xlinks (see
+Xlink_sensitivity). The current threshold is drawn as a vertical line which follows the mouse when
+the plot is clicked or dragged, and a function is called with the threshold under the mouse when
+the button is released, so that a threshold can be picked from the curve.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import numpy as np
+from pymol.Qt import QtWidgets, QtGui, QtCore
+
+import Xlink_sensitivity
+
+
+# margins around the plot area for the axis labels
+MARGIN_LEFT = 50
+MARGIN_RIGHT = 15
+MARGIN_TOP = 15
+MARGIN_BOTTOM = 35
+
+
+class Threshold_plot(QtWidgets.QWidget):
+
+    def __init__(self, parent=None):
+
+        QtWidgets.QWidget.__init__(self, parent)
+
+        self.curve = None
+        self.threshold = 0.
+        self.max_dist = 1.
+
+        # function called with the picked threshold when the mouse button is released
+        self.on_pick = None
+
+        # colours of the all, intra and inter curves
+        self.colours = {'all': QtGui.QColor(0, 0, 0), 'intra': QtGui.QColor(0, 130, 0), 'inter': QtGui.QColor(200, 100, 0)}
+
+        self.setMinimumSize(400, 250)
+
+
+    def set_curve(self, curve):
+        '''
+        Sets the curve to plot, as returned by Xlink_sensitivity.sensitivity_curve
+        '''
+
+        self.curve = curve
+
+        longest = [curve[t]['distances'][-1] for t in Xlink_sensitivity.LINK_TYPES if curve[t]['total']]
+        self.max_dist = max(longest + [self.threshold, 1.]) * 1.05
+
+        self.update()
+
+
+    def set_threshold(self, threshold):
+        self.threshold = threshold
+        self.update()
+
+#------------------------------------------------------------------------------
+
+    def plot_rect(self):
+        return QtCore.QRectF(MARGIN_LEFT, MARGIN_TOP, self.width() - MARGIN_LEFT - MARGIN_RIGHT,
+                             self.height() - MARGIN_TOP - MARGIN_BOTTOM)
+
+
+    def to_screen(self, dist, fraction):
+        rect = self.plot_rect()
+
+        return QtCore.QPointF(rect.left() + rect.width() * dist / self.max_dist, rect.bottom() - rect.height() * fraction)
+
+
+    def to_threshold(self, x):
+        rect = self.plot_rect()
+
+        return min(max((x - rect.left()) / rect.width(), 0.), 1.) * self.max_dist
+
+
+    def paintEvent(self, event):
+
+        painter = QtGui.QPainter(self)
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        painter.fillRect(self.rect(), QtGui.QColor(255, 255, 255))
+
+        rect = self.plot_rect()
+        painter.setPen(QtGui.QPen(QtGui.QColor(0, 0, 0)))
+        painter.drawRect(rect)
+
+        # axis ticks and labels
+        for fraction in [0., 0.25, 0.5, 0.75, 1.]:
+            point = self.to_screen(0., fraction)
+            painter.drawText(QtCore.QRectF(0, point.y() - 8, MARGIN_LEFT - 5, 16), QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter,
+                             '{0:.2f}'.format(fraction))
+
+        step = 5. if self.max_dist <= 60 else 10. * int(self.max_dist / 60. + 1)
+        dist = 0.
+        while dist <= self.max_dist:
+            point = self.to_screen(dist, 0.)
+            painter.drawLine(point, QtCore.QPointF(point.x(), point.y() + 4))
+            painter.drawText(QtCore.QRectF(point.x() - 20, point.y() + 4, 40, 14), QtCore.Qt.AlignCenter, '{0:g}'.format(dist))
+            dist += step
+
+        painter.drawText(QtCore.QRectF(rect.left(), rect.bottom() + 18, rect.width(), 16), QtCore.Qt.AlignCenter,
+                         'Threshold (A)')
+
+        if self.curve is not None:
+
+            # draw each curve as steps through its sorted distances
+            for i, link_type in enumerate(Xlink_sensitivity.LINK_TYPES):
+
+                entry = self.curve[link_type]
+                if not entry['total']:
+                    continue
+
+                dists, fractions = Xlink_sensitivity.step_points(entry['distances'])
+
+                path = QtGui.QPainterPath(self.to_screen(0., 0.))
+                previous = 0.
+                for dist, fraction in zip(dists, fractions):
+                    path.lineTo(self.to_screen(dist, previous))
+                    path.lineTo(self.to_screen(dist, fraction))
+                    previous = fraction
+                path.lineTo(self.to_screen(self.max_dist, previous))
+
+                painter.setPen(QtGui.QPen(self.colours[link_type], 2 if link_type == 'all' else 1.5))
+                painter.drawPath(path)
+
+                # legend in the top left corner (where the curves are low), with the number satisfied at the
+                # current threshold
+                num_sat = int(np.searchsorted(entry['distances'], self.threshold, side='right'))
+                painter.drawText(QtCore.QPointF(rect.left() + 10, rect.top() + 18 + 15 * i),
+                                 '{0}: {1}/{2}'.format(link_type, num_sat, entry['total']))
+
+        # the current threshold
+        painter.setPen(QtGui.QPen(QtGui.QColor(200, 0, 0), 1, QtCore.Qt.DashLine))
+        x = self.to_screen(self.threshold, 0.).x()
+        painter.drawLine(QtCore.QPointF(x, rect.top()), QtCore.QPointF(x, rect.bottom()))
+
+        painter.end()
+
+
+    def mousePressEvent(self, event):
+        self.set_threshold(round(self.to_threshold(event.pos().x()), 1))
+
+
+    def mouseMoveEvent(self, event):
+        # only the line follows the mouse - the threshold is applied when the button is released
+        if event.buttons() & QtCore.Qt.LeftButton:
+            self.set_threshold(round(self.to_threshold(event.pos().x()), 1))
+
+
+    def mouseReleaseEvent(self, event):
+        self.set_threshold(round(self.to_threshold(event.pos().x()), 1))
+
+        if self.on_pick is not None:
+            self.on_pick(self.threshold)
@@ -0,0 +1,157 @@
+'''
+Ui_cache.py
+
+Loads the PyXlinkViewer dialog from its Qt Designer .ui file, keeping a compiled form of the file
+so that the XML is only parsed again when the .ui file changes.
+
+The first time the dialog is opened the .ui file is translated to Python with the uic module of
+the Qt binding PyMOL is using, and the compiled code object is saved in the __pycache__
+directory next to the .ui file, stamped with the size and modification time of the .ui file.
+Later the code object is read back and run directly. The cache is kept per Qt binding and Python
+version. If the binding has no uic module (e.g. PySide) or the cache can't be used, the .ui file
+is loaded with pymol.Qt.utils.loadUi as before.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import importlib
+import io
+import marshal
+import os
+import struct
+import sys
+
+
+# changed if the format of the cache files changes
+CACHE_VERSION = 1
+
+STAMP_FORMAT = '<Iqq'
+
+
+def cache_filename(uifile, binding):
+    '''
+    Returns the name of the file the compiled form of a .ui file is cached in for a Qt binding
+    '''
+
+    name = os.path.splitext(os.path.basename(uifile))[0]
+
+    return os.path.join(os.path.dirname(uifile), '__pycache__',
+                        '{0}_ui.{1}.{2}.bin'.format(name, binding, sys.implementation.cache_tag))
+
+
+def ui_stamp(uifile):
+    '''
+    Returns the stamp a cache file must have to be used - the cache version and the .ui file's size and
+    modification time
+    '''
+
+    info = os.stat(uifile)
+
+    return struct.pack(STAMP_FORMAT, CACHE_VERSION, info.st_size, int(info.st_mtime))
+
+
+def read_cache(filename, stamp):
+    '''
+    Returns the code object in a cache file, or None if there is no cache file or it is out of date
+    '''
+
+    try:
+        with open(filename, 'rb') as f:
+            if f.read(len(stamp)) != stamp:
+                return None
+
+            return marshal.load(f)
+
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+
+
+def write_cache(filename, stamp, code):
+    '''
+    Saves a code object in a cache file. The file is written under a temporary name and then renamed, so a
+    partly written file is never read
+    '''
+
+    try:
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+
+        temp_filename = '{0}.{1}.tmp'.format(filename, os.getpid())
+        with open(temp_filename, 'wb') as f:
+            f.write(stamp)
+            marshal.dump(code, f)
+
+        os.replace(temp_filename, filename)
+
+    except (IOError, OSError):
+        # e.g. the plugin directory is read-only - the .ui file will be compiled each time
+        pass
+
+
+def compile_ui(uifile, uic):
+    '''
+    Translates a .ui file to Python with a uic module, and returns the compiled code
+    '''
+
+    source = io.StringIO()
+
+    with open(uifile) as f:
+        uic.compileUi(f, source)
+
+    return compile(source.getvalue(), uifile, 'exec')
+
+
+def load_ui(uifile, widget):
+    '''
+    Creates the widgets of a .ui file in a widget, and returns an object with the widgets as attributes
+    '''
+
+    import pymol.Qt
+
+    binding = getattr(pymol.Qt, 'PYQT_NAME', None) or ''
+
+    try:
+        uic = importlib.import_module(binding + '.uic') if binding.startswith('PyQt') else None
+    except ImportError:
+        uic = None
+
+    if uic is None:
+        from pymol.Qt.utils import loadUi
+        return loadUi(uifile, widget)
+
+    filename = cache_filename(uifile, binding)
+    stamp = ui_stamp(uifile)
+
+    code = read_cache(filename, stamp)
+
+    if code is None:
+        code = compile_ui(uifile, uic)
+        write_cache(filename, stamp, code)
+
+    # the compiled code defines a single Ui_<name> class which creates the widgets
+    namespace = {}
+    exec(code, namespace)
+
+    ui_class = [value for name, value in namespace.items() if name.startswith('Ui_')][0]
+
+    form = ui_class()
+    form.setupUi(widget)
+
+    return form
@@ -0,0 +1,542 @@
+'''
+Xlink_columns.py
+
+Functions and a class used by the PyXlinkViewer PyMOL plugin to hold very large xlink datasets
+(e.g. a million xlinks) as columns of NumPy arrays rather than as an Obs_xlink object per xlink,
+when the viewer is given a memory budget.
+
+Each xlink end is stored as an integer code into a list of the distinct (chain, resid) residue
+keys, so an xlink takes a few tens of bytes whatever its residue names. Only ambiguous xlinks keep
+their lists of candidate sites. The file is read, the ambiguous sites resolved, the distances
+calculated and the xlinks drawn a chunk at a time, with the size of the chunks set from the memory
+budget, so that the temporary objects of only one chunk exist at once.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import sys
+
+import numpy as np
+
+from Obs_xlink import Obs_xlink
+from Obs_mono import Obs_mono
+from BJwalk_file_reader import parse_end, parse_value
+from Xlink_index import resid_number
+import Xlink_confidence
+import Xlink_geometry
+
+
+# rough number of bytes used by each xlink of a chunk while it is processed - the temporary Obs_xlink objects made to
+# resolve ambiguous sites, the coordinates of the ends and the CGO list of the chunk
+BYTES_PER_CHUNK_ROW = 4096
+
+# fraction of the memory budget a chunk may use, leaving the rest for the columns, the coordinate index and PyMOL
+CHUNK_FRACTION = 0.25
+
+MIN_CHUNK_ROWS = 1000
+
+# chunk size used without a memory budget
+DEFAULT_CHUNK_ROWS = 10000
+
+# the arrays with a value per xlink
+COLUMN_NAMES = ['reported1', 'reported2', 'site1', 'site2', 'distance', 'found1', 'found2', 'interface', 'sigma',
+                'probability']
+
+
+def chunk_rows(budget_mb):
+    '''
+    Returns the number of xlinks processed at a time within a memory budget in MB
+    '''
+
+    return max(MIN_CHUNK_ROWS, int(budget_mb * 2 ** 20 * CHUNK_FRACTION) // BYTES_PER_CHUNK_ROW)
+
+
+def peak_memory():
+    '''
+    Returns the peak resident memory of the process in bytes, or None if it isn't available (e.g. on Windows, which
+    doesn't have the resource module)
+    '''
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def chunks(num, size):
+    '''
+    Generator of slices covering range(num) in steps of size
+    '''
+
+    for start in range(0, num, size):
+        yield slice(start, min(start + size, num))
+
+
+#------------------------------------------------------------------------------------
+
+def read_jwalk(filename, chunk_size=10000):
+    '''
+    Reads a jwalk style xlink file (see BJwalk_file_reader) into columns, a chunk of lines at a time, and returns the
+    columns and the list of mono-links. Duplicate xlinks and mono-links are removed as by BJwalk_file_reader. Any
+    quantitative columns are not kept
+    '''
+
+    columns = Xlink_columns()
+    monos = []
+    mono_keys = set()
+
+    # codes of the first reported site of each end of the xlinks read so far, as arrays for the complete chunks and
+    # lists for the current one
+    done1 = []
+    done2 = []
+    codes1 = []
+    codes2 = []
+    num_done = 0
+
+    with open(filename, 'r') as f:
+
+        for line_num, line in enumerate(f, 1):
+
+            line = line.strip()
+
+            if not line:
+                continue
+
+            data = [x.strip() for x in line.split('|')]
+
+            # remove the empty field after a trailing separator, so that the number of fields tells the line types apart
+            if len(data) > 2 and data[-1] == '':
+                data.pop()
+
+            if len(data) == 3 or len(data) == 2:
+
+                site = parse_end(data[0], data[1], line_num, filename)[0]
+
+                if site not in mono_keys:
+                    mono_keys.add(site)
+
+                    mono = Obs_mono()
+                    mono.chain, mono.resid = site
+                    if len(data) == 3:
+                        mono.value = parse_value(data[2])
+                    mono.obj_name = mono.chain + '_' + mono.resid
+                    monos.append(mono)
+
+            elif len(data) >= 4:
+
+                sites1 = parse_end(data[0], data[1], line_num, filename)
+                sites2 = parse_end(data[2], data[3], line_num, filename)
+
+                codes1.append(columns.key_code(sites1[0]))
+                codes2.append(columns.key_code(sites2[0]))
+
+                if len(sites1) > 1 or len(sites2) > 1:
+                    columns.candidates[num_done + len(codes1) - 1] = (sites1, sites2)
+
+                if len(codes1) == chunk_size:
+                    done1.append(np.array(codes1, dtype=np.int32))
+                    done2.append(np.array(codes2, dtype=np.int32))
+                    num_done += len(codes1)
+                    codes1 = []
+                    codes2 = []
+
+            else:
+                raise ValueError('Line {0} of {1} is not an xlink or a mono-link'.format(line_num, filename))
+
+    columns.set_ends(np.concatenate(done1 + [np.array(codes1, dtype=np.int32)]),
+                     np.concatenate(done2 + [np.array(codes2, dtype=np.int32)]))
+    columns.remove_duplicates()
+
+    return columns, monos
+
+
+class Xlink_columns():
+
+    def __init__(self):
+
+        # distinct (chain, resid) residue keys, and key -> position in the list
+        self.keys = []
+        self.key_codes = {}
+
+        # key codes of the first reported site of each end of each xlink, and of the sites chosen when the ambiguous
+        # xlinks were resolved (see resolve)
+        self.reported1 = np.zeros(0, dtype=np.int32)
+        self.reported2 = np.zeros(0, dtype=np.int32)
+        self.site1 = np.zeros(0, dtype=np.int32)
+        self.site2 = np.zeros(0, dtype=np.int32)
+
+        # row -> (sites1, sites2) lists of the candidate sites of the xlinks with more than one reported site
+        self.candidates = {}
+
+        # distance of each xlink (0 if a residue is missing), whether each residue was found in the PyMOL object, and
+        # the interface level (an index of Interface_index.INTERFACE_LABELS, -1 for none) of each xlink
+        self.distance = np.zeros(0, dtype=np.float32)
+        self.found1 = np.zeros(0, dtype=bool)
+        self.found2 = np.zeros(0, dtype=bool)
+        self.interface = np.zeros(0, dtype=np.int8)
+
+        # standard deviation of each distance from the uncertainty of the coordinates, and the probability that each
+        # xlink is satisfied (NaN unless an uncertainty mode is set - see Xlink_confidence)
+        self.sigma = np.zeros(0, dtype=np.float32)
+        self.probability = np.zeros(0, dtype=np.float32)
+
+        # (number of keys, chain names, chain number of each key, residue number of each key) - see key_arrays
+        self.key_cache = None
+
+        # (coordinate array, distance mode, points, found) of the points of the keys the distances were last
+        # calculated from - see key_points
+        self.points = None
+
+
+    def __len__(self):
+        return len(self.site1)
+
+
+    def key_code(self, key):
+        '''
+        Returns the code of a (chain, resid) key, adding it to the keys if it is new
+        '''
+
+        code = self.key_codes.get(key)
+
+        if code is None:
+            code = len(self.keys)
+            self.key_codes[key] = code
+            self.keys.append(key)
+
+        return code
+
+
+    def set_ends(self, reported1, reported2):
+        '''
+        Sets the key codes of the reported sites of the xlinks, which are also taken as the chosen sites until the
+        xlinks are resolved, and clears the distances
+        '''
+
+        n = len(reported1)
+
+        self.reported1 = np.asarray(reported1, dtype=np.int32)
+        self.reported2 = np.asarray(reported2, dtype=np.int32)
+        self.site1 = self.reported1.copy()
+        self.site2 = self.reported2.copy()
+
+        self.distance = np.zeros(n, dtype=np.float32)
+        self.found1 = np.ones(n, dtype=bool)
+        self.found2 = np.ones(n, dtype=bool)
+        self.interface = np.full(n, -1, dtype=np.int8)
+        self.sigma = np.zeros(n, dtype=np.float32)
+        self.probability = np.full(n, np.nan, dtype=np.float32)
+
+
+    def take(self, rows=None):
+        '''
+        Returns a copy of the columns of some rows. If rows is None the columns of all of the rows are shared as
+        read-only views instead, so that a snapshot of every xlink doesn't double the memory used. The keys are
+        shared, as they are only ever added to
+        '''
+
+        columns = Xlink_columns()
+        columns.keys = self.keys
+        columns.key_codes = self.key_codes
+
+        if rows is None:
+            for name in COLUMN_NAMES:
+                view = getattr(self, name).view()
+                view.setflags(write=False)
+                setattr(columns, name, view)
+
+            columns.candidates = self.candidates
+            columns.key_cache = self.key_cache
+            return columns
+
+        rows = np.asarray(rows, dtype=int)
+
+        for name in COLUMN_NAMES:
+            setattr(columns, name, getattr(self, name)[rows])
+
+        # the candidate rows are renumbered by their positions in rows
+        if self.candidates:
+            for new_row in np.flatnonzero(np.isin(rows, list(self.candidates))):
+                columns.candidates[int(new_row)] = self.candidates[int(rows[new_row])]
+
+        return columns
+
+
+    def remove_duplicates(self):
+        '''
+        Removes the xlinks which have the same reported sites as an earlier xlink
+        '''
+
+        num_keys = np.int64(len(self.keys))
+        pairs = self.reported1.astype(np.int64) * num_keys + self.reported2
+
+        # xlinks with candidate sites are told apart by their lists of candidates, numbered after the largest pair
+        numbers = {}
+        for row in sorted(self.candidates):
+            sites1, sites2 = self.candidates[row]
+            pairs[row] = num_keys * num_keys + numbers.setdefault((tuple(sites1), tuple(sites2)), len(numbers))
+
+        first = np.sort(np.unique(pairs, return_index=True)[1])
+
+        if len(first) < len(self):
+            columns = self.take(first)
+            self.__dict__.update(columns.__dict__)
+
+
+    def nbytes(self):
+        '''
+        Returns the approximate number of bytes held by the columns
+        '''
+
+        arrays = [getattr(self, name) for name in COLUMN_NAMES]
+
+        # each key is a tuple of two short strings and a dictionary entry, roughly 250 bytes
+        return sum(a.nbytes for a in arrays) + 250 * len(self.keys) + 1000 * len(self.candidates)
+
+#------------------------------------------------------------------------------------
+
+    def key_arrays(self):
+        '''
+        Returns the sorted list of chain names, and arrays of the chain number and residue number (NaN if it isn't a
+        number) of each key. They are only found again when keys have been added
+        '''
+
+        if self.key_cache is None or self.key_cache[0] != len(self.keys):
+
+            chains = sorted(set(chain for chain, resid in self.keys))
+            chain_numbers = dict((chain, i) for i, chain in enumerate(chains))
+
+            key_chains = np.array([chain_numbers[chain] for chain, resid in self.keys], dtype=np.int32)
+            numbers = [resid_number(resid) for chain, resid in self.keys]
+            key_numbers = np.array([np.nan if num is None else num for num in numbers], dtype=float)
+
+            self.key_cache = (len(self.keys), chains, key_chains, key_numbers)
+
+        return self.key_cache[1:]
+
+
+    def is_inter(self):
+        '''
+        Returns a boolean array of whether each xlink is between different chains
+        '''
+
+        chains, key_chains, key_numbers = self.key_arrays()
+
+        return key_chains[self.site1] != key_chains[self.site2]
+
+
+    def ends(self, row):
+        '''
+        Returns the (chain, resid) keys of the chosen sites of the ends of an xlink
+        '''
+
+        return self.keys[self.site1[row]], self.keys[self.site2[row]]
+
+
+    def reported_sites(self, row):
+        '''
+        Returns the lists of reported (chain, resid) sites of each end of an xlink
+        '''
+
+        if row in self.candidates:
+            return self.candidates[row]
+
+        return [self.keys[self.reported1[row]]], [self.keys[self.reported2[row]]]
+
+
+    def obj_name(self, row):
+        '''
+        Returns the name an xlink is given by BJwalk_file_reader, with the candidate chains and residues separated by dots
+        '''
+
+        if row not in self.candidates:
+            return '{0}_{1}-{2}_{3}'.format(*(self.keys[self.reported1[row]] + self.keys[self.reported2[row]]))
+
+        names = []
+        for sites in self.candidates[row]:
+            chains = sorted(set(chain for chain, resid in sites), key=[chain for chain, resid in sites].index)
+            resids = sorted(set(resid for chain, resid in sites), key=[resid for chain, resid in sites].index)
+            names.append('.'.join(chains) + '_' + '.'.join(resids))
+
+        return '-'.join(names)
+
+
+    def query(self, chain1=None, resid_range1=None, chain2=None, resid_range2=None, dist_range=None):
+        '''
+        Returns an array of the rows of the xlinks matching all of the given predicates, as Xlink_index.query. An xlink
+        matches the chain/residue range predicates in either orientation. Residue and distance ranges are inclusive
+        '''
+
+        chains, key_chains, key_numbers = self.key_arrays()
+
+        def end_matches(sites, chain, resid_range):
+            match = np.ones(len(sites), dtype=bool)
+
+            if chain is not None:
+                match &= key_chains[sites] == (chains.index(chain) if chain in chains else -1)
+
+            if resid_range is not None:
+                numbers = key_numbers[sites]
+                match &= (numbers >= resid_range[0]) & (numbers <= resid_range[1])
+
+            return match
+
+        match = ((end_matches(self.site1, chain1, resid_range1) & end_matches(self.site2, chain2, resid_range2)) |
+                 (end_matches(self.site2, chain1, resid_range1) & end_matches(self.site1, chain2, resid_range2)))
+
+        if dist_range is not None:
+            distance = self.distance.astype(float)
+            match &= (distance >= dist_range[0]) & (distance <= dist_range[1])
+
+        return np.flatnonzero(match)
+
+#------------------------------------------------------------------------------------
+
+    def xlinks(self, rows):
+        '''
+        Returns a list of temporary Obs_xlink objects for some rows, with their reported sites, e.g. to be resolved
+        by BXlink_viewer.resolve_ambiguous_xlinks
+        '''
+
+        xlinks = []
+
+        for row in rows:
+            xl = Obs_xlink()
+            xl.sites1, xl.sites2 = self.reported_sites(int(row))
+            (xl.chain1, xl.resid1), (xl.chain2, xl.resid2) = xl.sites1[0], xl.sites2[0]
+            xlinks.append(xl)
+
+        return xlinks
+
+
+    def resolve(self, resolve_xlinks, bAll=False, chunk_size=10000):
+        '''
+        Chooses the sites of the xlinks with candidate sites with a function which resolves a list of Obs_xlink objects
+        (see BXlink_viewer.resolve_ambiguous_xlinks), a chunk at a time. If bAll is set every xlink is resolved, e.g.
+        when chains are equivalent, otherwise only those with more than one reported site
+        '''
+
+        self.site1 = self.reported1.copy()
+        self.site2 = self.reported2.copy()
+
+        rows = np.arange(len(self)) if bAll else np.array(sorted(self.candidates), dtype=int)
+
+        for chunk in chunks(len(rows), chunk_size):
+
+            xlinks = self.xlinks(rows[chunk])
+            resolve_xlinks(xlinks)
+
+            self.site1[rows[chunk]] = [self.key_code((xl.chain1, xl.resid1)) for xl in xlinks]
+            self.site2[rows[chunk]] = [self.key_code((xl.chain2, xl.resid2)) for xl in xlinks]
+
+
+    def key_points(self, index, mode):
+        '''
+        Returns the point used to represent each key in a distance mode (see Coord_index.get_points), and whether it
+        was found. The points are kept until the keys, the coordinates or the mode change
+        '''
+
+        if self.points is None or self.points[0] is not index.xyz or self.points[1] != mode or len(self.points[3]) != len(self.keys):
+            xyz, found = index.get_points(self.keys, mode)
+            self.points = (index.xyz, mode, xyz, found)
+
+        return self.points[2], self.points[3]
+
+
+    def end_points(self, index, mode, rows):
+        '''
+        Returns the points between which the distances of some rows are measured in a distance mode, and whether each
+        residue was found (see Coord_index.get_end_points). Apart from the 'closest' mode, which depends on both
+        residues, the points are looked up from those of the keys
+        '''
+
+        site1 = self.site1[rows]
+        site2 = self.site2[rows]
+
+        if mode == 'closest':
+            return index.closest_atoms([self.keys[code] for code in site1], [self.keys[code] for code in site2])
+
+        xyz, found = self.key_points(index, mode)
+
+        return xyz[site1], xyz[site2], found[site1], found[site2]
+
+
+    def calculate_distances(self, index, mode, chunk_size=10000):
+        '''
+        Calculates the distances of all of the xlinks from a coordinate index, a chunk at a time
+        '''
+
+        self.points = None
+
+        for chunk in chunks(len(self), chunk_size):
+
+            xyz1, xyz2, found1, found2 = self.end_points(index, mode, chunk)
+            dists = Xlink_geometry.distances(xyz1, xyz2)
+
+            # xlinks with at least one residue missing in the structure have no distance
+            self.distance[chunk] = np.where(found1 & found2, dists, 0.)
+            self.found1[chunk] = found1
+            self.found2[chunk] = found2
+
+
+    def label_interfaces(self, interface_index, index, chunk_size=10000):
+        '''
+        Sets the interface level of each xlink from an interface index built for a coordinate index (see
+        Interface_index.pair_levels)
+        '''
+
+        res_rows = index.residue_rows(self.keys)
+        res_chains = np.array([interface_index.chain_codes.get(chain, -1) for chain, resid in self.keys], dtype=np.int64)
+
+        for chunk in chunks(len(self), chunk_size):
+            site1 = self.site1[chunk]
+            site2 = self.site2[chunk]
+            self.interface[chunk] = interface_index.pair_levels(res_rows[site1], res_chains[site1], res_rows[site2], res_chains[site2])
+
+
+    def calculate_uncertainties(self, index, distance_mode, uncertainty_mode, chunk_size=10000):
+        '''
+        Sets the standard deviation of each distance from the B-factor column values of the points of its residues (see
+        Xlink_confidence.distance_error). The values are looked up once for each key
+        '''
+
+        b = index.get_b_factors(self.keys, distance_mode)
+
+        for chunk in chunks(len(self), chunk_size):
+            self.sigma[chunk] = Xlink_confidence.distance_error(b[self.site1[chunk]], b[self.site2[chunk]], uncertainty_mode)
+
+
+    def calculate_probabilities(self, threshold, chunk_size=10000):
+        '''
+        Sets the probability that each xlink is satisfied at a threshold, a chunk at a time
+        '''
+
+        for chunk in chunks(len(self), chunk_size):
+            self.probability[chunk] = Xlink_confidence.satisfaction_probability(self.distance[chunk], self.sigma[chunk], threshold)
+
+
+    def clear_probabilities(self):
+        self.sigma[:] = 0
+        self.probability[:] = np.nan
@@ -0,0 +1,512 @@
+'''
+Xlink_commands.py
+
+PyMOL commands used to drive the PyXlinkViewer plugin's viewer from the PyMOL command line or
+.pml scripts, without opening the dialog. Each command works on the whole set of xlinks at once
+through the BXlink_viewer and Xlink_controller, e.g.:
+
+   PyMOL>xlink_load my_xlinks.txt, my_obj
+   PyMOL>xlink_threshold 30
+   PyMOL>xlink_filter violated=0, intra=0, query=A B
+   PyMOL>xlink_stats
+   PyMOL>xlink_export my_table.csv
+   PyMOL>xlink_sensitivity curves.csv, model_*
+   PyMOL>xlink_sequence uniprot.fasta
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import os
+
+from pymol import cmd, CmdException
+
+# NB. the viewer modules (and so NumPy) are imported by the commands when they are first used rather than here, as
+# the commands are registered when PyMOL starts
+
+
+def parse_bool(value):
+    '''
+    Converts a command argument such as 1, 0, on, off, true or false to a boolean
+    '''
+
+    text = str(value).strip().lower()
+
+    if text in ('1', 'on', 'true', 'yes'):
+        return True
+    if text in ('0', 'off', 'false', 'no'):
+        return False
+
+    raise CmdException('Invalid boolean value: ' + str(value))
+
+
+def register_commands(get_viewer, on_change=None):
+    '''
+    Adds the xlink commands to PyMOL. get_viewer is a function returning the viewer, and on_change an optional
+    function called after a command changes the viewer (e.g. to update the dialog)
+    '''
+
+    def changed():
+        if on_change is not None:
+            on_change()
+
+
+    def xlink_load(filename, obj='', distance_mode='', quiet=1, compare='', _self=cmd):
+        '''
+DESCRIPTION
+
+    Loads an xlink file (jwalk format, or a store saved with xlink_export) and draws the xlinks on an object.
+    compare is a list of further xlink files separated by semicolons, which are loaded with the first file as the
+    conditions of a comparison. An object or distance mode given with a store replaces the one it was saved with.
+
+USAGE
+
+    xlink_load filename [, obj [, distance_mode [, quiet [, compare ]]]]
+        '''
+
+        import Xlink_controller
+        import Xlink_store
+        from Coord_index import DISTANCE_MODES
+
+        viewer = get_viewer()
+        files = [filename] + [f.strip() for f in compare.split(';') if f.strip()]
+
+        if distance_mode and distance_mode not in DISTANCE_MODES:
+            raise CmdException('Unknown distance mode: ' + distance_mode)
+
+        viewer.delete_objects()
+
+        # a store restores the object and distance mode it was saved with, so any given are applied after it is read
+        if len(files) == 1 and Xlink_store.is_store(filename):
+            viewer.load_store(filename, obj, distance_mode)
+            snap = Xlink_controller.snapshot(viewer)
+        else:
+            # the first molecular object is used by default - not e.g. the CGOs of xlinks drawn earlier
+            if not (obj or viewer.obj):
+                objects = _self.get_object_list()
+                if not objects:
+                    raise CmdException('No object to draw the xlinks on')
+                obj = objects[0]
+
+            viewer.set_obj(obj or viewer.obj)
+
+            if distance_mode:
+                viewer.set_distance_mode(distance_mode)
+
+            try:
+                if len(files) > 1:
+                    viewer.set_xlink_file_type('jwalk')
+                    viewer.parse_comparison_files(files)
+                    snap = Xlink_controller.compute(viewer)
+                else:
+                    snap = Xlink_controller.load(viewer, filename, 'jwalk')
+            except ValueError as e:
+                # the xlinks already loaded are drawn again
+                viewer.update()
+                raise CmdException(str(e))
+
+            viewer.update()
+
+        changed()
+
+        if not int(quiet):
+            print(' xlink_load: {0} xlinks and {1} mono-links loaded on {2}'.format(viewer.num_xlinks(), len(viewer.obs_monos), viewer.obj))
+
+        return snap
+
+
+    def xlink_threshold(distance, _self=cmd):
+        '''
+DESCRIPTION
+
+    Sets the threshold distance below which xlinks are satisfied, and redraws the xlinks.
+
+USAGE
+
+    xlink_threshold distance
+        '''
+
+        viewer = get_viewer()
+        viewer.set_threshold(float(distance))
+        viewer.update()
+        changed()
+
+
+    def xlink_filter(satisfied='', violated='', inter='', intra='', mono='', query=None, interface='', _self=cmd):
+        '''
+DESCRIPTION
+
+    Sets which xlinks are shown, and redraws them. Arguments which aren't given are left unchanged. The query
+    restricts the xlinks to chains and residue and distance ranges, e.g. 'A:100-300 B dist:0-30'. An empty query
+    shows all xlinks. interface restricts the inter-chain xlinks to those whose residues are at the 'interface'
+    between their chains, 'near-interface' or 'distal', or 'all'.
+
+USAGE
+
+    xlink_filter [ satisfied [, violated [, inter [, intra [, mono [, query [, interface ]]]]]]]
+        '''
+
+        viewer = get_viewer()
+
+        if interface:
+            try:
+                viewer.set_interface_filter(interface)
+            except ValueError as e:
+                raise CmdException(str(e))
+
+        for value, setter in [(satisfied, viewer.set_show_satisfied), (violated, viewer.set_show_violated),
+                              (inter, viewer.set_show_inter), (intra, viewer.set_show_intra), (mono, viewer.set_show_mono)]:
+            if value != '':
+                setter(parse_bool(value))
+
+        if query is not None:
+            try:
+                viewer.set_query(query)
+            except ValueError as e:
+                raise CmdException(str(e))
+
+        viewer.update()
+        changed()
+
+
+    def xlink_export(filename, comparison=0, _self=cmd):
+        '''
+DESCRIPTION
+
+    Saves the xlinks. A .npz file saves the viewer state (as load_state), a file with the store extension saves a
+    binary store which can be loaded with xlink_load, and any other file saves the xlink table in csv format. If
+    comparison is set, the xlinks of the comparison are saved in csv format instead, with their intensities in each
+    condition and their fold-changes.
+
+USAGE
+
+    xlink_export filename [, comparison ]
+        '''
+
+        import Xlink_controller
+        import Xlink_store
+
+        viewer = get_viewer()
+        ext = os.path.splitext(filename)[1].lower()
+
+        if parse_bool(comparison):
+            if viewer.comparison is None:
+                raise CmdException('No conditions are being compared')
+            viewer.comparison.export(filename)
+        elif ext == '.npz':
+            viewer.save_state(filename)
+        elif ext == Xlink_store.STORE_EXTENSION:
+            viewer.save_store(filename)
+        else:
+            Xlink_controller.export(Xlink_controller.snapshot(viewer), filename, Xlink_controller.options_from_viewer(viewer))
+
+        print(' xlink_export: saved ' + filename)
+
+
+    def xlink_stats(quiet=0, _self=cmd):
+        '''
+DESCRIPTION
+
+    Prints the numbers of satisfied and violated xlinks shown, and the restraint score, and returns them as a
+    dictionary.
+
+USAGE
+
+    xlink_stats
+        '''
+
+        import Xlink_controller
+
+        viewer = get_viewer()
+        snap = Xlink_controller.snapshot(viewer)
+        num_sat, num_viol = Xlink_controller.count(snap, Xlink_controller.options_from_viewer(viewer))
+
+        import Xlink_columns
+
+        peak = Xlink_columns.peak_memory()
+
+        stats = {
+            'obj': viewer.obj,
+            'threshold': viewer.threshold,
+            'distance_mode': viewer.distance_mode,
+            'num_xlinks': len(snap.links),
+            'num_monos': len(snap.monos),
+            'num_satisfied': num_sat,
+            'num_violated': num_viol,
+            'score': Xlink_controller.score(snap),
+            'peak_memory_mb': None if peak is None else peak / 2. ** 20,
+        }
+
+        if not int(quiet):
+            print(' xlink_stats: {num_xlinks} xlinks on {obj}, {num_satisfied} satisfied and {num_violated} violated at '
+                  '{threshold} A ({distance_mode}), restraint score {score:.1f}'.format(**stats))
+
+        return stats
+
+
+    def xlink_sensitivity(filename, objects='', step=1.0, quiet=0, _self=cmd):
+        '''
+DESCRIPTION
+
+    Saves the numbers and fractions of all, intra-chain and inter-chain xlinks satisfied at every threshold from zero
+    to the longest distance, in csv format. If objects are given, the current xlink file is loaded against each of
+    them with the current settings (e.g. to compare alternative models), otherwise the current xlinks are used.
+
+USAGE
+
+    xlink_sensitivity filename [, objects [, step ]]
+        '''
+
+        import Xlink_controller
+
+        viewer = get_viewer()
+
+        if objects:
+            if not viewer.xlink_file:
+                raise CmdException('No xlink file has been loaded')
+
+            settings = {'threshold': viewer.threshold, 'distance_mode': viewer.distance_mode,
+                        'chain_equivalence': list(viewer.chain_equivalence.values())}
+
+            objs = _self.get_object_list('(' + objects + ')')
+            snaps = Xlink_controller.process_models(objs, viewer.xlink_file, settings, viewer.xlink_file_type)
+        else:
+            snaps = [Xlink_controller.snapshot(viewer)]
+
+        Xlink_controller.export_sensitivity(snaps, filename, step=float(step))
+
+        if not int(quiet):
+            print(' xlink_sensitivity: saved curves of {0} model(s) to {1}'.format(len(snaps), filename))
+
+        return snaps
+
+
+    def xlink_sequence(filename='', quiet=0, _self=cmd):
+        '''
+DESCRIPTION
+
+    Loads the reference sequences (FASTA) the xlink residue numbers are given against, and maps the residues to the
+    numbering of the structure by aligning the sequences to its chains. The first word of each sequence header is
+    its chain (or comma separated chains), and a file with one sequence is used for every chain. Without a filename
+    the structure's own numbering is used again.
+
+USAGE
+
+    xlink_sequence [ filename ]
+        '''
+
+        viewer = get_viewer()
+
+        if filename:
+            viewer.load_sequence_file(filename)
+        else:
+            viewer.set_reference_sequences({})
+
+        if viewer.num_xlinks() or viewer.obs_monos:
+            viewer.calculate_distances()
+            viewer.test_monos_in_obj()
+            viewer.build_network()
+            viewer.update()
+
+        changed()
+
+        if not int(quiet):
+            for line in viewer.residue_mapping_report() or ['No residues need mapping']:
+                print(' xlink_sequence: ' + line)
+
+
+    def xlink_missing(filename='', quiet=0, _self=cmd):
+        '''
+DESCRIPTION
+
+    Prints the summary of the xlinks and mono-links which can't be displayed because their residues aren't found in
+    the object, per chain. If a filename is given the residues are also saved in csv format.
+
+USAGE
+
+    xlink_missing [ filename ]
+        '''
+
+        viewer = get_viewer()
+
+        if filename:
+            viewer.export_missing_residues(filename)
+
+        if not int(quiet):
+            lines = viewer.missing_residues.report() + viewer.missing_residues.report(bMonos=True)
+            for line in lines or ['All xlinks and mono-links were found in ' + viewer.obj]:
+                print(' xlink_missing: ' + line)
+
+            if filename:
+                print(' xlink_missing: saved the residues to ' + filename)
+
+        return viewer.missing_residues
+
+
+    def xlink_memory(budget='', quiet=0, _self=cmd):
+        '''
+DESCRIPTION
+
+    Sets the memory budget in MB for the next xlink file loaded, and prints the memory used. With a budget the xlinks
+    are held as columns of arrays rather than an object each, and are read, measured and drawn a chunk at a time,
+    e.g. to load a million xlinks. A budget of 0 keeps an object per xlink. Without a budget the setting is unchanged.
+
+USAGE
+
+    xlink_memory [ budget ]
+        '''
+
+        viewer = get_viewer()
+
+        if budget != '':
+            try:
+                viewer.set_memory_budget(int(budget))
+            except ValueError:
+                raise CmdException('Invalid memory budget: ' + str(budget))
+
+            changed()
+
+        lines = viewer.memory_report()
+
+        if not int(quiet):
+            for line in lines:
+                print(' xlink_memory: ' + line)
+
+        return lines
+
+
+    def xlink_uncertainty(mode='', min_confidence='', quiet=0, _self=cmd):
+        '''
+DESCRIPTION
+
+    Sets what the B-factor column of the object holds - 'bfactor' (crystallographic B-factors) or 'plddt' (the
+    pLDDT scores of a predicted model) - so that each distance is given an uncertainty and each xlink a probability of
+    being satisfied, or 'off' to treat the coordinates as exact. Xlinks are faded towards grey as the confidence in
+    their satisfied or violated call falls, and those called with less than min_confidence (0.5 to 1) are hidden.
+    Arguments which aren't given are left unchanged.
+
+USAGE
+
+    xlink_uncertainty [ mode [, min_confidence ]]
+        '''
+
+        viewer = get_viewer()
+
+        try:
+            if min_confidence != '':
+                viewer.set_min_confidence(float(min_confidence))
+
+            if mode:
+                viewer.set_uncertainty_mode(mode)
+        except ValueError as e:
+            raise CmdException(str(e))
+
+        # the uncertainties only change with the mode - the probabilities are kept up to date by the threshold
+        if mode and viewer.num_xlinks():
+            viewer.calculate_uncertainties()
+
+        viewer.update()
+        changed()
+
+        lines = viewer.uncertainty_report()
+
+        if not int(quiet):
+            for line in lines:
+                print(' xlink_uncertainty: ' + line)
+
+        return lines
+
+
+    def xlink_render(directory, thresholds='', filters='', views='', objects='', grid='', width=1200, height=900,
+                     dpi=300, ray=1, workers=4, python='', quiet=0, _self=cmd):
+        '''
+DESCRIPTION
+
+    Ray-traces an image of the xlinks for every combination of objects, views, thresholds and filters, split between
+    several headless PyMOL processes, and saves the images to a directory with a manifest.csv of the settings of
+    each. Views are scene names or 'current', and a filter is a '+' separated list of the links shown, e.g.
+    'violated+inter', 'all' or 'all+mono'. Lists are separated by spaces, and arguments which aren't given use the
+    current settings. The combinations can instead be listed in a csv grid file with Model, View, Threshold and
+    Filter columns. python is the Python (with PyMOL) the workers are run with, by default PyMOL's own.
+
+USAGE
+
+    xlink_render directory [, thresholds [, filters [, views [, objects [, grid [, width [, height [, dpi [, ray [, workers [, python ]]]]]]]]]]]
+
+EXAMPLE
+
+    xlink_render figures, 25 30 35, all violated+inter, front side
+        '''
+
+        import Xlink_controller
+        import Xlink_render
+
+        viewer = get_viewer()
+
+        if not (viewer.num_xlinks() or viewer.obs_monos):
+            raise CmdException('No xlink file has been loaded')
+
+        # the frames are drawn from the Obs_xlink objects of each worker's viewer
+        if viewer.columns is not None:
+            raise CmdException('Batch rendering needs the xlinks in full - set xlink_memory 0 and load the file again')
+
+        current_filter = Xlink_render.filter_spec(Xlink_controller.options_from_viewer(viewer))
+
+        try:
+            thresholds = [float(t) for t in thresholds.split()] or [viewer.threshold]
+        except ValueError:
+            raise CmdException('Invalid thresholds: ' + thresholds)
+
+        objs = _self.get_object_list('(' + objects + ')') if objects else [viewer.obj]
+
+        if grid:
+            defaults = (viewer.obj, 'current', viewer.threshold, current_filter)
+            combos = [tuple(default if value is None else value for value, default in zip(combo, defaults))
+                      for combo in Xlink_render.read_grid(grid)]
+        else:
+            combos = Xlink_render.grid_product(objs, views.split() or ['current'], thresholds, filters.split() or [current_filter])
+
+        scenes = _self.get_scene_list()
+
+        for obj, view, threshold, spec in combos:
+            if view != 'current' and view not in scenes:
+                raise CmdException('No scene named ' + view)
+            try:
+                Xlink_render.parse_filter(spec)
+            except ValueError as e:
+                raise CmdException(str(e))
+
+        rows = Xlink_render.render_batch(viewer, directory, combos, int(width), int(height), int(dpi), parse_bool(ray),
+                                         int(workers), python or None)
+
+        if not int(quiet):
+            num_failed = sum(1 for row in rows if row[-1] != 'ok')
+            print(' xlink_render: saved {0} images to {1}{2}'.format(len(rows) - num_failed, directory,
+                  ', {0} failed (see manifest.csv)'.format(num_failed) if num_failed else ''))
+
+        return rows
+
+
+    for func in [xlink_load, xlink_threshold, xlink_filter, xlink_export, xlink_stats, xlink_sensitivity, xlink_sequence,
+                 xlink_missing, xlink_memory, xlink_uncertainty, xlink_render]:
+        cmd.extend(func.__name__, func)
+
+    # complete the object name of xlink_load
+    cmd.auto_arg[1]['xlink_load'] = [cmd.object_sc, 'object', ', ']
+    cmd.auto_arg[1]['xlink_sensitivity'] = [cmd.object_sc, 'object', ', ']
@@ -0,0 +1,267 @@
+'''
+Xlink_comparison.py
+
+This class joins the xlinks observed in two or more conditions (e.g. the conformational states
+of a differential XL-MS experiment) into one table - used by the PyXlinkViewer PyMOL plugin.
+Each condition is either a separate xlink file, or one of several quantitative columns of a
+single file. The conditions are joined on the residue pair of each xlink with a hash join, so
+every xlink is looked up once rather than scanning the other conditions for it, giving a
+matrix of intensities with one row per xlink and one column per condition.
+
+The log2 fold-change of each xlink is calculated between a test and a reference condition. The
+absolute fold-changes are kept in sorted order, so when the fold-change threshold is adjusted
+the xlinks which change state are found with two bisections, and only those need redrawing.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import numpy as np
+
+
+def pair_key(xl):
+    '''
+    Returns the key used to join an xlink across conditions - the reported sites of the two ends, in sorted order
+    so that the same residue pair matches whichever way round it was reported
+    '''
+
+    return tuple(sorted((tuple(xl.get_sites(1)), tuple(xl.get_sites(2)))))
+
+
+class Xlink_comparison():
+
+    def __init__(self):
+
+        # condition names, and for each condition a dictionary of pair key -> (xlink, intensity)
+        self.conditions = []
+        self.tables = []
+
+        # the joined xlinks, one per residue pair, and the (num xlinks, num conditions) intensity matrix.
+        # Intensities of xlinks not observed in a condition are NaN
+        self.xlinks = []
+        self.intensities = np.zeros((0, 0))
+
+        # whether each xlink was observed in each condition, as an xlink can be observed without an intensity
+        self.observed = np.zeros((0, 0), dtype=bool)
+
+        # the conditions compared, as indices into conditions
+        self.reference = 0
+        self.test = 1
+
+        # log2(test / reference) of each xlink. Xlinks observed in only one of the two conditions have a fold-change
+        # of +/- infinity, and those observed in neither (or without intensities) have NaN
+        self.log2fc = np.zeros(0)
+
+        # absolute fold-change threshold above which an xlink counts as changed
+        self.threshold = 1.0
+
+        # xlink rows in ascending order of absolute fold-change (NaN last), and the sorted absolute fold-changes
+        self.order = np.zeros(0, dtype=int)
+        self.sorted_abs = np.zeros(0)
+
+
+    def add_condition(self, name, xlinks, column=0):
+        '''
+        Adds a condition from a list of Obs_xlink objects, taking the intensity of each xlink from one of its
+        quantitative columns. Duplicate residue pairs keep the highest intensity
+        '''
+
+        table = {}
+
+        for xl in xlinks:
+
+            value = xl.intensities[column] if column < len(xl.intensities) else None
+            value = np.nan if value is None else float(value)
+
+            key = pair_key(xl)
+            if key not in table or np.isnan(table[key][1]) or value > table[key][1]:
+                table[key] = (xl, value)
+
+        self.conditions.append(name)
+        self.tables.append(table)
+
+
+    def join(self):
+        '''
+        Joins the conditions on the residue pair of each xlink. The row of each pair is found through a dictionary,
+        so the join takes one pass over each condition. The joined xlinks are the xlinks of the first condition that
+        observed each pair, and hold their row of the intensity matrix in their intensities list
+        '''
+
+        rows = {}
+        self.xlinks = []
+
+        for table in self.tables:
+            for key, (xl, value) in table.items():
+                if key not in rows:
+                    rows[key] = len(self.xlinks)
+                    self.xlinks.append(xl)
+
+        self.intensities = np.full((len(self.xlinks), len(self.conditions)), np.nan)
+        self.observed = np.zeros((len(self.xlinks), len(self.conditions)), dtype=bool)
+
+        for c, table in enumerate(self.tables):
+            for key, (xl, value) in table.items():
+                self.intensities[rows[key], c] = value
+                self.observed[rows[key], c] = True
+
+        for xl, row in zip(self.xlinks, self.intensities):
+            xl.intensities = [None if np.isnan(v) else float(v) for v in row]
+
+        self.set_conditions(self.reference, min(self.test, len(self.conditions) - 1))
+
+        return self.xlinks
+
+
+    @classmethod
+    def from_xlinks(cls, xlinks, conditions, observed=None):
+        '''
+        Rebuilds a comparison from joined xlinks, e.g. restored from a saved session, whose intensities lists hold a
+        value (or None) for each condition. If the observed matrix isn't given, xlinks without an intensity in a
+        condition are taken as not observed in it
+        '''
+
+        comparison = cls()
+        comparison.conditions = list(conditions)
+        comparison.tables = [{} for name in conditions]
+        comparison.xlinks = xlinks
+
+        comparison.intensities = np.full((len(xlinks), len(conditions)), np.nan)
+        for i, xl in enumerate(xlinks):
+            for c, value in enumerate(xl.intensities[:len(conditions)]):
+                if value is not None:
+                    comparison.intensities[i, c] = value
+
+        if observed is None:
+            comparison.observed = ~np.isnan(comparison.intensities)
+        else:
+            comparison.observed = np.asarray(observed, dtype=bool).reshape(len(xlinks), len(conditions))
+
+        for c in range(len(conditions)):
+            comparison.tables[c] = dict((pair_key(xl), (xl, v)) for xl, v in zip(xlinks, comparison.intensities[:, c]) if not np.isnan(v))
+
+        comparison.set_conditions(0, min(1, len(conditions) - 1))
+
+        return comparison
+
+
+#------------------------------------------------------------------------------------
+
+    def set_conditions(self, reference, test):
+        '''
+        Sets the reference and test conditions, calculating the log2 fold-change of every xlink and sorting them
+        '''
+
+        self.reference = reference
+        self.test = test
+
+        if not len(self.xlinks):
+            self.log2fc = np.zeros(0)
+        else:
+            ref = self.intensities[:, reference]
+            tst = self.intensities[:, test]
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.log2fc = np.log2(tst) - np.log2(ref)
+
+            # xlinks only observed in one condition are treated as infinitely changed
+            bRef = self.observed[:, reference]
+            bTst = self.observed[:, test]
+
+            self.log2fc[~bRef & bTst & (tst > 0)] = np.inf
+            self.log2fc[bRef & ~bTst & (ref > 0)] = -np.inf
+
+        for xl, fc in zip(self.xlinks, self.log2fc):
+            xl.fold_change = None if np.isnan(fc) else float(fc)
+
+        # NB. argsort puts NaN at the end, so they are never above a threshold
+        abs_fc = np.abs(self.log2fc)
+        self.order = np.argsort(abs_fc, kind='stable')
+        self.sorted_abs = abs_fc[self.order]
+
+
+    def num_valid(self):
+        return int(np.count_nonzero(~np.isnan(self.sorted_abs)))
+
+
+    def first_changed(self, threshold):
+        '''
+        Returns the position in sorted order of the first xlink whose absolute fold-change is at least the threshold
+        '''
+
+        return int(np.searchsorted(self.sorted_abs[:self.num_valid()], threshold, side='left'))
+
+
+    def set_threshold(self, threshold):
+        '''
+        Sets the fold-change threshold. Returns the xlinks which have changed state, i.e. those whose absolute
+        fold-change lies between the old and new threshold
+        '''
+
+        old = self.first_changed(self.threshold)
+        new = self.first_changed(threshold)
+
+        self.threshold = threshold
+
+        lo, hi = min(old, new), max(old, new)
+
+        return [self.xlinks[i] for i in self.order[lo:hi]]
+
+
+    def changed(self):
+        '''
+        Returns a boolean array of whether each xlink's absolute fold-change is at least the threshold
+        '''
+
+        bChanged = np.zeros(len(self.xlinks), dtype=bool)
+        bChanged[self.order[self.first_changed(self.threshold):self.num_valid()]] = True
+
+        return bChanged
+
+
+    def num_changed(self):
+        '''
+        Returns the number of xlinks increased and decreased by at least the threshold
+        '''
+
+        bChanged = self.changed()
+
+        return int(np.count_nonzero(bChanged & (self.log2fc > 0))), int(np.count_nonzero(bChanged & (self.log2fc < 0)))
+
+
+#------------------------------------------------------------------------------------
+
+    def export(self, filename):
+        '''
+        Save the joined xlinks with their intensities in each condition and fold-changes in csv format
+        '''
+
+        bChanged = self.changed()
+
+        with open(filename, 'w') as f:
+
+            f.write('Chain 1,Residue 1,Chain 2,Residue 2,Distance,' + ','.join(self.conditions))
+            f.write(',log2 FC ({0}/{1}),Changed\n'.format(self.conditions[self.test], self.conditions[self.reference]))
+
+            for i, xl in enumerate(self.xlinks):
+                values = ['' if np.isnan(v) else '{0:g}'.format(v) for v in self.intensities[i]]
+                fc = '' if np.isnan(self.log2fc[i]) else '{0:.3f}'.format(self.log2fc[i])
+
+                f.write('{0},{1},{2},{3},{4:.1f},'.format(xl.chain1, xl.resid1, xl.chain2, xl.resid2, xl.distance))
+                f.write(','.join(values) + ',' + fc + ',' + ('Y' if bChanged[i] else 'N') + '\n')
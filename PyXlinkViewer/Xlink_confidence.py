@@ -0,0 +1,142 @@
+'''
+Xlink_confidence.py
+
+Functions used by the PyXlinkViewer PyMOL plugin to take the uncertainty of the atomic coordinates
+into account when deciding whether an xlink is satisfied. The B-factor column of the PyMOL object
+holds either crystallographic B-factors or, for predicted models (e.g. AlphaFold), pLDDT scores,
+and either is turned into an estimate of the positional error of each xlink end. Treating the
+ends as independent with normally distributed errors, the measured distance is uncertain by the
+combined error of both ends, and the probability that the true distance is within the threshold is
+given by the normal cumulative distribution.
+
+All of the functions work on NumPy arrays of any number of xlinks at once.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import numpy as np
+
+
+# what the B-factor column of the PyMOL object holds - 'off' treats the coordinates as exact
+UNCERTAINTY_MODES = {
+    'off': 'Coordinates exact',
+    'bfactor': 'B-factors',
+    'plddt': 'pLDDT',
+}
+
+
+def coordinate_error(b, mode):
+    '''
+    Returns an array of the positional error along any one axis (in A) of atoms with an array of B-factor column values.
+    A B-factor is 8 pi^2 times the mean square displacement along an axis. pLDDT scores (0-100) are converted to a
+    positional error with rmsd = 1.5 exp(4 (0.7 - pLDDT / 100)), as used to make B-factors for predicted models, and a
+    pLDDT of 0 (e.g. a structure without scores) is taken as unknown. Unknown errors are NaN
+    '''
+
+    b = np.asarray(b, dtype=float)
+
+    if mode == 'bfactor':
+        return np.sqrt(np.where(b >= 0, b, np.nan) / (8 * np.pi ** 2))
+
+    if mode == 'plddt':
+        rmsd = 1.5 * np.exp(4 * (0.7 - np.where(b > 0, b, np.nan) / 100.))
+        return rmsd / np.sqrt(3)
+
+    return np.zeros(b.shape)
+
+
+def distance_error(b1, b2, mode):
+    '''
+    Returns an array of the standard deviation of the distance of each xlink, from the B-factor column values of the
+    points at its ends. Only the errors along the line between the points change the distance
+    '''
+
+    return np.sqrt(coordinate_error(b1, mode) ** 2 + coordinate_error(b2, mode) ** 2)
+
+
+def erf(x):
+    '''
+    Vectorised error function (Abramowitz and Stegun 7.1.26, absolute error below 1.5e-7)
+    '''
+
+    x = np.asarray(x, dtype=float)
+    sign = np.sign(x)
+    x = np.abs(x)
+
+    t = 1. / (1. + 0.3275911 * x)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+
+    return sign * (1. - poly * np.exp(-x * x))
+
+
+def normal_cdf(x):
+    return 0.5 * (1. + erf(np.asarray(x, dtype=float) / np.sqrt(2)))
+
+
+def satisfaction_probability(distance, sigma, threshold):
+    '''
+    Returns an array of the probability that the true distance of each xlink is no more than the threshold. Xlinks
+    whose distance is exact are satisfied with a probability of 0 or 1, and those without a distance (a residue missing
+    from the structure) or an error estimate have a NaN probability
+    '''
+
+    distance = np.asarray(distance, dtype=float)
+    sigma = np.asarray(sigma, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        prob = normal_cdf((threshold - distance) / sigma)
+
+    prob = np.where(sigma == 0, (distance <= threshold).astype(float), prob)
+
+    return np.where(distance == 0, np.nan, prob)
+
+
+def confidence(probability):
+    '''
+    Returns an array of the confidence (0.5 to 1) in the satisfied or violated call of each xlink, i.e. the
+    probability of the more likely call. NaN probabilities give a NaN confidence
+    '''
+
+    probability = np.asarray(probability, dtype=float)
+
+    return np.maximum(probability, 1. - probability)
+
+
+def confident(probability, min_confidence):
+    '''
+    Returns a boolean array (or a single boolean) of whether the call of each xlink is made with at least the minimum
+    confidence. Xlinks without a probability (None or NaN) always pass
+    '''
+
+    conf = confidence(probability)
+
+    return np.isnan(conf) | (conf >= min_confidence)
+
+
+def shade(rgb, probability, colour):
+    '''
+    Returns an (n, 3) array of colours faded towards another colour as the confidence of each xlink falls from 1 to
+    0.5. Xlinks without a probability keep their colours
+    '''
+
+    weight = 2. * confidence(probability) - 1.
+    weight = np.where(np.isnan(weight), 1., weight)[:, None]
+
+    return weight * np.asarray(rgb, dtype=float) + (1. - weight) * np.asarray(colour, dtype=float)
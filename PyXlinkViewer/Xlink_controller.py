@@ -0,0 +1,451 @@
+'''
+Xlink_controller.py
+
+UI-independent functions used by the PyXlinkViewer PyMOL plugin dialog, which can also be used by
+scripts and services without Qt. Loading and calculating distances work on a BXlink_viewer, and
+return an immutable snapshot of the result - a named tuple of the xlinks and mono-links (also
+named tuples) with the threshold and distance mode. Filtering, counting and exporting are pure
+functions of a snapshot and a set of display options, so snapshots can be shared between threads
+and several datasets can be processed in parallel, each with its own viewer.
+
+PyMOL serialises the calls made to it from different threads with its API lock, so the parallel
+part of processing several datasets is the NumPy distance calculation and the filtering.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+from collections import namedtuple
+
+import numpy as np
+
+from BXlink_viewer import BXlink_viewer
+from Coord_index import DISTANCE_MODES
+from Interface_index import INTERFACE_LABELS
+from Xlink_columns import Xlink_columns
+import Xlink_confidence
+import Xlink_restraints
+import Xlink_sensitivity
+
+
+# immutable records of an xlink and a mono-link. sigma is the standard deviation of the distance and probability the
+# probability that the xlink is satisfied (None without an uncertainty mode - see Xlink_confidence)
+Link = namedtuple('Link', ['chain1', 'resid1', 'chain2', 'resid2', 'distance', 'bRes1_in_obj', 'bRes2_in_obj',
+                           'obj_name', 'fold_change', 'interface', 'sigma', 'probability'])
+Mono = namedtuple('Mono', ['chain', 'resid', 'value', 'obj_name'])
+
+# the xlinks (the result of the current query, if there is one) and mono-links of a dataset with the settings
+# needed to classify them. bComparison is set if the xlinks have fold-changes between conditions, and bUncertainty if
+# they have probabilities of being satisfied. If the viewer has a memory budget the links are its columns (see
+# Xlink_columns) rather than a tuple of Link records - a copy of the rows of the current query, or read-only views of
+# all of the columns without one, which follow the viewer if its distances are recalculated
+Snapshot = namedtuple('Snapshot', ['obj', 'source', 'threshold', 'distance_mode', 'links', 'monos', 'bComparison',
+                                   'bUncertainty'])
+
+# which xlinks and mono-links are shown, as set by the dialog check boxes, the interface label of the inter-chain
+# xlinks shown ('all' shows every inter-chain xlink), and the minimum confidence in the satisfied or violated call of
+# the xlinks shown (xlinks without a probability are always shown)
+Display_options = namedtuple('Display_options', ['show_satisfied', 'show_violated', 'show_inter', 'show_intra', 'show_mono',
+                                                 'interface_filter', 'min_confidence'])
+
+DEFAULT_OPTIONS = Display_options(True, True, True, True, False, 'all', 0.0)
+
+
+def snapshot(viewer):
+    '''
+    Returns an immutable snapshot of the current xlinks and mono-links of a viewer
+    '''
+
+    if viewer.columns is not None:
+        links = viewer.columns.take(viewer.get_rows())
+    else:
+        links = tuple(Link(xl.chain1, xl.resid1, xl.chain2, xl.resid2, xl.distance, xl.bRes1_in_obj, xl.bRes2_in_obj,
+                           xl.obj_name, xl.fold_change, xl.interface, xl.sigma, xl.probability) for xl in viewer.get_xlinks())
+    monos = tuple(Mono(m.chain, m.resid, m.value, m.obj_name) for m in viewer.obs_monos)
+
+    return Snapshot(viewer.obj, viewer.xlink_file, viewer.threshold, viewer.distance_mode, links, monos,
+                    viewer.comparison is not None, viewer.uncertainty_mode != 'off')
+
+
+def options_from_viewer(viewer):
+    return Display_options(viewer.show_satisied, viewer.show_violated, viewer.show_inter, viewer.show_intra, viewer.show_mono,
+                           viewer.interface_filter, viewer.min_confidence)
+
+
+def is_columnar(snap):
+    return isinstance(snap.links, Xlink_columns)
+
+
+def column_link(links, row):
+    '''
+    Returns the Link record of a row of xlinks held as columns
+    '''
+
+    (chain1, resid1), (chain2, resid2) = links.ends(row)
+    level = links.interface[row]
+    prob = float(links.probability[row])
+
+    return Link(chain1, resid1, chain2, resid2, float(links.distance[row]), bool(links.found1[row]), bool(links.found2[row]),
+                links.obj_name(row), None, INTERFACE_LABELS[level] if level >= 0 else '', float(links.sigma[row]),
+                None if np.isnan(prob) else prob)
+
+
+def with_threshold(snap, threshold):
+    '''
+    Returns a copy of a snapshot with a different threshold, and the probabilities of its xlinks being satisfied at
+    that threshold
+    '''
+
+    if not snap.bUncertainty:
+        return snap._replace(threshold=threshold)
+
+    if is_columnar(snap):
+        # the other columns are shared with the snapshot, so only the probabilities are copied
+        links = snap.links.take()
+        links.probability = np.empty_like(links.probability)
+        links.calculate_probabilities(threshold)
+    else:
+        prob = Xlink_confidence.satisfaction_probability([link.distance for link in snap.links],
+                                                         [link.sigma for link in snap.links], threshold)
+        links = tuple(link._replace(probability=None if np.isnan(p) else float(p)) for link, p in zip(snap.links, prob))
+
+    return snap._replace(threshold=threshold, links=links)
+
+
+#------------------------------------------------------------------------------------
+
+def load(viewer, filename, file_type='jwalk'):
+    '''
+    Reads an xlink file into a viewer and calculates the distances and the xlink network. Returns a snapshot
+    '''
+
+    viewer.set_xlink_file(filename)
+    viewer.set_xlink_file_type(file_type)
+    viewer.parse_xlink_file()
+
+    return compute(viewer)
+
+
+def compute(viewer):
+    '''
+    Calculates the distances of the xlinks of a viewer and builds the xlink network. Returns a snapshot
+    '''
+
+    viewer.calculate_distances()
+    viewer.test_monos_in_obj()
+    viewer.build_network()
+
+    return snapshot(viewer)
+
+
+def new_viewer(obj, settings=None):
+    '''
+    Returns a new viewer for a PyMOL object, with settings given as a dictionary of viewer member variables (see
+    Xlink_session.SETTINGS)
+    '''
+
+    viewer = BXlink_viewer()
+    viewer.set_obj(obj)
+
+    for name, value in (settings or {}).items():
+        if name == 'chain_equivalence':
+            viewer.set_chain_equivalence(value)
+        elif name == 'threshold':
+            viewer.set_threshold(value)
+        else:
+            setattr(viewer, name, value)
+
+    return viewer
+
+
+def process_file(obj, filename, settings=None, file_type='jwalk'):
+    '''
+    Loads an xlink file against a PyMOL object with a viewer of its own, and returns a snapshot
+    '''
+
+    return load(new_viewer(obj, settings), filename, file_type)
+
+
+def process_files(obj, filenames, settings=None, file_type='jwalk', max_workers=4):
+    '''
+    Loads several xlink files in parallel threads, each with its own viewer, and returns a snapshot of each in the
+    same order as the files
+    '''
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda filename: process_file(obj, filename, settings, file_type), filenames))
+
+
+def process_models(objs, filename, settings=None, file_type='jwalk', max_workers=4):
+    '''
+    Loads one xlink file against several PyMOL objects (e.g. alternative models) in parallel threads, and returns a
+    snapshot for each object in the same order
+    '''
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda obj: process_file(obj, filename, settings, file_type), objs))
+
+
+#------------------------------------------------------------------------------------
+
+def is_shown(link, threshold, options):
+    '''
+    Returns whether an xlink is shown with the display options
+    '''
+
+    if link.distance <= threshold and not options.show_satisfied:
+        return False
+
+    if link.distance > threshold and not options.show_violated:
+        return False
+
+    if not Xlink_confidence.confident(link.probability, options.min_confidence):
+        return False
+
+    if link.chain1 != link.chain2:
+        return options.show_inter and options.interface_filter in ('all', link.interface)
+
+    return options.show_intra
+
+
+def column_mask(links, threshold, options):
+    '''
+    Returns a boolean array of which xlinks held as columns are shown with the display options, as is_shown
+    '''
+
+    inter = links.is_inter()
+
+    bInterface = options.interface_filter == 'all'
+    if not bInterface:
+        bInterface = links.interface == INTERFACE_LABELS.index(options.interface_filter)
+
+    shown = np.where(links.distance <= threshold, options.show_satisfied, options.show_violated)
+    shown &= Xlink_confidence.confident(links.probability, options.min_confidence)
+
+    return shown & np.where(inter, options.show_inter & bInterface, options.show_intra)
+
+
+def filter_links(snap, options=DEFAULT_OPTIONS):
+    '''
+    Returns the xlinks of a snapshot shown with the display options
+    '''
+
+    if is_columnar(snap):
+        return snap.links.take(np.flatnonzero(column_mask(snap.links, snap.threshold, options)))
+
+    return tuple(link for link in snap.links if is_shown(link, snap.threshold, options))
+
+
+def count(snap, options=DEFAULT_OPTIONS):
+    '''
+    Returns the numbers of satisfied and violated xlinks of the types (inter/intra chain) shown with the display
+    options. Xlinks with a residue missing from the structure are neither satisfied nor violated
+    '''
+
+    if is_columnar(snap):
+        links = snap.links
+        inter = links.is_inter()
+
+        counted = links.found1 & links.found2 & np.where(inter, options.show_inter, options.show_intra)
+        if options.interface_filter != 'all':
+            counted &= ~inter | (links.interface == INTERFACE_LABELS.index(options.interface_filter))
+
+        counted &= Xlink_confidence.confident(links.probability, options.min_confidence)
+
+        num_sat = int(np.count_nonzero(counted & (links.distance <= snap.threshold)))
+
+        return num_sat, int(np.count_nonzero(counted)) - num_sat
+
+    num_sat = 0
+    num_viol = 0
+
+    for link in snap.links:
+
+        if not (link.bRes1_in_obj and link.bRes2_in_obj):
+            continue
+
+        if (link.chain1 != link.chain2 and not options.show_inter) or (link.chain1 == link.chain2 and not options.show_intra):
+            continue
+
+        if link.chain1 != link.chain2 and options.interface_filter not in ('all', link.interface):
+            continue
+
+        if not Xlink_confidence.confident(link.probability, options.min_confidence):
+            continue
+
+        if link.distance <= snap.threshold:
+            num_sat += 1
+        else:
+            num_viol += 1
+
+    return num_sat, num_viol
+
+
+def score(snap, force_constant=1.0):
+    '''
+    Returns the restraint score of the xlinks of a snapshot (see Xlink_restraints.restraint_score)
+    '''
+
+    if is_columnar(snap):
+        links = snap.links
+        dists = links.distance[links.found1 & links.found2 & (links.distance != 0)].astype(float)
+    else:
+        dists = [link.distance for link in snap.links if link.bRes1_in_obj and link.bRes2_in_obj and link.distance != 0]
+
+    return Xlink_restraints.restraint_score(dists, snap.threshold, force_constant)
+
+
+def sensitivity(snap, thresholds=None, step=1.0):
+    '''
+    Returns the satisfied xlink curve of a snapshot over a range of thresholds (see
+    Xlink_sensitivity.sensitivity_curve). As with count, xlinks with a residue missing from the structure are left out
+    '''
+
+    if is_columnar(snap):
+        links = snap.links
+        found = links.found1 & links.found2
+        return Xlink_sensitivity.sensitivity_curve(links.distance[found].astype(float), links.is_inter()[found], thresholds, step)
+
+    links = [link for link in snap.links if link.bRes1_in_obj and link.bRes2_in_obj]
+
+    return Xlink_sensitivity.sensitivity_curve([link.distance for link in links],
+                                               [link.chain1 != link.chain2 for link in links], thresholds, step)
+
+
+def export_sensitivity(snaps, filename, thresholds=None, step=1.0):
+    '''
+    Saves the satisfied xlink curves of several snapshots (e.g. from process_models) to one csv file. By default all
+    the curves use the same thresholds, up to the longest distance in any of them
+    '''
+
+    if thresholds is None:
+        dists = [snap.links.distance.astype(float) if is_columnar(snap) else [link.distance for link in snap.links] for snap in snaps]
+        thresholds = Xlink_sensitivity.default_thresholds(np.concatenate(dists + [np.zeros(0)]), step)
+
+    Xlink_sensitivity.export_curves([(snap.obj, sensitivity(snap, thresholds)) for snap in snaps], filename)
+
+
+def table_header(snap):
+    header = ['Chain 1', 'Residue 1', 'Chain 2', 'Residue 2', DISTANCE_MODES[snap.distance_mode], 'Interface']
+
+    if snap.bComparison:
+        header.append('log2 FC')
+
+    if snap.bUncertainty:
+        header.append('P(satisfied)')
+
+    return header
+
+
+def link_row(snap, link):
+    '''
+    Returns the row of the xlink table of a Link as a list of strings
+    '''
+
+    row = [link.chain1, link.resid1, link.chain2, link.resid2, '{0:3.1f}'.format(link.distance), link.interface or '-']
+
+    # add the fold-change column if conditions are being compared
+    if snap.bComparison:
+        row.append('-' if link.fold_change is None else '{0:.2f}'.format(link.fold_change))
+
+    # and the probability of the xlink being satisfied if the coordinates are uncertain
+    if snap.bUncertainty:
+        row.append('-' if link.probability is None else '{0:.2f}'.format(link.probability))
+
+    return row
+
+
+def mono_row(snap, m):
+    return [m.chain, m.resid, '-', '-', '-', '-'] + (['-'] if snap.bComparison else []) + (['-'] if snap.bUncertainty else [])
+
+
+class Column_rows():
+    '''
+    The rows of the xlink table of a snapshot whose xlinks are held as columns. Each row is only made when it is
+    asked for, e.g. when it is scrolled into view, so that a list of every row is never held
+    '''
+
+    def __init__(self, snap, links, monos):
+        self.snap = snap
+        self.links = links
+        self.monos = monos
+
+    def __len__(self):
+        return len(self.links) + len(self.monos)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+
+        if not 0 <= i < len(self):
+            raise IndexError('table row out of range')
+
+        if i < len(self.links):
+            return link_row(self.snap, column_link(self.links, i))
+
+        return mono_row(self.snap, self.monos[i - len(self.links)])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def table_rows(snap, options=DEFAULT_OPTIONS):
+    '''
+    Returns the rows of the xlink table as lists of strings - the xlinks shown with the display options, followed
+    by the mono-links if they are shown. The rows of xlinks held as columns are made when they are used (see
+    Column_rows)
+    '''
+
+    monos = snap.monos if options.show_mono else ()
+
+    if is_columnar(snap):
+        return Column_rows(snap, filter_links(snap, options), monos)
+
+    rows = [link_row(snap, link) for link in filter_links(snap, options)]
+
+    for m in monos:
+        rows.append(mono_row(snap, m))
+
+    return rows
+
+
+def export(snap, filename, options=DEFAULT_OPTIONS):
+    '''
+    Saves the xlink table in csv format. For each entry two additional columns are written: the threshold, and 'S'
+    or 'V' depending on whether the xlink is satisfied or violated at that threshold
+    '''
+
+    with open(filename, 'w') as f:
+
+        f.write(','.join(table_header(snap)) + ',Threshold,Sat-Viol\n')
+
+        for row in table_rows(snap, options):
+
+            f.write(','.join(row) + ',')
+
+            # the fifth column is the distance, or a dash for a mono-link
+            if row[4] == '-':
+                f.write('-,-\n')
+            else:
+                f.write(str(snap.threshold) + ',' + ('S' if float(row[4]) <= snap.threshold else 'V') + '\n')
@@ -0,0 +1,114 @@
+'''
+Xlink_geometry.py
+
+Batched geometry functions used by the PyXlinkViewer PyMOL plugin and the draw_xlink script. Each
+function works on (n, 3) NumPy arrays of coordinates for many xlinks at once, and the CGO functions
+return a single flat list which can be passed to one cmd.load_cgo call.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+from pymol.cgo import BEGIN, END, LINES, LINEWIDTH, COLOR, VERTEX, CYLINDER, SPHERE
+import numpy as np
+
+
+def distances(xyz1, xyz2):
+    '''
+    Returns the euclidean distance between each pair of rows of two (n, 3) coordinate arrays
+    '''
+
+    return np.sqrt(((np.asarray(xyz1) - np.asarray(xyz2)) ** 2).sum(axis=1))
+
+
+def per_link(values, n, width):
+    '''
+    Broadcasts a single value (e.g. a radius or an rgb colour) or an array of per-xlink values to an (n, width) array
+    '''
+
+    return np.broadcast_to(np.asarray(values, dtype=float).reshape(-1, width), (n, width))
+
+
+def cylinder_cgo(xyz1, xyz2, radius, rgb1, rgb2=None):
+    '''
+    Returns a CGO list of a cylinder between each pair of points. The radius and colours can be single values
+    or one per cylinder
+    '''
+
+    n = len(xyz1)
+
+    if rgb2 is None:
+        rgb2 = rgb1
+
+    cgo = np.hstack([np.full((n, 1), CYLINDER), xyz1, xyz2, per_link(radius, n, 1), per_link(rgb1, n, 3), per_link(rgb2, n, 3)])
+
+    return cgo.ravel().tolist()
+
+
+def line_cgo(xyz1, xyz2, rgb, width):
+    '''
+    Returns a CGO list of a line between each pair of points, drawn with a single BEGIN/END block
+    '''
+
+    n = len(xyz1)
+
+    lines = np.hstack([np.full((n, 1), COLOR), per_link(rgb, n, 3), np.full((n, 1), VERTEX), xyz1, np.full((n, 1), VERTEX), xyz2])
+
+    return [LINEWIDTH, float(width), BEGIN, LINES] + lines.ravel().tolist() + [END]
+
+
+def sphere_cgo(xyz, radius, rgb):
+    '''
+    Returns a CGO list of a sphere at each point. The radius and colour can be single values or one per sphere
+    '''
+
+    n = len(xyz)
+
+    spheres = np.hstack([np.full((n, 1), COLOR), per_link(rgb, n, 3), np.full((n, 1), SPHERE), xyz, per_link(radius, n, 1)])
+
+    return spheres.ravel().tolist()
+
+
+def in_view(xyz, view, viewport, field_of_view):
+    '''
+    Returns a boolean array of whether each point lies inside the view, i.e. between the front and rear clipping
+    planes and inside the field of view. The arguments are as returned by cmd.get_view, cmd.get_viewport and
+    cmd.get('field_of_view')
+    '''
+
+    xyz = np.asarray(xyz, dtype=float).reshape(-1, 3)
+
+    # the first 9 values of the view are the model to camera rotation matrix in column-major order,
+    # followed by the camera position and the origin of rotation
+    rot = np.asarray(view[0:9], dtype=float).reshape(3, 3)
+    cam = np.asarray(view[9:12], dtype=float)
+    origin = np.asarray(view[12:15], dtype=float)
+    front, rear = view[15], view[16]
+    bOrtho = view[17] > 0
+
+    width, height = viewport
+    tan_half_fov = np.tan(np.radians(float(field_of_view)) / 2.)
+    aspect = float(width) / height if height else 1.
+
+    cxyz = np.dot(xyz - origin, rot) + cam
+
+    depth = -cxyz[:, 2]
+    half_height = (-cam[2] if bOrtho else depth) * tan_half_fov
+
+    return (depth >= front) & (depth <= rear) & (np.abs(cxyz[:, 1]) <= half_height) & (np.abs(cxyz[:, 0]) <= half_height * aspect)
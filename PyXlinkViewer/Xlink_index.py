@@ -0,0 +1,321 @@
+'''
+Xlink_index.py
+
+This class holds per-chain sorted residue indexes over the observed xlinks - used by the PyXlinkViewer
+PyMOL plugin to answer chain pair, residue range and distance range queries with bisections rather than
+scanning every xlink. A query string of the form:
+
+   <chain1>[:<from>-<to>] [<chain2>[:<from>-<to>]] [dist:<min>-<max>]
+
+e.g. '3:100-300 7' or 'A B:20-80 dist:0-30', can be converted to query arguments with parse_query.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import bisect
+import re
+
+
+def resid_number(resid):
+    '''
+    Returns the residue number of a resid string as an integer, ignoring any insertion code, or None if
+    the resid does not start with a number
+    '''
+
+    match = re.match(r'\s*(-?\d+)', resid)
+
+    if match:
+        return int(match.group(1))
+
+    return None
+
+
+def parse_range(text):
+    '''
+    Converts a '<from>-<to>' string to a (from, to) tuple. A single value gives a range of that value only
+    '''
+
+    match = re.match(r'^(-?[\d.]+)(?:-(-?[\d.]+))?$', text)
+
+    if not match:
+        raise ValueError('Invalid range: ' + text)
+
+    lo = float(match.group(1))
+    hi = float(match.group(2)) if match.group(2) is not None else lo
+
+    return (min(lo, hi), max(lo, hi))
+
+
+def parse_query(text):
+    '''
+    Converts a query string to a dictionary of keyword arguments for Xlink_index.query
+    '''
+
+    kwargs = {}
+    ends = []
+
+    for term in text.split():
+
+        if term.lower().startswith('dist:'):
+            kwargs['dist_range'] = parse_range(term[5:])
+            continue
+
+        chain, sep, rng = term.partition(':')
+        ends.append((chain, parse_range(rng) if sep else None))
+
+    if len(ends) > 2:
+        raise ValueError('A query can only contain two chains: ' + text)
+
+    for i, (chain, rng) in enumerate(ends):
+        kwargs['chain' + str(i + 1)] = chain
+        kwargs['resid_range' + str(i + 1)] = rng
+
+    return kwargs
+
+
+class Xlink_index():
+
+    def __init__(self):
+
+        self.xlinks = []
+
+        # index of each xlink (keyed by its id), and the (chain, residue number) of each end of each xlink as it was
+        # indexed, so that the xlinks can be moved when they change (see update)
+        self.link_index = {}
+        self.link_ends = []
+
+        # for each chain, the residue numbers of xlink ends in that chain in sorted order, with a parallel list
+        # of (xlink index, end) so that a residue range can be found with two bisections
+        self.chain_resids = {}
+        self.chain_ends = {}
+
+        # for each chain, the (xlink index, end) of xlink ends whose resid doesn't start with a number
+        self.chain_unnumbered = {}
+
+        # xlink indices for each (chain1, chain2) pair, with the chains in sorted order
+        self.pair_links = {}
+
+        # the distances of the xlinks in sorted order, with a parallel list of xlink indices so that a distance range
+        # can be found with two bisections. Made when a distance range is first queried (see links_in_dist_range),
+        # with the distance each xlink was sorted by
+        self.sorted_dists = None
+        self.dist_links = None
+        self.link_dists = None
+
+
+    def build(self, xlinks):
+        '''
+        Build the indexes for a list of Obs_xlink objects
+        '''
+
+        self.__init__()
+        self.xlinks = xlinks
+
+        ends = {}
+
+        for i, xl in enumerate(xlinks):
+
+            self.link_index[id(xl)] = i
+            self.link_ends.append(((xl.chain1, resid_number(xl.resid1)), (xl.chain2, resid_number(xl.resid2))))
+
+            ends.setdefault(xl.chain1, []).append((resid_number(xl.resid1), i, 1))
+            ends.setdefault(xl.chain2, []).append((resid_number(xl.resid2), i, 2))
+
+            self.pair_links.setdefault(tuple(sorted((xl.chain1, xl.chain2))), []).append(i)
+
+        for chain, chain_ends in ends.items():
+
+            # ends without a residue number can only be found by a chain query without a range
+            unnumbered = [(e[1], e[2]) for e in chain_ends if e[0] is None]
+            if unnumbered:
+                self.chain_unnumbered[chain] = unnumbered
+
+            chain_ends = sorted(e for e in chain_ends if e[0] is not None)
+
+            self.chain_resids[chain] = [e[0] for e in chain_ends]
+            self.chain_ends[chain] = [(e[1], e[2]) for e in chain_ends]
+
+
+    def update(self, xlinks):
+        '''
+        Updates the indexes for some of the xlinks after their distances (or chosen sites) have been recalculated.
+        Only the entries of the given xlinks are moved
+        '''
+
+        for xl in xlinks:
+            i = self.link_index[id(xl)]
+
+            ends = ((xl.chain1, resid_number(xl.resid1)), (xl.chain2, resid_number(xl.resid2)))
+            old_ends = self.link_ends[i]
+
+            if ends != old_ends:
+                for end, (chain, num) in enumerate(old_ends, 1):
+                    self.remove_end(chain, num, (i, end))
+                for end, (chain, num) in enumerate(ends, 1):
+                    self.add_end(chain, num, (i, end))
+
+                self.pair_links[tuple(sorted((old_ends[0][0], old_ends[1][0])))].remove(i)
+                self.pair_links.setdefault(tuple(sorted((xl.chain1, xl.chain2))), []).append(i)
+                self.link_ends[i] = ends
+
+            if self.sorted_dists is not None and xl.distance != self.link_dists[i]:
+                pos = bisect.bisect_left(self.sorted_dists, self.link_dists[i])
+                while self.dist_links[pos] != i:
+                    pos += 1
+                del self.sorted_dists[pos]
+                del self.dist_links[pos]
+
+                pos = bisect.bisect_right(self.sorted_dists, xl.distance)
+                self.sorted_dists.insert(pos, xl.distance)
+                self.dist_links.insert(pos, i)
+                self.link_dists[i] = xl.distance
+
+
+    def remove_end(self, chain, num, entry):
+        if num is None:
+            self.chain_unnumbered[chain].remove(entry)
+            return
+
+        resids = self.chain_resids[chain]
+        pos = bisect.bisect_left(resids, num)
+        while self.chain_ends[chain][pos] != entry:
+            pos += 1
+
+        del resids[pos]
+        del self.chain_ends[chain][pos]
+
+
+    def add_end(self, chain, num, entry):
+        if num is None:
+            self.chain_unnumbered.setdefault(chain, []).append(entry)
+            return
+
+        resids = self.chain_resids.setdefault(chain, [])
+        pos = bisect.bisect_right(resids, num)
+
+        resids.insert(pos, num)
+        self.chain_ends.setdefault(chain, []).insert(pos, entry)
+
+
+    def ends_in_range(self, chain, resid_range):
+        '''
+        Returns a list of (xlink index, end) for the xlink ends in a chain within a residue range
+        '''
+
+        resids = self.chain_resids.get(chain, [])
+
+        lo = bisect.bisect_left(resids, resid_range[0])
+        hi = bisect.bisect_right(resids, resid_range[1])
+
+        return self.chain_ends[chain][lo:hi] if hi > lo else []
+
+
+    def chain_all_ends(self, chain):
+        '''
+        Returns a list of (xlink index, end) for all of the xlink ends in a chain
+        '''
+
+        return self.chain_ends.get(chain, []) + self.chain_unnumbered.get(chain, [])
+
+
+    def links_in_dist_range(self, dist_range):
+        '''
+        Returns a list of the indices of the xlinks within a distance range
+        '''
+
+        if self.sorted_dists is None:
+            self.link_dists = [xl.distance for xl in self.xlinks]
+            self.dist_links = sorted(range(len(self.xlinks)), key=lambda i: self.link_dists[i])
+            self.sorted_dists = [self.link_dists[i] for i in self.dist_links]
+
+        lo = bisect.bisect_left(self.sorted_dists, dist_range[0])
+        hi = bisect.bisect_right(self.sorted_dists, dist_range[1])
+
+        return self.dist_links[lo:hi]
+
+
+    def query(self, chain1=None, resid_range1=None, chain2=None, resid_range2=None, dist_range=None):
+        '''
+        Returns the xlinks (in the original order) matching all of the given predicates. An xlink matches the
+        chain/residue range predicates in either orientation. Residue and distance ranges are inclusive
+        '''
+
+        def end_matches(xl, end, chain, resid_range):
+            if end == 1:
+                xl_chain, xl_resid = xl.chain1, xl.resid1
+            else:
+                xl_chain, xl_resid = xl.chain2, xl.resid2
+
+            if chain is not None and xl_chain != chain:
+                return False
+
+            if resid_range is not None:
+                num = resid_number(xl_resid)
+                return num is not None and resid_range[0] <= num <= resid_range[1]
+
+            return True
+
+        # use the most selective index available to find the candidate xlinks
+        if chain1 is not None and resid_range1 is not None:
+            candidates = self.ends_in_range(chain1, resid_range1)
+        elif chain2 is not None and resid_range2 is not None:
+            candidates = self.ends_in_range(chain2, resid_range2)
+            chain1, resid_range1, chain2, resid_range2 = chain2, resid_range2, chain1, resid_range1
+        elif chain1 is not None and chain2 is not None:
+            candidates = [(i, 1) for i in self.pair_links.get(tuple(sorted((chain1, chain2))), [])]
+            candidates += [(i, 2) for i, end in candidates]
+        else:
+            chain = chain1 if chain1 is not None else chain2
+
+            if chain is not None:
+                candidates = self.chain_all_ends(chain)
+                chain1, chain2 = chain, None
+            else:
+                candidates = [(i, 1) for i in range(len(self.xlinks))]
+
+            # the distance index is used instead if it gives fewer candidates - both ends of each xlink are candidates
+            # if there is a chain to match
+            if dist_range is not None:
+                in_range = self.links_in_dist_range(dist_range)
+
+                if len(in_range) < len(candidates):
+                    candidates = [(i, 1) for i in in_range]
+                    if chain is not None:
+                        candidates += [(i, 2) for i in in_range]
+
+        matches = set()
+
+        for i, end in candidates:
+
+            xl = self.xlinks[i]
+
+            # the candidate end has been matched to the first predicate, so check the other end against the second
+            if not end_matches(xl, end, chain1, resid_range1):
+                continue
+
+            if not end_matches(xl, 3 - end, chain2, resid_range2):
+                continue
+
+            if dist_range is not None and not dist_range[0] <= xl.distance <= dist_range[1]:
+                continue
+
+            matches.add(i)
+
+        return [self.xlinks[i] for i in sorted(matches)]
@@ -0,0 +1,404 @@
+'''
+Xlink_network.py
+
+This class builds a graph over the observed xlinks - used by the PyXlinkViewer PyMOL plugin.
+Residues are the nodes of the graph and xlinks are the edges. The class keeps adjacency
+indexes so that per-residue degrees, per-chain-pair satisfied/violated counts, and connected
+components can be looked up without rescanning the xlink list. Satisfied/violated counts are
+updated incrementally when the threshold changes, as only the xlinks whose distance lies between
+the old and new threshold can change state.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import bisect
+
+
+class Xlink_network():
+
+    def __init__(self):
+
+        # residue nodes, keyed by (chain, resid), and the inverse list
+        self.node_index = {}
+        self.nodes = []
+
+        # adjacency index - for each node a dictionary of neighbouring node -> list of edge indices
+        self.adjacency = []
+
+        # edges are stored as (node1, node2, xlink) tuples, with the edge index of each xlink (keyed by its id)
+        self.edges = []
+        self.edge_index = {}
+
+        # sorted list of chain ids present in the network
+        self.chains = []
+
+        # edges with both residues present in the structure, sorted by distance, plus the sorted distances
+        # themselves so that the threshold can be located with a bisection
+        self.sorted_edges = []
+        self.sorted_dists = []
+
+        # the distance each edge is sorted by, or None if it is not one of the sorted edges
+        self.edge_dists = []
+
+        # number of sorted edges which are satisfied at the current threshold
+        self.num_sat = 0
+        self.threshold = None
+
+        # satisfied and violated counts per (chain1, chain2) pair and per node
+        self.pair_sat = {}
+        self.pair_viol = {}
+        self.node_sat = []
+        self.node_viol = []
+
+        # connected component id for each node - only calculated when first asked for
+        self.components = None
+
+
+#------------------------------------------------------------------------------------
+
+    def build(self, xlinks, threshold):
+        '''
+        Build the graph from a list of Obs_xlink objects and classify the xlinks using the threshold value
+        '''
+
+        self.__init__()
+
+        for xl in xlinks:
+            n1 = self.add_node(xl.chain1, xl.resid1)
+            n2 = self.add_node(xl.chain2, xl.resid2)
+
+            e = len(self.edges)
+            self.edges.append((n1, n2, xl))
+            self.edge_index[id(xl)] = e
+
+            self.adjacency[n1].setdefault(n2, []).append(e)
+            self.adjacency[n2].setdefault(n1, []).append(e)
+
+        self.chains = sorted(set(chain for chain, resid in self.nodes))
+
+        # NB. xlinks with a residue missing from the structure are neither satisfied nor violated
+        present = [e for e, (n1, n2, xl) in enumerate(self.edges) if xl.bRes1_in_obj and xl.bRes2_in_obj]
+        self.sorted_edges = sorted(present, key=lambda e: self.edges[e][2].distance)
+        self.sorted_dists = [self.edges[e][2].distance for e in self.sorted_edges]
+
+        self.edge_dists = [None] * len(self.edges)
+        for e, dist in zip(self.sorted_edges, self.sorted_dists):
+            self.edge_dists[e] = dist
+
+        # start with every xlink violated and then move the satisfied ones across
+        self.node_sat = [0] * len(self.nodes)
+        self.node_viol = [0] * len(self.nodes)
+
+        for e in self.sorted_edges:
+            self.move_edge(e, 1, 'viol')
+
+        self.num_sat = 0
+        self.threshold = None
+        self.set_threshold(threshold)
+
+
+    def update(self, xlinks):
+        '''
+        Updates the edges of some of the xlinks of the graph after their distances (or chosen sites) have been
+        recalculated, keeping the classification at the current threshold. Each edge is taken out of the counts and
+        the sorted edges and put back, so only the given xlinks are visited
+        '''
+
+        bNodes_changed = False
+
+        for xl in xlinks:
+            e = self.edge_index[id(xl)]
+            n1, n2, xl = self.edges[e]
+
+            self.remove_sorted_edge(e)
+
+            # the chosen sites of an ambiguous xlink may have changed
+            new_n1 = self.add_node(xl.chain1, xl.resid1)
+            new_n2 = self.add_node(xl.chain2, xl.resid2)
+
+            if (new_n1, new_n2) != (n1, n2):
+                self.remove_adjacency(e, n1, n2)
+                self.adjacency[new_n1].setdefault(new_n2, []).append(e)
+                self.adjacency[new_n2].setdefault(new_n1, []).append(e)
+                self.edges[e] = (new_n1, new_n2, xl)
+                bNodes_changed = True
+
+            if xl.bRes1_in_obj and xl.bRes2_in_obj:
+                self.insert_sorted_edge(e)
+
+        # nodes may have been added, and residues may be left without xlinks
+        if bNodes_changed:
+            self.node_sat += [0] * (len(self.nodes) - len(self.node_sat))
+            self.node_viol += [0] * (len(self.nodes) - len(self.node_viol))
+            self.chains = sorted(set(self.nodes[n][0] for n1, n2, xl in self.edges for n in (n1, n2)))
+            self.components = None
+
+
+    def remove_sorted_edge(self, e):
+        '''
+        Takes an edge out of the sorted edges and the satisfied or violated counts, if it is there
+        '''
+
+        dist = self.edge_dists[e]
+
+        if dist is None:
+            return
+
+        pos = bisect.bisect_left(self.sorted_dists, dist)
+        while self.sorted_edges[pos] != e:
+            pos += 1
+
+        del self.sorted_edges[pos]
+        del self.sorted_dists[pos]
+        self.edge_dists[e] = None
+
+        # the sorted edges before num_sat are the satisfied ones
+        if pos < self.num_sat:
+            self.move_edge(e, -1, 'sat')
+            self.num_sat -= 1
+        else:
+            self.move_edge(e, -1, 'viol')
+
+
+    def insert_sorted_edge(self, e):
+        '''
+        Puts an edge into the sorted edges by its distance, and classifies it at the current threshold
+        '''
+
+        dist = self.edges[e][2].distance
+        pos = bisect.bisect_right(self.sorted_dists, dist)
+
+        self.sorted_edges.insert(pos, e)
+        self.sorted_dists.insert(pos, dist)
+        self.edge_dists[e] = dist
+
+        if self.threshold is not None and dist <= self.threshold:
+            self.move_edge(e, 1, 'sat')
+            self.num_sat += 1
+        else:
+            self.move_edge(e, 1, 'viol')
+
+
+    def remove_adjacency(self, e, n1, n2):
+        for a, b in [(n1, n2), (n2, n1)]:
+            edges = self.adjacency[a][b]
+            if e in edges:
+                edges.remove(e)
+            if not edges:
+                del self.adjacency[a][b]
+
+
+    def add_node(self, chain, resid):
+        '''
+        Returns the index of the node for a residue, adding it to the graph if not already present
+        '''
+
+        key = (chain, resid.strip())
+
+        if key not in self.node_index:
+            self.node_index[key] = len(self.nodes)
+            self.nodes.append(key)
+            self.adjacency.append({})
+
+        return self.node_index[key]
+
+
+    def pair_key(self, e):
+        '''
+        Returns the chain pair of an edge, ordered so that (A, B) and (B, A) are counted together
+        '''
+
+        n1, n2, xl = self.edges[e]
+        c1 = self.nodes[n1][0]
+        c2 = self.nodes[n2][0]
+
+        if c2 < c1:
+            return (c2, c1)
+
+        return (c1, c2)
+
+
+    def move_edge(self, e, step, kind):
+        '''
+        Add (step = 1) or remove (step = -1) an edge from the satisfied or violated counts
+        '''
+
+        n1, n2, xl = self.edges[e]
+        key = self.pair_key(e)
+
+        if kind == 'sat':
+            self.pair_sat[key] = self.pair_sat.get(key, 0) + step
+            self.node_sat[n1] += step
+            self.node_sat[n2] += step
+        else:
+            self.pair_viol[key] = self.pair_viol.get(key, 0) + step
+            self.node_viol[n1] += step
+            self.node_viol[n2] += step
+
+
+#------------------------------------------------------------------------------------
+
+    def set_threshold(self, threshold):
+        '''
+        Reclassify the xlinks for a new threshold. Only the xlinks with a distance between the old and
+        new threshold values are visited
+        '''
+
+        if threshold == self.threshold:
+            return
+
+        new_num_sat = bisect.bisect_right(self.sorted_dists, threshold)
+
+        # xlinks that have become satisfied
+        for e in self.sorted_edges[self.num_sat:new_num_sat]:
+            self.move_edge(e, -1, 'viol')
+            self.move_edge(e, 1, 'sat')
+
+        # xlinks that have become violated
+        for e in self.sorted_edges[new_num_sat:self.num_sat]:
+            self.move_edge(e, -1, 'sat')
+            self.move_edge(e, 1, 'viol')
+
+        self.num_sat = new_num_sat
+        self.threshold = threshold
+
+
+#------------------------------------------------------------------------------------
+
+    def chain_pair_matrix(self, kind):
+        '''
+        Returns a symmetric matrix (list of lists in the order of self.chains) of the number of satisfied
+        (kind = 'sat') or violated (kind = 'viol') xlinks between each pair of chains
+        '''
+
+        counts = self.pair_sat if kind == 'sat' else self.pair_viol
+        index = dict((c, i) for i, c in enumerate(self.chains))
+
+        matrix = [[0] * len(self.chains) for c in self.chains]
+
+        for (c1, c2), num in counts.items():
+            matrix[index[c1]][index[c2]] = num
+            matrix[index[c2]][index[c1]] = num
+
+        return matrix
+
+
+    def degree(self, chain, resid):
+        '''
+        Returns the number of xlinks made by a residue
+        '''
+
+        n = self.node_index.get((chain, resid.strip()))
+
+        if n is None:
+            return 0
+
+        return sum(len(edges) for edges in self.adjacency[n].values())
+
+
+    def residue_hubs(self, num=None):
+        '''
+        Returns a list of (chain, resid, degree, num_sat, num_viol) for each residue, sorted so that the
+        residues making the most xlinks come first
+        '''
+
+        hubs = []
+        for n, (chain, resid) in enumerate(self.nodes):
+            deg = sum(len(edges) for edges in self.adjacency[n].values())
+
+            # residues whose xlinks have been moved to other sites (see update) have no edges
+            if deg == 0:
+                continue
+
+            hubs.append((chain, resid, deg, self.node_sat[n], self.node_viol[n]))
+
+        hubs.sort(key=lambda h: (-h[2], -h[4]))
+
+        if num is not None:
+            return hubs[:num]
+
+        return hubs
+
+
+    def connected_components(self):
+        '''
+        Returns a list giving the connected component id of each node. Components are found once with a
+        union-find over the edges, as they do not depend on the threshold
+        '''
+
+        if self.components is not None:
+            return self.components
+
+        parent = list(range(len(self.nodes)))
+
+        def find(n):
+            while parent[n] != n:
+                parent[n] = parent[parent[n]]
+                n = parent[n]
+            return n
+
+        for n1, n2, xl in self.edges:
+            r1 = find(n1)
+            r2 = find(n2)
+            if r1 != r2:
+                parent[r2] = r1
+
+        # number the components from zero in the order their first residue was seen
+        ids = {}
+        self.components = []
+        for n in range(len(self.nodes)):
+            root = find(n)
+            if root not in ids:
+                ids[root] = len(ids)
+            self.components.append(ids[root])
+
+        return self.components
+
+
+    def num_components(self):
+        return len(set(self.connected_components()))
+
+
+#------------------------------------------------------------------------------------
+
+    def export(self, filename):
+        '''
+        Save the chain pair counts and the per-residue degrees and components in csv format
+        '''
+
+        components = self.connected_components()
+
+        with open(filename, 'w') as f:
+
+            f.write('Chain 1,Chain 2,Satisfied,Violated,Threshold\n')
+
+            for i, c1 in enumerate(self.chains):
+                for c2 in self.chains[i:]:
+                    num_sat = self.pair_sat.get((c1, c2), 0)
+                    num_viol = self.pair_viol.get((c1, c2), 0)
+
+                    if num_sat or num_viol:
+                        f.write('{0},{1},{2},{3},{4}\n'.format(c1, c2, num_sat, num_viol, self.threshold))
+
+            f.write('\nChain,Residue,Degree,Satisfied,Violated,Component\n')
+
+            for chain, resid, deg, num_sat, num_viol in self.residue_hubs():
+                n = self.node_index[(chain, resid)]
+                f.write('{0},{1},{2},{3},{4},{5}\n'.format(chain, resid, deg, num_sat, num_viol, components[n]))
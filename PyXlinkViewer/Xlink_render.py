@@ -0,0 +1,478 @@
+'''
+Xlink_render.py
+
+Functions and a class used by the PyXlinkViewer PyMOL plugin to render figure panels in bulk - an
+image for each combination of a set of models, views, thresholds and display filters.
+
+The images are shared between several headless PyMOL processes, each of which loads a copy of
+the session and of the viewer state and ray-traces its share. Within a process the xlink
+coordinates of a model are fetched once, and the xlinks are drawn as a few CGO layers (satisfied
+and violated, intra-chain and inter-chain, and mono-links). Between images only the layers whose
+xlinks have changed (e.g. the threshold has moved past some of the distances) are rebuilt, and
+the filters just enable and disable layers. The images are ordered by model and threshold so that
+neighbouring images share as much geometry as possible. The images are saved to a directory with
+a manifest.csv of the settings of each.
+
+The worker processes run this file as a script:
+
+python Xlink_render.py job.json
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import itertools
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+
+# NB. PyMOL and the viewer modules are imported by the functions which use them, as a worker process has to start
+# PyMOL before they are imported
+
+
+# the classes of link a filter can name, in the order of Xlink_controller.Display_options
+FILTER_WORDS = ['satisfied', 'violated', 'inter', 'intra', 'mono']
+
+# the CGO layers the xlinks are drawn in, with whether their xlinks are satisfied and inter-chain
+LAYERS = [('render_satisfied_intra', True, False), ('render_satisfied_inter', True, True),
+          ('render_violated_intra', False, False), ('render_violated_inter', False, True)]
+
+MONO_LAYER = 'render_monos'
+
+MANIFEST_COLUMNS = ['Image', 'Model', 'View', 'Threshold', 'Filter', 'Satisfied', 'Violated', 'Worker', 'Seconds', 'Status']
+
+# an image to render - view_name is a scene name or 'current', and view the scene name or the 18 values of the view
+Frame = namedtuple('Frame', ['image', 'obj', 'view_name', 'view', 'threshold', 'filter'])
+
+
+def parse_filter(spec):
+    '''
+    Returns the display options (show_satisfied, show_violated, show_inter, show_intra, show_mono) of a filter - a
+    '+' separated list of the links to show, e.g. 'violated+inter'. Xlinks of both states are shown unless satisfied
+    or violated is given, and of both types unless inter or intra is given, so 'all' shows every xlink
+    '''
+
+    words = [word for word in spec.strip().lower().split('+') if word and word != 'all']
+
+    for word in words:
+        if word not in FILTER_WORDS:
+            raise ValueError('Unknown filter: ' + spec)
+
+    bState = 'satisfied' in words or 'violated' in words
+    bType = 'inter' in words or 'intra' in words
+
+    return (not bState or 'satisfied' in words, not bState or 'violated' in words,
+            not bType or 'inter' in words, not bType or 'intra' in words, 'mono' in words)
+
+
+def filter_spec(options):
+    '''
+    Returns the filter which gives a set of display options (the reverse of parse_filter)
+    '''
+
+    words = [word for word, bShow in zip(FILTER_WORDS[:4], options[:4]) if bShow]
+
+    if all(options[:4]):
+        words = ['all']
+
+    if options[4]:
+        words.append('mono')
+
+    return '+'.join(words)
+
+
+def grid_product(objs, views, thresholds, filters):
+    '''
+    Returns every combination of lists of models, views, thresholds and filters
+    '''
+
+    return list(itertools.product(objs, views, thresholds, filters))
+
+
+def read_grid(filename):
+    '''
+    Reads the combinations to render from a csv file with Model, View, Threshold and Filter columns. Returns a list of
+    (model, view, threshold, filter) tuples, with None for the columns which aren't in the file
+    '''
+
+    with open(filename) as f:
+        lines = [line.strip() for line in f if line.strip()]
+
+    header = [name.strip().lower() for name in lines[0].split(',')]
+
+    combos = []
+
+    for line in lines[1:]:
+        row = dict(zip(header, [value.strip() for value in line.split(',')]))
+
+        threshold = row.get('threshold')
+        combos.append((row.get('model') or None, row.get('view') or None,
+                       float(threshold) if threshold else None, row.get('filter') or None))
+
+    return combos
+
+
+def make_frames(combos, current_view):
+    '''
+    Returns the frames for a list of (model, view, threshold, filter) combinations, ordered by model and threshold so
+    that neighbouring frames share geometry, and named by their position in the list. A view of 'current' is the
+    current view (current_view)
+    '''
+
+    frames = []
+
+    for i, (obj, view_name, threshold, spec) in enumerate(combos):
+
+        view = list(current_view) if view_name == 'current' else view_name
+
+        image = '{0:04d}_{1}_{2}_{3:g}A_{4}.png'.format(i + 1, obj, view_name, threshold, spec)
+        image = re.sub(r'[^\w.+-]', '_', image)
+
+        frames.append(Frame(image, obj, view_name, view, float(threshold), spec))
+
+    # the models keep the order they are first given in
+    order = {}
+    for frame in frames:
+        order.setdefault(frame.obj, len(order))
+
+    return sorted(frames, key=lambda frame: (order[frame.obj], frame.threshold))
+
+
+def split_frames(frames, num_workers):
+    '''
+    Splits a list of frames into num_workers runs of neighbouring frames of nearly equal length
+    '''
+
+    size, extra = divmod(len(frames), num_workers)
+
+    chunks = []
+    start = 0
+    for i in range(num_workers):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(frames[start:end])
+        start = end
+
+    return [chunk for chunk in chunks if chunk]
+
+
+#------------------------------------------------------------------------------------
+
+class Frame_renderer():
+
+    def __init__(self, viewer, models):
+
+        self.viewer = viewer
+
+        # the models of the frames, of which only the model of the current frame is enabled
+        self.models = models
+
+        # the model the geometry is cached for, and the xlinks, end points, whether each xlink can be drawn, the
+        # distances and whether each is inter-chain
+        self.obj = None
+        self.geometry = None
+
+        # layer -> indexes of the xlinks drawn in the layer
+        self.loaded = {}
+        self.bMonos_loaded = False
+
+        # the mono-links are drawn as a single layer, and B-factor colouring can't be switched off per image
+        viewer.mono_obj = MONO_LAYER
+        viewer.lod_link_limit = 0
+        if viewer.mono_mode == 'bfactor':
+            viewer.mono_mode = 'gradient'
+
+
+    def set_model(self, obj):
+        '''
+        Makes a model current, calculating its distances and fetching the coordinates of its xlinks if it has changed
+        '''
+
+        if obj == self.obj:
+            return
+
+        from pymol import cmd
+        import numpy as np
+
+        viewer = self.viewer
+
+        if obj != viewer.obj:
+            viewer.set_obj(obj)
+            viewer.calculate_distances()
+
+        xlinks = viewer.get_xlinks()
+        xyz1, xyz2, found1, found2 = viewer.get_xlink_coords(xlinks)
+
+        distance = np.array([xl.distance for xl in xlinks], dtype=float)
+        bInter = np.array([xl.chain1 != xl.chain2 for xl in xlinks], dtype=bool)
+
+        # the inter-chain xlinks are restricted by the viewer's interface filter in every frame
+        bShown = np.array([viewer.interface_shown(xl) for xl in xlinks], dtype=bool)
+
+        self.geometry = (xlinks, xyz1, xyz2, found1 & found2 & (distance != 0) & bShown, distance, bInter)
+        self.obj = obj
+
+        # the layers of the previous model are out of date
+        for name in list(self.loaded) + [MONO_LAYER]:
+            cmd.delete(name)
+        self.loaded = {}
+        self.bMonos_loaded = False
+
+        for model in self.models:
+            if model == obj:
+                cmd.enable(model)
+            else:
+                cmd.disable(model)
+
+
+    def update_layers(self, threshold):
+        '''
+        Rebuilds the layers whose xlinks at a threshold differ from the xlinks they were drawn with
+        '''
+
+        from pymol import cmd
+        import numpy as np
+        import Xlink_geometry
+
+        xlinks, xyz1, xyz2, drawable, distance, bInter = self.geometry
+        sat = distance <= threshold
+
+        for name, bSatisfied, bInter_layer in LAYERS:
+
+            rows = np.flatnonzero(drawable & (sat == bSatisfied) & (bInter == bInter_layer))
+
+            if name in self.loaded and np.array_equal(self.loaded[name], rows):
+                continue
+
+            cmd.delete(name)
+
+            if len(rows):
+                rgb, radius = self.viewer.get_link_styles([xlinks[i] for i in rows], sat[rows])
+                cmd.load_cgo(Xlink_geometry.cylinder_cgo(xyz1[rows], xyz2[rows], radius, rgb), name)
+
+            self.loaded[name] = rows
+
+
+    def render(self, frame, directory, width, height, dpi, bRay):
+        '''
+        Draws a frame and saves its image. Returns the numbers of satisfied and violated xlinks shown
+        '''
+
+        from pymol import cmd
+
+        show_sat, show_viol, show_inter, show_intra, show_mono = parse_filter(frame.filter)
+
+        self.set_model(frame.obj)
+        self.update_layers(frame.threshold)
+
+        num_sat = 0
+        num_viol = 0
+
+        for name, bSatisfied, bInter in LAYERS:
+
+            if (show_sat if bSatisfied else show_viol) and (show_inter if bInter else show_intra):
+                cmd.enable(name)
+                if bSatisfied:
+                    num_sat += len(self.loaded[name])
+                else:
+                    num_viol += len(self.loaded[name])
+            else:
+                cmd.disable(name)
+
+        if show_mono and not self.bMonos_loaded:
+            self.viewer.draw_monos(self.viewer.obs_monos)
+            self.bMonos_loaded = True
+
+        if show_mono:
+            cmd.enable(MONO_LAYER)
+        else:
+            cmd.disable(MONO_LAYER)
+
+        if isinstance(frame.view, list):
+            cmd.set_view(frame.view)
+        else:
+            cmd.scene(frame.view, 'recall', view=1, color=0, active=0, rep=0, frame=0, animate=0)
+
+        cmd.png(os.path.join(directory, frame.image), width=width, height=height, dpi=dpi, ray=int(bRay), quiet=1)
+
+        return num_sat, num_viol
+
+
+def run_worker(job_file):
+    '''
+    Renders the frames of a job in a new headless PyMOL, writing a json line of the manifest entry of each frame to
+    the job's results file as it is finished
+    '''
+
+    with open(job_file) as f:
+        job = json.load(f)
+
+    import pymol
+    pymol.finish_launching(['pymol', '-qc'])
+
+    from pymol import cmd
+    from BXlink_viewer import BXlink_viewer
+    import Xlink_session
+
+    cmd.load(job['session'])
+
+    # the xlinks drawn in the session are replaced by the layers
+    for name in job['exclude']:
+        cmd.delete(name)
+
+    cmd.set('max_threads', job['threads'])
+
+    viewer = BXlink_viewer()
+    Xlink_session.load_state(viewer, job['state'])
+
+    renderer = Frame_renderer(viewer, job['models'])
+
+    with open(job['results'], 'w') as f:
+
+        for values in job['frames']:
+            frame = Frame(*values)
+            start = time.time()
+
+            try:
+                num_sat, num_viol = renderer.render(frame, job['directory'], job['width'], job['height'], job['dpi'], job['ray'])
+                status = 'ok'
+            except Exception as e:
+                num_sat, num_viol = '', ''
+                status = 'failed: ' + str(e).replace(',', ';')
+
+            f.write(json.dumps(manifest_row(frame, num_sat, num_viol, job['worker'], time.time() - start, status)) + '\n')
+            f.flush()
+
+
+#------------------------------------------------------------------------------------
+
+def manifest_row(frame, num_sat, num_viol, worker, seconds, status):
+    return [frame.image, frame.obj, frame.view_name, '{0:g}'.format(frame.threshold), frame.filter, num_sat, num_viol,
+            worker, '{0:.2f}'.format(seconds), status]
+
+
+def write_manifest(filename, rows):
+    '''
+    Saves the manifest of the rendered images in csv format
+    '''
+
+    with open(filename, 'w') as f:
+
+        f.write(','.join(MANIFEST_COLUMNS) + '\n')
+
+        for row in rows:
+            f.write(','.join(str(value) for value in row) + '\n')
+
+
+def viewer_objects(viewer):
+    '''
+    Returns the names of all PyMOL objects the viewer may have drawn
+    '''
+
+    return ([xl.obj_name for xl in viewer.obs_xlinks] + [mono.obj_name for mono in viewer.obs_monos] +
+            [viewer.lod_cylinder_obj, viewer.lod_line_obj, viewer.mono_obj])
+
+
+def render_batch(viewer, directory, combos, width=1200, height=900, dpi=300, bRay=True, num_workers=4, executable=None):
+    '''
+    Renders an image for each of a list of (model, view, threshold, filter) combinations (see make_frames) with the
+    xlinks of a viewer, split between num_workers headless PyMOL processes run with executable (by default the current
+    Python). Saves the images and manifest.csv to a directory, and returns the rows of the manifest in the order
+    of the combinations
+    '''
+
+    from pymol import cmd
+    import Xlink_session
+
+    frames = make_frames(combos, cmd.get_view())
+    models = sorted(set(frame.obj for frame in frames))
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    num_workers = max(1, min(int(num_workers), len(frames)))
+    threads = max(1, (os.cpu_count() or 1) // num_workers)
+
+    temp_dir = tempfile.mkdtemp(prefix='xlink_render_', dir=directory)
+
+    try:
+        session = os.path.join(temp_dir, 'session.pse')
+        state = os.path.join(temp_dir, 'state.npz')
+
+        cmd.save(session)
+        Xlink_session.save_state(viewer, state)
+
+        workers = []
+
+        for i, chunk in enumerate(split_frames(frames, num_workers)):
+
+            job = {
+                'worker': i + 1, 'session': session, 'state': state, 'exclude': viewer_objects(viewer),
+                'models': models, 'frames': [list(frame) for frame in chunk], 'directory': os.path.abspath(directory),
+                'width': int(width), 'height': int(height), 'dpi': int(dpi), 'ray': bool(bRay), 'threads': threads,
+                'results': os.path.join(temp_dir, 'results_{0}.json'.format(i + 1)),
+            }
+
+            job_file = os.path.join(temp_dir, 'job_{0}.json'.format(i + 1))
+            with open(job_file, 'w') as f:
+                json.dump(job, f)
+
+            log = open(os.path.join(temp_dir, 'worker_{0}.log'.format(i + 1)), 'w')
+            process = subprocess.Popen([executable or sys.executable, os.path.abspath(__file__), job_file],
+                                       stdout=log, stderr=subprocess.STDOUT)
+
+            workers.append((process, log, job, chunk))
+
+        rows = {}
+
+        for process, log, job, chunk in workers:
+            code = process.wait()
+            log.close()
+
+            if os.path.exists(job['results']):
+                with open(job['results']) as f:
+                    for line in f:
+                        row = json.loads(line)
+                        rows[row[0]] = row
+
+            # frames a worker didn't reach (e.g. it crashed) are listed as failed
+            for frame in chunk:
+                if frame.image not in rows:
+                    rows[frame.image] = manifest_row(frame, '', '', job['worker'], 0., 'failed: worker exited with code {0}'.format(code))
+
+            if code != 0:
+                with open(log.name) as f:
+                    print('PyXlinkViewer: render worker {0} failed:\n{1}'.format(job['worker'], f.read()[-2000:]))
+
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    rows = [rows[image] for image in sorted(rows)]
+    write_manifest(os.path.join(directory, 'manifest.csv'), rows)
+
+    return rows
+
+
+if __name__ == '__main__':
+    run_worker(sys.argv[1])
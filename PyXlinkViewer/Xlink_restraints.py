@@ -0,0 +1,172 @@
+'''
+Xlink_restraints.py
+
+Functions used by the PyXlinkViewer PyMOL plugin to score a model against the observed xlinks
+treated as distance restraints, and to check whether a rigid-body move of one chain relative to
+another would reduce the number of violated inter-chain xlinks.
+
+Each xlink contributes a flat-bottom penalty - zero up to the threshold distance, then rising
+with the square of the distance beyond it - and the score of a model is the sum of the penalties.
+The placement search works on NumPy arrays of the xlink end points: a batch of candidate rotations
+and translations of the moving chain is applied to all of its end points at once with a single
+einsum, so thousands of placements are scored per call. The search samples placements around the
+best placement found so far, halving the sampled range each round.
+
+NB. the placement search only considers the xlinks, not steric clashes between the chains, so it
+is a check of whether the xlinks are consistent with a different arrangement of the chains rather
+than a docking method.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import numpy as np
+
+
+def flat_bottom_penalties(distances, threshold, force_constant=1.0):
+    '''
+    Returns the flat-bottom penalty of each distance - zero up to the threshold, then the force constant times the
+    square of the excess distance
+    '''
+
+    excess = np.maximum(np.asarray(distances, dtype=float) - threshold, 0.)
+
+    return force_constant * excess ** 2
+
+
+def restraint_score(distances, threshold, force_constant=1.0):
+    '''
+    Returns the sum of the flat-bottom penalties of a set of xlink distances
+    '''
+
+    return float(flat_bottom_penalties(distances, threshold, force_constant).sum())
+
+
+#------------------------------------------------------------------------------------
+
+def random_rotations(num, max_angle, rng):
+    '''
+    Returns a (num, 3, 3) array of rotation matrices about random axes by random angles of up to max_angle radians,
+    made with Rodrigues' formula
+    '''
+
+    axes = rng.normal(size=(num, 3))
+    axes /= np.linalg.norm(axes, axis=1)[:, None]
+    angles = rng.uniform(0., max_angle, num)
+
+    # cross product matrix of each axis
+    k = np.zeros((num, 3, 3))
+    k[:, 0, 1], k[:, 0, 2] = -axes[:, 2], axes[:, 1]
+    k[:, 1, 0], k[:, 1, 2] = axes[:, 2], -axes[:, 0]
+    k[:, 2, 0], k[:, 2, 1] = -axes[:, 1], axes[:, 0]
+
+    return np.eye(3) + np.sin(angles)[:, None, None] * k + (1. - np.cos(angles))[:, None, None] * np.matmul(k, k)
+
+
+def score_placements(fixed, moving, centre, rotations, shifts, threshold, force_constant=1.0):
+    '''
+    Scores a batch of placements of the moving chain. Each placement rotates the moving end points about the centre
+    and then shifts them. Returns arrays of the restraint score and the number of violated xlinks of each placement
+    '''
+
+    moved = np.einsum('mij,nj->mni', rotations, moving - centre) + (centre + shifts)[:, None, :]
+    dists = np.sqrt(((moved - fixed[None, :, :]) ** 2).sum(axis=2))
+
+    scores = flat_bottom_penalties(dists, threshold, force_constant).sum(axis=1)
+    num_violated = (dists > threshold).sum(axis=1)
+
+    return scores, num_violated
+
+
+def search_placement(fixed, moving, centre, threshold, num_samples=5000, num_rounds=6, max_shift=10.0,
+                     max_angle=30.0, force_constant=1.0, chunk_size=2000, seed=0):
+    '''
+    Searches for the rigid-body placement of the moving chain which minimises the restraint score of the xlinks
+    between two chains. fixed and moving are (n, 3) arrays of the end points of the xlinks in each chain, and centre
+    the point the moving chain is rotated about (e.g. its centroid). max_shift is in Angstroms and max_angle in
+    degrees. Returns a dictionary of the best rotation and shift, and the score and number of violated xlinks before
+    and after
+    '''
+
+    fixed = np.asarray(fixed, dtype=float).reshape(-1, 3)
+    moving = np.asarray(moving, dtype=float).reshape(-1, 3)
+    centre = np.asarray(centre, dtype=float)
+
+    rng = np.random.RandomState(seed)
+
+    best_rotation = np.eye(3)
+    best_shift = np.zeros(3)
+
+    scores, num_violated = score_placements(fixed, moving, centre, best_rotation[None], best_shift[None], threshold, force_constant)
+    initial_score, initial_violated = float(scores[0]), int(num_violated[0])
+    best_score, best_violated = initial_score, initial_violated
+
+    shift_range = float(max_shift)
+    angle_range = np.radians(max_angle)
+
+    for i in range(num_rounds):
+
+        # sample placements around the best so far - the sampled rotation is applied after the best rotation,
+        # about the centre as moved by the best shift
+        rotations = np.matmul(random_rotations(num_samples, angle_range, rng), best_rotation)
+        shifts = best_shift + rng.uniform(-shift_range, shift_range, (num_samples, 3))
+
+        for start in range(0, num_samples, chunk_size):
+            end = start + chunk_size
+
+            scores, num_violated = score_placements(fixed, moving, centre, rotations[start:end], shifts[start:end],
+                                                    threshold, force_constant)
+            best = int(scores.argmin())
+
+            if scores[best] < best_score:
+                best_score, best_violated = float(scores[best]), int(num_violated[best])
+                best_rotation, best_shift = rotations[start + best], shifts[start + best]
+
+        shift_range /= 2.
+        angle_range /= 2.
+
+    angle = np.degrees(np.arccos(np.clip((np.trace(best_rotation) - 1.) / 2., -1., 1.)))
+
+    return {
+        'rotation': best_rotation,
+        'shift': best_shift,
+        'shift_length': float(np.linalg.norm(best_shift)),
+        'centre': centre,
+        'angle': float(angle),
+        'score': best_score,
+        'num_violated': best_violated,
+        'initial_score': initial_score,
+        'initial_violated': initial_violated,
+        'num_xlinks': len(fixed),
+        'num_evaluated': 1 + num_samples * num_rounds,
+        'matrix': transform_matrix(best_rotation, best_shift, centre),
+    }
+
+
+def transform_matrix(rotation, shift, centre):
+    '''
+    Returns a placement as a 16 element row-major homogeneous matrix, as used by cmd.transform_selection with
+    homogenous=1
+    '''
+
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation
+    matrix[:3, 3] = centre + shift - np.dot(rotation, centre)
+
+    return matrix.ravel().tolist()
@@ -0,0 +1,122 @@
+'''
+Xlink_sensitivity.py
+
+Functions used by the PyXlinkViewer PyMOL plugin to show how the numbers of satisfied xlinks
+depend on the threshold distance, so that a threshold can be chosen from the whole curve rather
+than by trying values one at a time.
+
+The distances are sorted once. The number of xlinks satisfied at any threshold is then the
+position of the threshold in the sorted distances, so the counts at every threshold of a grid
+are found with a single searchsorted call. The curve is kept separately for all, intra-chain and
+inter-chain xlinks.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import math
+
+import numpy as np
+
+
+# the xlink types a curve is calculated for
+LINK_TYPES = ['all', 'intra', 'inter']
+
+
+def default_thresholds(distances, step=1.0):
+    '''
+    Returns thresholds from zero to the first multiple of step beyond the longest distance
+    '''
+
+    longest = float(np.max(distances)) if len(distances) else 0.
+
+    return np.arange(0., math.floor(longest / step) * step + 1.5 * step, step)
+
+
+def sensitivity_curve(distances, bInter, thresholds=None, step=1.0):
+    '''
+    Returns the numbers and fractions of xlinks satisfied at each of a set of thresholds (by default every step
+    Angstroms, see default_thresholds), for all xlinks and for the intra-chain and inter-chain xlinks. bInter is
+    whether each xlink is between different chains. The result is a dictionary with the thresholds, and for each
+    type of xlink its sorted distances, the total number of xlinks, and the number and fraction satisfied at each
+    threshold
+    '''
+
+    distances = np.asarray(distances, dtype=float)
+    bInter = np.asarray(bInter, dtype=bool)
+
+    if thresholds is None:
+        thresholds = default_thresholds(distances, step)
+    thresholds = np.asarray(thresholds, dtype=float)
+
+    curve = {'thresholds': thresholds}
+
+    for link_type, mask in zip(LINK_TYPES, [np.ones(len(distances), dtype=bool), ~bInter, bInter]):
+
+        sorted_dists = np.sort(distances[mask])
+
+        # a threshold satisfies every distance up to and including it
+        num_sat = np.searchsorted(sorted_dists, thresholds, side='right')
+
+        curve[link_type] = {
+            'distances': sorted_dists,
+            'total': len(sorted_dists),
+            'num_satisfied': num_sat,
+            'fraction': num_sat / float(len(sorted_dists)) if len(sorted_dists) else np.zeros(len(thresholds)),
+        }
+
+    return curve
+
+
+def step_points(sorted_dists):
+    '''
+    Returns the exact cumulative curve of a set of sorted distances - the fraction satisfied jumps to (i + 1) / n at
+    the i-th distance
+    '''
+
+    n = len(sorted_dists)
+
+    return sorted_dists, np.arange(1, n + 1) / float(max(n, 1))
+
+
+#------------------------------------------------------------------------------------
+
+def export_curves(named_curves, filename):
+    '''
+    Saves the curves of several models in csv format, with one row per model and threshold. named_curves is a list
+    of (name, curve) tuples
+    '''
+
+    with open(filename, 'w') as f:
+
+        header = ['Model', 'Threshold']
+        for link_type in LINK_TYPES:
+            header += ['Satisfied ' + link_type, 'Total ' + link_type, 'Fraction ' + link_type]
+
+        f.write(','.join(header) + '\n')
+
+        for name, curve in named_curves:
+            for i, threshold in enumerate(curve['thresholds']):
+
+                row = [name, '{0:.2f}'.format(threshold)]
+                for link_type in LINK_TYPES:
+                    entry = curve[link_type]
+                    row += [str(entry['num_satisfied'][i]), str(entry['total']), '{0:.4f}'.format(entry['fraction'][i])]
+
+                f.write(','.join(row) + '\n')
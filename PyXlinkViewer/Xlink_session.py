@@ -0,0 +1,431 @@
+'''
+Xlink_session.py
+
+Functions used by the PyXlinkViewer PyMOL plugin to save the state of a BXlink_viewer (the parsed
+xlinks and mono-links, their distances, and the display settings) and restore it later, either
+inside a PyMOL session (.pse) file or in a sidecar file.
+
+The state is stored as NumPy arrays in .npz format, with one array per field rather than a
+pickled object per xlink, so it is compact and quick to load. A checksum of the coordinates of the
+PyMOL object is stored with it, and the distances are only recalculated on restore if the
+coordinates have changed.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import hashlib
+import io
+import json
+
+from pymol import cmd
+import numpy as np
+
+from Obs_xlink import Obs_xlink
+from Obs_mono import Obs_mono
+from Xlink_comparison import Xlink_comparison
+from Xlink_columns import Xlink_columns
+from Interface_index import INTERFACE_LABELS
+import Xlink_store
+
+
+# key used to store the viewer state in a PyMOL session, and the version of the stored format
+SESSION_KEY = 'PyXlinkViewer'
+STATE_VERSION = 1
+
+# viewer member variables stored as settings
+SETTINGS = ['obj', 'xlink_file', 'xlink_file_type', 'threshold', 'mono_size', 'radius',
+            'satisfied_colour', 'violated_colour', 'mono_colour',
+            'show_satisied', 'show_violated', 'show_inter', 'show_intra', 'show_mono',
+            'lod_mode', 'lod_link_limit', 'cull_to_view', 'distance_mode',
+            'chain_equivalence', 'query_text', 'mono_mode', 'mono_low_colour', 'mono_palette',
+            'show_fold_change', 'fc_threshold', 'reference_sequences',
+            'interface_filter', 'interface_cutoff', 'near_interface_cutoff', 'memory_budget',
+            'uncertainty_mode', 'min_confidence', 'uncertain_colour']
+
+
+def coords_checksum(obj):
+    '''
+    Returns a checksum of the current coordinates of a PyMOL object, or an empty string if it has no atoms
+    '''
+
+    xyz = cmd.get_coords("obj " + obj) if obj else None
+
+    if xyz is None:
+        return ''
+
+    return hashlib.sha1(np.ascontiguousarray(xyz).tobytes()).hexdigest()
+
+
+def encode_sites(sites):
+    return ';'.join(chain + ':' + resid for chain, resid in sites)
+
+
+def decode_sites(text):
+    return [tuple(site.split(':', 1)) for site in text.split(';') if site]
+
+
+def widen(texts, longer):
+    '''
+    Returns a string array widened to hold the strings of a list
+    '''
+
+    width = max([texts.dtype.itemsize // np.dtype('U1').itemsize] + [len(text) for text in longer])
+
+    return texts.astype('U' + str(max(1, width)))
+
+
+#------------------------------------------------------------------------------------
+
+def columns_to_arrays(columns):
+    '''
+    Returns a dictionary of the arrays of the xlinks held as columns (see Xlink_columns), in the format of
+    state_to_arrays. The text of each key is made once and picked out for every xlink
+    '''
+
+    key_chains = np.array([chain for chain, resid in columns.keys], dtype=str).reshape(-1)
+    key_resids = np.array([resid for chain, resid in columns.keys], dtype=str).reshape(-1)
+    key_sites = np.array([encode_sites([key]) for key in columns.keys], dtype=str).reshape(-1)
+    key_names = np.array([chain + '_' + resid for chain, resid in columns.keys], dtype=str).reshape(-1)
+
+    # the texts of the xlinks with candidate sites replace those picked out for their first sites, so the string
+    # arrays are widened to fit them
+    rows = sorted(columns.candidates)
+    candidates1 = [encode_sites(columns.candidates[row][0]) for row in rows]
+    candidates2 = [encode_sites(columns.candidates[row][1]) for row in rows]
+    candidate_names = [columns.obj_name(row) for row in rows]
+
+    sites1 = widen(key_sites[columns.reported1], candidates1)
+    sites2 = widen(key_sites[columns.reported2], candidates2)
+    obj_names = widen(np.char.add(np.char.add(key_names[columns.reported1], '-'), key_names[columns.reported2]), candidate_names)
+
+    if rows:
+        sites1[rows] = candidates1
+        sites2[rows] = candidates2
+        obj_names[rows] = candidate_names
+
+    labels = np.array(INTERFACE_LABELS + [''], dtype=str)
+
+    return {
+        'chain1': key_chains[columns.site1],
+        'resid1': key_resids[columns.site1],
+        'chain2': key_chains[columns.site2],
+        'resid2': key_resids[columns.site2],
+        'sites1': sites1,
+        'sites2': sites2,
+        'obj_name': obj_names,
+        'distance': columns.distance.astype(np.float64),
+        'interface': labels[columns.interface],
+        'sigma': columns.sigma.astype(np.float64),
+        'in_obj': np.column_stack([columns.found1, columns.found2]).reshape(-1, 2),
+        'intensities': np.zeros((len(columns), 0)),
+    }
+
+
+def arrays_to_columns(arrays):
+    '''
+    Returns the xlinks of a dictionary of state arrays as columns (see Xlink_columns). The keys of all of the sites
+    are numbered at once with np.unique
+    '''
+
+    columns = Xlink_columns()
+
+    texts, codes = Xlink_store.site_codes(arrays)
+
+    for text in texts:
+        columns.key_code(decode_sites(str(text))[0])
+
+    columns.set_ends(codes[0], codes[1])
+    columns.site1 = codes[2]
+    columns.site2 = codes[3]
+
+    ambiguous = np.flatnonzero((np.char.find(arrays['sites1'], ';') >= 0) | (np.char.find(arrays['sites2'], ';') >= 0))
+    for row in ambiguous:
+        columns.candidates[int(row)] = (decode_sites(str(arrays['sites1'][row])), decode_sites(str(arrays['sites2'][row])))
+
+    columns.distance = arrays['distance'].astype(np.float32)
+    columns.found1 = arrays['in_obj'][:, 0].astype(bool)
+    columns.found2 = arrays['in_obj'][:, 1].astype(bool)
+
+    if 'interface' in arrays:
+        columns.interface = Xlink_store.interface_levels(arrays['interface'])
+
+    if 'sigma' in arrays:
+        columns.sigma = arrays['sigma'].astype(np.float32)
+
+    return columns
+
+
+def store_to_columns(store):
+    '''
+    Returns the xlinks of a store (see Xlink_store) as columns whose code, distance and uncertainty arrays are the
+    memory-mapped columns of the file, so nothing is read or copied until it is used or changed. Only the residue keys
+    and the candidate sites of the ambiguous xlinks are decoded. Stores without residue codes are decoded in full
+    '''
+
+    if not store.has_codes():
+        return arrays_to_columns(store.to_arrays())
+
+    columns = Xlink_columns()
+
+    for text in store.get_column('key_sites'):
+        columns.key_code(decode_sites(text.decode('utf-8'))[0])
+
+    columns.reported1, columns.reported2, columns.site1, columns.site2 = [store.get_column(name) for name in Xlink_store.CODE_COLUMNS]
+
+    n = len(store)
+    flags = store.get_column('flags')
+
+    columns.found1 = (flags & Xlink_store.FLAG_RES1_IN_OBJ) > 0
+    columns.found2 = (flags & Xlink_store.FLAG_RES2_IN_OBJ) > 0
+    columns.distance = store.get_column('distance')
+
+    if 'interface_level' in store.columns:
+        columns.interface = store.get_column('interface_level')
+    else:
+        columns.interface = np.full(n, -1, dtype=np.int8)
+
+    if 'sigma' in store.columns:
+        columns.sigma = store.get_column('sigma')
+    else:
+        columns.sigma = np.zeros(n, dtype=np.float32)
+
+    columns.probability = np.full(n, np.nan, dtype=np.float32)
+
+    sites1 = store.get_column('sites1')
+    sites2 = store.get_column('sites2')
+    for row in np.flatnonzero(flags & Xlink_store.FLAG_AMBIGUOUS):
+        columns.candidates[int(row)] = (decode_sites(sites1[row].decode('utf-8')), decode_sites(sites2[row].decode('utf-8')))
+
+    return columns
+
+
+def state_to_arrays(viewer):
+    '''
+    Returns a dictionary of NumPy arrays holding the state of a BXlink_viewer
+    '''
+
+    xls = viewer.obs_xlinks
+    monos = viewer.obs_monos
+
+    settings = dict((name, getattr(viewer, name)) for name in SETTINGS)
+    settings['version'] = STATE_VERSION
+    settings['checksum'] = coords_checksum(viewer.obj)
+
+    # the conditions of a comparison - the intensities are stored with the xlinks
+    comparison = viewer.comparison
+    if comparison is not None:
+        settings['conditions'] = comparison.conditions
+        settings['comparison'] = [comparison.reference, comparison.test]
+
+    num_columns = max([len(xl.intensities) for xl in xls] + [0])
+    intensities = np.full((len(xls), num_columns), np.nan)
+    for i, xl in enumerate(xls):
+        for j, value in enumerate(xl.intensities):
+            if value is not None:
+                intensities[i, j] = value
+
+    monos_arrays = {
+        'settings': np.array(json.dumps(settings)),
+        'mono_chain': np.array([m.chain for m in monos], dtype=str),
+        'mono_resid': np.array([m.resid for m in monos], dtype=str),
+        'mono_obj_name': np.array([m.obj_name for m in monos], dtype=str),
+        'mono_value': np.array([np.nan if m.value is None else m.value for m in monos], dtype=np.float64),
+    }
+
+    if viewer.columns is not None:
+        arrays = columns_to_arrays(viewer.columns)
+        arrays['observed'] = np.zeros((0, 0), dtype=bool)
+        arrays.update(monos_arrays)
+        return arrays
+
+    # NB. string arrays are given an explicit type so that empty lists don't become float arrays
+    arrays = {
+        'chain1': np.array([xl.chain1 for xl in xls], dtype=str),
+        'resid1': np.array([xl.resid1 for xl in xls], dtype=str),
+        'chain2': np.array([xl.chain2 for xl in xls], dtype=str),
+        'resid2': np.array([xl.resid2 for xl in xls], dtype=str),
+        'sites1': np.array([encode_sites(xl.sites1) for xl in xls], dtype=str),
+        'sites2': np.array([encode_sites(xl.sites2) for xl in xls], dtype=str),
+        'obj_name': np.array([xl.obj_name for xl in xls], dtype=str),
+        'distance': np.array([xl.distance for xl in xls], dtype=np.float64),
+        'interface': np.array([xl.interface for xl in xls], dtype=str),
+        'sigma': np.array([xl.sigma for xl in xls], dtype=np.float64),
+        'in_obj': np.array([[xl.bRes1_in_obj, xl.bRes2_in_obj] for xl in xls], dtype=bool).reshape(-1, 2),
+        'intensities': intensities,
+        'observed': comparison.observed if comparison is not None else np.zeros((0, 0), dtype=bool),
+    }
+    arrays.update(monos_arrays)
+
+    return arrays
+
+
+def arrays_to_xlinks(arrays):
+    '''
+    Returns a list of Obs_xlink objects made from a dictionary of state arrays
+    '''
+
+    xlinks = []
+
+    for i in range(len(arrays['chain1'])):
+        xl = Obs_xlink()
+        xl.chain1 = str(arrays['chain1'][i])
+        xl.resid1 = str(arrays['resid1'][i])
+        xl.chain2 = str(arrays['chain2'][i])
+        xl.resid2 = str(arrays['resid2'][i])
+        xl.sites1 = decode_sites(str(arrays['sites1'][i]))
+        xl.sites2 = decode_sites(str(arrays['sites2'][i]))
+        xl.obj_name = str(arrays['obj_name'][i])
+        xl.distance = float(arrays['distance'][i])
+        xl.bRes1_in_obj = bool(arrays['in_obj'][i, 0])
+        xl.bRes2_in_obj = bool(arrays['in_obj'][i, 1])
+
+        # states saved before the interface labels were added are labelled when restored
+        if 'interface' in arrays:
+            xl.interface = str(arrays['interface'][i])
+
+        if 'sigma' in arrays:
+            xl.sigma = float(arrays['sigma'][i])
+
+        if 'intensities' in arrays:
+            xl.intensities = [None if np.isnan(v) else float(v) for v in arrays['intensities'][i]]
+        xlinks.append(xl)
+
+    return xlinks
+
+
+def arrays_to_state(viewer, arrays, columns=None):
+    '''
+    Restores the state of a BXlink_viewer from a dictionary of arrays made by state_to_arrays. Distances are only
+    recalculated if the coordinates of the PyMOL object have changed since the state was saved. The xlinks may be given
+    as columns instead (see store_to_columns), in which case they are kept as columns whatever the memory budget
+    '''
+
+    settings = json.loads(str(arrays['settings']))
+
+    for name in SETTINGS:
+        if name in settings:
+            setattr(viewer, name, settings[name])
+
+    viewer.obs_xlinks = []
+    viewer.columns = None
+
+    # with a memory budget the xlinks are restored as columns, unless they are the conditions of a comparison
+    if columns is not None:
+        viewer.columns = columns
+    elif viewer.memory_budget and not settings.get('conditions'):
+        viewer.columns = arrays_to_columns(arrays)
+    else:
+        viewer.obs_xlinks = arrays_to_xlinks(arrays)
+
+    viewer.obs_monos = []
+    for i in range(len(arrays['mono_chain'])):
+        mono = Obs_mono()
+        mono.chain = str(arrays['mono_chain'][i])
+        mono.resid = str(arrays['mono_resid'][i])
+        mono.obj_name = str(arrays['mono_obj_name'][i])
+
+        if 'mono_value' in arrays and not np.isnan(arrays['mono_value'][i]):
+            mono.value = float(arrays['mono_value'][i])
+        viewer.obs_monos.append(mono)
+
+    viewer.coord_index = None
+
+    viewer.comparison = None
+    if settings.get('conditions'):
+        viewer.comparison = Xlink_comparison.from_xlinks(viewer.obs_xlinks, settings['conditions'], arrays.get('observed'))
+        viewer.comparison.set_conditions(*settings['comparison'])
+        viewer.comparison.set_threshold(viewer.fc_threshold)
+
+    if settings.get('checksum') != coords_checksum(viewer.obj):
+        print('PyXlinkViewer: coordinates of ' + viewer.obj + ' have changed, recalculating xlink distances')
+        viewer.calculate_distances()
+    else:
+        viewer.xlink_index.build(viewer.obs_xlinks)
+
+        if 'interface' not in arrays:
+            viewer.label_interfaces()
+
+        # the uncertainties of the distances are kept, so only the probabilities are calculated again
+        if 'sigma' in arrays:
+            viewer.calculate_probabilities()
+        else:
+            viewer.calculate_uncertainties()
+
+    viewer.set_query(viewer.query_text)
+    viewer.build_network()
+
+
+#------------------------------------------------------------------------------------
+
+def save_state(viewer, f):
+    '''
+    Saves the state of a viewer to a file name or file object in .npz format
+    '''
+
+    np.savez_compressed(f, **state_to_arrays(viewer))
+
+
+def load_state(viewer, f):
+    '''
+    Restores the state of a viewer from a file name or file object saved with save_state
+    '''
+
+    with np.load(f, allow_pickle=False) as data:
+        arrays = dict((name, data[name]) for name in data.files)
+
+    arrays_to_state(viewer, arrays)
+
+
+def state_to_bytes(viewer):
+    f = io.BytesIO()
+    save_state(viewer, f)
+    return f.getvalue()
+
+
+def bytes_to_state(viewer, data):
+    load_state(viewer, io.BytesIO(data))
+
+
+#------------------------------------------------------------------------------------
+
+def save_session(viewer, session):
+    '''
+    Stores the viewer state in a PyMOL session dictionary when a session is saved, if there are xlinks to store
+    '''
+
+    if viewer.num_xlinks() or viewer.obs_monos:
+        session[SESSION_KEY] = state_to_bytes(viewer)
+
+
+def restore_session(get_viewer, session):
+    '''
+    Restores the viewer state from a PyMOL session dictionary when a session is loaded. get_viewer is a function
+    returning the viewer, so that it is only created if the session holds a state. Returns whether a state was
+    restored
+    '''
+
+    data = session.get(SESSION_KEY)
+
+    if data is None:
+        return False
+
+    bytes_to_state(get_viewer(), data)
+
+    return True
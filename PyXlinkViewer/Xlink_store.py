@@ -0,0 +1,300 @@
+'''
+Xlink_store.py
+
+Functions and a class used by the PyXlinkViewer PyMOL plugin to save xlinks and mono-links, with
+their distances and quantitative values, in a compact binary columnar file which can be opened
+again without re-parsing the original xlink file. Only NumPy is needed to read the file, so it
+can also be used by scripts outside PyMOL.
+
+The file starts with a magic string and the length of a JSON header, followed by the header
+itself. The header holds the viewer settings and the dtype, shape and offset of each column.
+The columns follow, each aligned to 64 bytes: fixed-width byte strings for the chains, residues
+and object names, float32 distances and scores, and a byte of flags per xlink. The distinct
+residues are also stored once, with int32 codes of the residues of each xlink and an int8
+interface level, so that the xlinks can be used as Xlink_columns without decoding any strings.
+The file is memory-mapped once, and each column is a view into the mapping, so opening a store
+only reads the header - the columns are paged in by the OS when they are used, and the page
+cache is shared between processes reading the same file.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+import json
+import os
+import struct
+
+import numpy as np
+
+from Interface_index import INTERFACE_LABELS
+
+
+MAGIC = b'PXLSTORE'
+STORE_VERSION = 1
+
+# file extension used for stores
+STORE_EXTENSION = '.pxl'
+
+# columns (and the header) start on multiples of this many bytes
+ALIGN = 64
+
+# columns stored as float32
+FLOAT_COLUMNS = set(['distance', 'sigma', 'intensities', 'mono_value'])
+
+# bits of the flags column
+FLAG_RES1_IN_OBJ = 1
+FLAG_RES2_IN_OBJ = 2
+FLAG_AMBIGUOUS = 4
+
+# columns of the residue key table and the codes of the residues of each xlink (see site_codes)
+CODE_COLUMNS = ['key_reported1', 'key_reported2', 'key_site1', 'key_site2']
+
+
+def aligned(num_bytes):
+    return (num_bytes + ALIGN - 1) // ALIGN * ALIGN
+
+
+def is_store(filename):
+    '''
+    Returns whether a file is an xlink store, by checking its magic string
+    '''
+
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except IOError:
+        return False
+
+
+#------------------------------------------------------------------------------------
+
+def site_codes(arrays):
+    '''
+    Returns an array of the distinct 'chain:resid' texts of the first reported site and the chosen site of each end of
+    the xlinks of a dictionary of state arrays, and a (4, n) int32 array of the positions of the reported and chosen
+    sites of each xlink in it. All of the sites are numbered at once with np.unique
+    '''
+
+    n = len(arrays['chain1'])
+
+    reported = [np.array([text.split(';', 1)[0] for text in arrays[name]], dtype=str).reshape(-1) for name in ['sites1', 'sites2']]
+    chosen = [np.char.add(np.char.add(arrays[chain], ':'), arrays[resid]) for chain, resid in [('chain1', 'resid1'), ('chain2', 'resid2')]]
+
+    texts, codes = np.unique(np.concatenate(reported + chosen), return_inverse=True)
+
+    return texts, codes.reshape(4, n).astype(np.int32)
+
+
+def interface_levels(labels):
+    '''
+    Returns an int8 array of the position of each interface label in INTERFACE_LABELS, -1 for none
+    '''
+
+    levels = np.full(len(labels), -1, dtype=np.int8)
+
+    for i, label in enumerate(INTERFACE_LABELS):
+        levels[np.asarray(labels) == label] = i
+
+    return levels
+
+
+def encode(col):
+    '''
+    Returns a string array as fixed-width byte strings, as wide as the longest value (and at least one byte)
+    '''
+
+    encoded = np.char.encode(col, 'utf-8') if col.size else np.zeros(col.shape, dtype='S1')
+
+    return encoded.astype('S' + str(max(1, encoded.dtype.itemsize)))
+
+
+def to_columns(arrays):
+    '''
+    Converts a dictionary of state arrays (as made by Xlink_session.state_to_arrays) to the columns stored in a file
+    '''
+
+    columns = {}
+
+    for name, col in arrays.items():
+
+        if name == 'settings':
+            continue
+
+        if name == 'in_obj':
+            flags = col[:, 0] * FLAG_RES1_IN_OBJ + col[:, 1] * FLAG_RES2_IN_OBJ
+            ambiguous = np.array([';' in s1 or ';' in s2 for s1, s2 in zip(arrays['sites1'], arrays['sites2'])], dtype=bool)
+            columns['flags'] = (flags + ambiguous * FLAG_AMBIGUOUS).astype(np.uint8)
+
+        elif col.dtype.kind == 'U':
+            columns[name] = encode(col)
+
+        elif name in FLOAT_COLUMNS:
+            columns[name] = col.astype(np.float32)
+
+        else:
+            columns[name] = col
+
+    texts, codes = site_codes(arrays)
+    columns['key_sites'] = encode(texts)
+    for name, code in zip(CODE_COLUMNS, codes):
+        columns[name] = code
+
+    if 'interface' in arrays:
+        columns['interface_level'] = interface_levels(arrays['interface'])
+
+    return columns
+
+
+def from_columns(columns):
+    '''
+    Converts stored columns back to a dictionary of state arrays in memory
+    '''
+
+    arrays = {}
+
+    for name, col in columns.items():
+
+        if name == 'flags':
+            arrays['in_obj'] = np.column_stack([(col & FLAG_RES1_IN_OBJ) > 0, (col & FLAG_RES2_IN_OBJ) > 0]).reshape(-1, 2)
+
+        elif col.dtype.kind == 'S':
+            arrays[name] = np.char.decode(col, 'utf-8') if col.size else np.array([], dtype=str)
+
+        elif name in FLOAT_COLUMNS:
+            arrays[name] = col.astype(np.float64)
+
+        else:
+            arrays[name] = np.array(col)
+
+    return arrays
+
+
+#------------------------------------------------------------------------------------
+
+def write_store(filename, arrays):
+    '''
+    Writes a dictionary of state arrays (as made by Xlink_session.state_to_arrays) to a store file. The file is written
+    under a temporary name and then renamed, so a store which is open (and mapped) can be saved over
+    '''
+
+    columns = to_columns(arrays)
+
+    layout = []
+    offset = 0
+
+    for name in sorted(columns):
+        col = np.ascontiguousarray(columns[name])
+        layout.append({'name': name, 'dtype': col.dtype.str, 'shape': list(col.shape), 'offset': offset})
+        offset = aligned(offset + col.nbytes)
+
+    header = json.dumps({
+        'version': STORE_VERSION,
+        'num_xlinks': int(len(arrays['chain1'])),
+        'num_monos': int(len(arrays['mono_chain'])),
+        'settings': json.loads(str(arrays['settings'])),
+        'columns': layout,
+    }).encode('utf-8')
+
+    data_start = aligned(len(MAGIC) + 8 + len(header))
+
+    temp_filename = filename + '.tmp'
+
+    with open(temp_filename, 'wb') as f:
+
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+
+        for entry in layout:
+            f.write(b'\0' * (data_start + entry['offset'] - f.tell()))
+            f.write(np.ascontiguousarray(columns[entry['name']]).tobytes())
+
+    os.replace(temp_filename, filename)
+
+
+class Xlink_store():
+
+    def __init__(self, filename):
+
+        self.filename = filename
+
+        with open(filename, 'rb') as f:
+
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(filename + ' is not an xlink store')
+
+            header_size = struct.unpack('<Q', f.read(8))[0]
+            self.header = json.loads(f.read(header_size).decode('utf-8'))
+
+        if self.header['version'] > STORE_VERSION:
+            raise ValueError(filename + ' was written by a newer version of PyXlinkViewer')
+
+        data_start = aligned(len(MAGIC) + 8 + header_size)
+
+        # map the whole file once - each column is a view into the mapping. The mapping is copy-on-write, so the
+        # columns can be changed in memory (e.g. distances recalculated) without changing the file, and only the pages
+        # which are changed are copied
+        self.mmap = np.memmap(filename, dtype=np.uint8, mode='c')
+
+        self.columns = {}
+        for entry in self.header['columns']:
+            self.columns[entry['name']] = np.ndarray(tuple(entry['shape']), dtype=np.dtype(entry['dtype']),
+                                                     buffer=self.mmap, offset=data_start + entry['offset'])
+
+
+    def __len__(self):
+        return self.header['num_xlinks']
+
+
+    def get_settings(self):
+        return self.header['settings']
+
+
+    def get_column(self, name):
+        '''
+        Returns a stored column as a memory-mapped array, without reading it into memory
+        '''
+
+        return self.columns[name]
+
+
+    def has_codes(self):
+        '''
+        Returns whether the store holds the residue codes of the xlinks, which stores written by earlier versions don't
+        '''
+
+        return 'key_sites' in self.columns
+
+
+    def to_arrays(self, bXlinks=True):
+        '''
+        Returns the state arrays held in the store, read into memory, for Xlink_session.arrays_to_state. If bXlinks is
+        false only the settings and mono-links are read, and the columns of the xlinks are left as memory-mapped views
+        (see Xlink_session.store_to_columns)
+        '''
+
+        if bXlinks:
+            arrays = from_columns(self.columns)
+        else:
+            arrays = dict(self.columns)
+            arrays.update(from_columns(dict((name, col) for name, col in self.columns.items() if name.startswith('mono_'))))
+
+        arrays['settings'] = np.array(json.dumps(self.get_settings()))
+
+        return arrays
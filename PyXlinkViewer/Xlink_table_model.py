@@ -0,0 +1,89 @@
+'''
+Xlink_table_model.py
+
+A Qt table model used by the PyXlinkViewer PyMOL plugin dialog to show the xlink table. The model
+holds the header and a sequence of rows (see Xlink_controller.table_rows), and the view asks it for
+the text of only the cells it shows, so the rows of xlinks held as columns (see Xlink_columns) are
+only made when they are scrolled into view, rather than a table item being made for every cell.
+
+Copyright (C) Bob Schiffrin March 2020
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+Any queries, suggestions, or bug reports (!) please contact Bob Schiffrin:
+b.schiffrin@leeds.ac.uk
+
+'''
+
+from pymol.Qt import QtCore
+
+Qt = QtCore.Qt
+
+
+class Xlink_table_model(QtCore.QAbstractTableModel):
+
+    def __init__(self, parent=None):
+
+        QtCore.QAbstractTableModel.__init__(self, parent)
+
+        self.header = []
+        self.rows = []
+
+        # the last row asked for, as the view asks for the cells of a row one at a time
+        self.cached_row = (-1, None)
+
+
+    def set_rows(self, header, rows):
+        '''
+        Replaces the header and the rows shown. rows is any sequence of lists of strings
+        '''
+
+        self.beginResetModel()
+        self.header = header
+        self.rows = rows
+        self.cached_row = (-1, None)
+        self.endResetModel()
+
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.header)
+
+
+    def data(self, index, role=Qt.DisplayRole):
+
+        if not index.isValid():
+            return None
+
+        if role == Qt.TextAlignmentRole:
+            return int(Qt.AlignCenter)
+
+        if role != Qt.DisplayRole:
+            return None
+
+        if self.cached_row[0] != index.row():
+            self.cached_row = (index.row(), self.rows[index.row()])
+
+        return self.cached_row[1][index.column()]
+
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal and section < len(self.header):
+            return self.header[section]
+
+        return QtCore.QAbstractTableModel.headerData(self, section, orientation, role)
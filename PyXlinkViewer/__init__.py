@@ -26,6 +26,7 @@ b.schiffrin@leeds.ac.uk
 from __future__ import absolute_import
 from __future__ import print_function
 
+import fnmatch
 import os
 import sys
 
@@ -34,8 +35,8 @@ import sys
 script_dir = os.path.dirname(__file__)
 sys.path.insert(0, script_dir)
 
-from BXlink_viewer import BXlink_viewer
-from pymol import cmd
+# NB. the viewer, NumPy and Qt are only imported when they are first used (by a command, a session, or opening
+# the dialog), so that loading the plugin at PyMOL startup is quick
 
 ##-----------------------------------------------------------------------------
 
@@ -47,10 +48,70 @@ def __init_plugin__(app=None):
     from pymol.plugins import addmenuitemqt
     addmenuitemqt('PyXlinkViewer', run_plugin_gui)
 
+    register_hooks()
+
+
+def register_hooks():
+    '''
+    Adds the session tasks and the xlink_* commands to PyMOL, without importing the viewer
+    '''
+    import pymol
+
+    # store the viewer state in saved sessions, and restore it when they are loaded
+    pymol._session_save_tasks.append(save_session_task)
+    pymol._session_restore_tasks.append(restore_session_task)
+
+    # add the xlink_* commands, so that the viewer can be used from scripts without the dialog
+    import Xlink_commands
+    Xlink_commands.register_commands(get_viewer, refresh_dialog)
+
+
+def save_session_task(session, _self=None):
+    # nothing is stored (or imported) if the plugin hasn't been used
+    if viewer is not None:
+        import Xlink_session
+        Xlink_session.save_session(viewer, session)
+
+    return 1
+
+
+def restore_session_task(session, _self=None):
+    import Xlink_session
+
+    if Xlink_session.restore_session(get_viewer, session):
+        refresh_dialog()
+
+    return 1
+
 
 # global reference to avoid garbage collection of our dialog
 dialog = None
 
+# the viewer is shared by the dialog and session restore, so it is kept at module level
+viewer = None
+
+
+def get_viewer():
+    '''
+    Returns the viewer, creating it if necessary
+    '''
+    global viewer
+
+    if viewer is None:
+        from BXlink_viewer import BXlink_viewer
+        viewer = BXlink_viewer()
+
+    return viewer
+
+
+def refresh_dialog():
+    '''
+    Update the dialog (if it has been created) after the viewer state has been changed, e.g. by loading a session
+    '''
+
+    if dialog is not None:
+        dialog.refresh_from_viewer()
+
 
 ##-----------------------------------------------------------------------------
 
@@ -66,6 +127,9 @@ def run_plugin_gui():
 
     dialog.show()
 
+    # pick up objects loaded while the dialog was closed
+    dialog.sync_object_list()
+
 
 def make_dialog():
     '''
@@ -74,14 +138,18 @@ def make_dialog():
 
     from pymol import cmd
     from pymol.Qt import QtWidgets, QtGui, QtCore  # note this gives the PyQt5 rather than PyQt4 interface
-    from pymol.Qt.utils import loadUi
     from pymol.Qt.utils import getSaveFileNameWithExt
 
+    import Xlink_store
+    import Xlink_controller
+    import Ui_cache
+    from Xlink_table_model import Xlink_table_model
+
     import pymol.Qt
     Qt = QtCore.Qt
 
     #make a viewer object accessible by all functions
-    viewer = BXlink_viewer()
+    viewer = get_viewer()
 
     QFileDialog = QtWidgets.QFileDialog
     getOpenFileNames = QFileDialog.getOpenFileNames
@@ -89,9 +157,15 @@ def make_dialog():
     # create a new Window
     dialog = QtWidgets.QDialog()
 
-    # populate the Window from our *.ui file which was created with the Qt Designer
+    # populate the Window from our *.ui file which was created with the Qt Designer. The compiled form of the file
+    # is cached, so it is only parsed again when it changes
     uifile = os.path.join(os.path.dirname(__file__), 'PyXlinkViewer.ui')
-    form = loadUi(uifile, dialog)
+    form = Ui_cache.load_ui(uifile, dialog)
+
+    # the xlink table shows the rows of a model, which only makes the rows it is asked for
+    xlink_model = Xlink_table_model(dialog)
+    form.table_xlinks.setModel(xlink_model)
+    form.table_xlinks.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.Stretch)
 
 
 #-------------------------------------------------------------------
@@ -112,80 +186,72 @@ def make_dialog():
             #need to convert list object returned by open file dialog to a string
             xlink_file = "".join(open_fname)       
 
+            # xlinks saved in a binary store are restored with their distances rather than parsed
+            if Xlink_store.is_store(xlink_file):
+                viewer.delete_objects()
+                viewer.load_store(xlink_file)
+                refresh_from_viewer()
+                return
+
             # only deal with files in jwalk format for now
             xlink_file_type = 'jwalk'
 
-            viewer.set_xlink_file(xlink_file)
-            viewer.set_xlink_file_type(xlink_file_type)
-            viewer.parse_xlink_file()
-            viewer.calculate_distances()
-            viewer.test_monos_in_obj()
+            try:
+                Xlink_controller.load(viewer, xlink_file, xlink_file_type)
+            except ValueError as e:
+                QtWidgets.QMessageBox.warning(dialog, 'PyXlinkViewer', str(e))
+                return
+
+            populate_comparison_combo()
             populate_xlink_table()
             change_num_sat_viol()
+            update_threshold_curve(True)
             
             viewer.display()
 
-#-------------------------------------------------------------------
 
-    def populate_xlink_table():
+    def open_comparison_files():
         '''
-        Populates the table with xlinks and mono-links according to which are currently set to be displayed
+        Callback for the 'Compare...' button. Opens xlink files giving two or more conditions - one per file, or per
+        quantitative column - and joins them so that the xlinks can be coloured by their fold-change between conditions.
+        Files giving fewer conditions are rejected with a message
         '''
 
-        obs_xlinks = viewer.obs_xlinks
-        obs_monos = viewer.obs_monos
+        files = getOpenFileNames(dialog, 'Open files to compare', os.getcwd())[0]
 
-        w = form.table_xlinks
-        
-        #remove data if already 
-        w.setRowCount(0)
+        if files:
+            viewer.delete_objects()
+            viewer.set_xlink_file_type('jwalk')
 
-        entries = []
+            try:
+                viewer.parse_comparison_files(files)
+                Xlink_controller.compute(viewer)
+            except ValueError as e:
+                QtWidgets.QMessageBox.warning(dialog, 'PyXlinkViewer', str(e))
 
-        for xl in obs_xlinks:
+                # the xlinks already loaded are drawn again
+                viewer.update()
+                return
 
-            str_dist = '{0:3.1f}'.format(xl.distance)
-            entry = [xl.chain1, xl.resid1, xl.chain2, xl.resid2, str_dist]
+            populate_comparison_combo()
+            populate_xlink_table()
+            change_num_sat_viol()
+            update_threshold_curve(True)
 
-            bAdded_entry = False
-            if xl.distance <= viewer.threshold and viewer.show_satisied == True:
-                entries.append(entry)
-                bAdded_entry = True
+            viewer.display()
 
-            if xl.distance > viewer.threshold and viewer.show_violated == True:
-                entries.append(entry)
-                bAdded_entry = True
+#-------------------------------------------------------------------
 
-            # check that inters should be shown
-            if bAdded_entry and xl.chain1 != xl.chain2 and viewer.show_inter == False:
-                entries.pop()
+    def populate_xlink_table():
+        '''
+        Populates the table with xlinks and mono-links according to which are currently set to be displayed
+        '''
 
-            if bAdded_entry and xl.chain1 == xl.chain2 and viewer.show_intra == False:
-                entries.pop()
-        
+        snap = Xlink_controller.snapshot(viewer)
+        entries = Xlink_controller.table_rows(snap, Xlink_controller.options_from_viewer(viewer))
 
-        #now add the monolinks to end of table
-        for m in obs_monos:
-            if viewer.show_mono == True:
-                entry = [m.chain, m.resid, '-', '-', '-']
-                entries.append(entry)
-
-        if entries:
-            w.setColumnCount(len(entries[0]))
-            w.setRowCount(len(entries))
-
-            for i, row in enumerate(entries):
-                for j, col in enumerate(row):
-                    item = QtWidgets.QTableWidgetItem(col)
-                    w.setItem(i, j, item)
-                    #align text in centre of cell
-                    item.setTextAlignment(Qt.AlignCenter)
-        
-            # set the columns to be equal width and fit in the table
-            header = w.horizontalHeader()
-            for i in range(0, len(entries[0])):  
-                header.setSectionResizeMode(i, QtWidgets.QHeaderView.Stretch)
-            
+        # the columns are equal widths which fit in the table, and the cells are centred (see Xlink_table_model)
+        xlink_model.set_rows(Xlink_controller.table_header(snap), entries)
 
 
 #-------------------------------------------------------------------
@@ -202,37 +268,7 @@ def make_dialog():
         filename = getSaveFileNameWithExt(dialog, 'Save As...', filter='csv file (*.csv)')
        
         if filename:
-        
-            table = form.table_xlinks
-
-            num_cols = table.columnCount()
-            num_rows = table.rowCount()
-
-            with open(filename, 'w') as f:
-
-                for i in range(0, num_cols):
-
-                    item = table.horizontalHeaderItem(i)
-                    f.write(item.text() + ',')
-                f.write('Threshold,Sat-Viol\n')
-
-                for i in range(0, num_rows):
-                    for j in range(0, num_cols):
-
-                        item = table.item(i, j)
-                        text = item.text()
-                        f.write(text + ',')
-                   
-                    #last item retrieved was the distance for this xlink or a dash if a mono-link entry so use this to test if satisfied 
-                    if text == '-':
-                        f.write('-,-\n')
-                    else:
-                        f.write(str(viewer.threshold) + ',')
-
-                        if float(text) <= viewer.threshold:
-                            f.write('S\n')
-                        else:
-                            f.write('V\n')
+            Xlink_controller.export(Xlink_controller.snapshot(viewer), filename, Xlink_controller.options_from_viewer(viewer))
 
 #----------------------------------------------------------------------------------------------------
     
@@ -309,6 +345,8 @@ def make_dialog():
         viewer.set_threshold(form.doublespin_threshold.value())
         change_num_sat_viol()
         populate_xlink_table()
+        populate_chain_pair_table()
+        update_threshold_curve()
         viewer.update()
 
 
@@ -321,39 +359,159 @@ def make_dialog():
         viewer.set_mono_size(form.doublespin_mono_size.value())
         viewer.update()
 
+    # the mono-link modes in the order they are listed in the combo box
+    mono_modes = ['fixed', 'gradient', 'bfactor']
+
+    def change_mono_mode():
+        viewer.set_mono_mode(mono_modes[form.combo_mono_mode.currentIndex()])
+        viewer.update()
+
+    # the interface labels of the inter-chain xlinks shown, in the order they are listed in the combo box
+    interface_filters = ['all', 'interface', 'near-interface', 'distal']
+
+    def change_interface_filter():
+        viewer.set_interface_filter(interface_filters[form.combo_interface.currentIndex()])
+        populate_xlink_table()
+        change_num_sat_viol()
+        viewer.update()
+
+    # what the B-factor column of the object holds, in the order listed in the combo box
+    uncertainty_modes = ['off', 'bfactor', 'plddt']
+
+    def change_uncertainty_mode():
+        '''
+        Callback for the B-factor column combo box. Gives each distance an uncertainty from the B-factors or pLDDT
+        scores, and each xlink a probability of being satisfied, which adds a column to the table
+        '''
+
+        viewer.set_uncertainty_mode(uncertainty_modes[form.combo_uncertainty.currentIndex()])
+
+        if viewer.num_xlinks():
+            viewer.calculate_uncertainties()
+
+            for line in viewer.uncertainty_report():
+                print('PyXlinkViewer: ' + line)
+
+        populate_xlink_table()
+        change_num_sat_viol()
+        viewer.update()
+
+    def change_min_confidence():
+        viewer.set_min_confidence(form.doublespin_confidence.value())
+        populate_xlink_table()
+        change_num_sat_viol()
+        viewer.update()
 
 #---------------------------------------------------------------------------
-    def change_num_sat_viol():
+
+    # call back functions for level of detail controls
+
+    def change_detail():
+        viewer.set_lod_mode(form.combo_detail.currentText().lower())
+        viewer.update()
+
+    def check_cull_click():
+        viewer.set_cull_to_view(form.check_cull.isChecked())
+        viewer.update()
+
+#---------------------------------------------------------------------------
+
+    def watch_coords():
         '''
-        Changes the numbers of satisfied and violated xlinks in line-edit boxes. Called when either a change to threshold value is made,
-        or the intra or inter checkboxes are clicked on
+        Called by a timer to check whether the coordinates of the selected object have changed, in which case the
+        affected xlink distances are recalculated and redrawn by the viewer, and the table is updated
         '''
 
-        num_sat = 0
-        num_viol  = 0
+        if not form.check_watch.isChecked() or not viewer.num_xlinks() or not dialog.isVisible():
+            return
 
-        for xl in viewer.obs_xlinks:
-            
-            # NB. check that both residues are in structure, if one is not, don't class as either sat or viol as not known
-            if xl.distance <= viewer.threshold and xl.bRes1_in_obj == True and xl.bRes2_in_obj == True:
+        if viewer.check_coords():
+            populate_xlink_table()
+            change_num_sat_viol()
+            populate_chain_pair_table()
+            update_threshold_curve(True)
+
+#---------------------------------------------------------------------------
+
+    def change_chain_equivalence():
+        '''
+        Callback for the equivalent chains line edit. Re-resolves ambiguous xlinks with the new groups of equivalent
+        chains, e.g. 'A=B=C' for a homo-trimer
+        '''
+
+        viewer.set_chain_equivalence(form.line_edit_equivalence.text())
+
+        if viewer.num_xlinks():
+            viewer.calculate_distances()
+            viewer.build_network()
+            populate_xlink_table()
+            change_num_sat_viol()
+            populate_chain_pair_table()
+            update_threshold_curve(True)
+            viewer.update()
+
+#---------------------------------------------------------------------------
+
+    def open_sequence_file():
+        '''
+        Callback for the 'Map sequence' button. Opens a FASTA file of the reference sequences the xlink residue numbers
+        are given against, and recalculates the distances with the residues mapped onto the structure's numbering
+        '''
+
+        files = getOpenFileNames(dialog, 'Open reference sequence (FASTA) file', os.getcwd())[0]
+
+        if not files:
+            return
+
+        viewer.load_sequence_file(files[0])
+
+        for line in viewer.residue_mapping_report() or ['the residue numbers of the structure match the reference sequences']:
+            print('PyXlinkViewer: ' + line)
+
+        if viewer.num_xlinks() or viewer.obs_monos:
+            viewer.calculate_distances()
+            viewer.test_monos_in_obj()
+            viewer.build_network()
+            populate_xlink_table()
+            change_num_sat_viol()
+            populate_chain_pair_table()
+            update_threshold_curve(True)
+            viewer.update()
+
+#---------------------------------------------------------------------------
+
+    # the distance modes in the order they are listed in the combo box
+    distance_modes = ['ca', 'cb', 'reactive', 'centroid', 'closest']
+
+    def change_distance_mode():
+        '''
+        Callback for the distance mode combo box. Recalculates all xlink distances with the new mode
+        '''
 
-                #check that inter/intra are selected
-                if viewer.show_inter == True and xl.chain1 != xl.chain2:
-                    num_sat += 1
+        mode = distance_modes[form.combo_distance.currentIndex()]
+        viewer.set_distance_mode(mode)
 
-                if viewer.show_intra == True and xl.chain1 == xl.chain2:
-                    num_sat += 1
-              
-            if xl.distance > viewer.threshold and xl.bRes1_in_obj == True and xl.bRes2_in_obj == True: 
-                
-                #check that inter/intra are selected
-                if viewer.show_inter == True and xl.chain1 != xl.chain2:
-                    num_viol += 1
+        if viewer.num_xlinks():
+            viewer.calculate_distances()
+            viewer.build_network()
+            change_num_sat_viol()
+            populate_chain_pair_table()
+            update_threshold_curve(True)
+            viewer.update()
 
-                if viewer.show_intra == True and xl.chain1 == xl.chain2:
-                    num_viol += 1
+        # the distance column is named after the mode
+        populate_xlink_table()
 
-                
+
+#---------------------------------------------------------------------------
+    def change_num_sat_viol():
+        '''
+        Changes the numbers of satisfied and violated xlinks in line-edit boxes. Called when either a change to threshold value is made,
+        or the intra or inter checkboxes are clicked on
+        '''
+
+        snap = Xlink_controller.snapshot(viewer)
+        num_sat, num_viol = Xlink_controller.count(snap, Xlink_controller.options_from_viewer(viewer))
 
         form.line_edit_satisfied.setText(str(num_sat))
         form.line_edit_violated.setText(str(num_viol))
@@ -361,6 +519,261 @@ def make_dialog():
         form.line_edit_satisfied.setAlignment(Qt.AlignCenter)
         form.line_edit_violated.setAlignment(Qt.AlignCenter)
 
+        # sum of the flat-bottom penalties of the xlinks beyond the threshold
+        form.line_edit_score.setText('{0:.1f}'.format(Xlink_controller.score(snap)))
+        form.line_edit_score.setAlignment(Qt.AlignCenter)
+
+#-------------------------------------------------------------------------
+
+    def check_placement():
+        '''
+        Callback for the 'Check placement' button. Asks for a fixed and a moving chain, searches for a rigid-body move
+        of the moving chain which reduces the violated xlinks between them, and offers to apply it
+        '''
+
+        text, bOk = QtWidgets.QInputDialog.getText(dialog, 'PyXlinkViewer', 'Fixed and moving chains (e.g. A B):')
+        chains = text.split()
+
+        if not bOk or len(chains) != 2:
+            return
+
+        result = viewer.check_chain_placement(chains[0], chains[1])
+
+        if result is None:
+            QtWidgets.QMessageBox.information(dialog, 'PyXlinkViewer', 'There are no xlinks between chains {0} and {1}'.format(*chains))
+            return
+
+        message = ('Moving chain {0} by {1:.1f} A and rotating it by {2:.1f} degrees changes the violated xlinks between chains '
+                   '{3} and {0} from {4} to {5} (score {6:.1f} to {7:.1f}, {8} placements tested).\n\nApply this move?').format(
+                       chains[1], result['shift_length'], result['angle'], chains[0], result['initial_violated'],
+                       result['num_violated'], result['initial_score'], result['score'], result['num_evaluated'])
+
+        print('PyXlinkViewer: ' + message.split('\n')[0] + ' Transformation matrix: ' + str(result['matrix']))
+
+        if QtWidgets.QMessageBox.question(dialog, 'PyXlinkViewer', message) == QtWidgets.QMessageBox.Yes:
+            viewer.apply_chain_placement(chains[1], result)
+            populate_xlink_table()
+            change_num_sat_viol()
+            populate_chain_pair_table()
+            update_threshold_curve(True)
+
+#-------------------------------------------------------------------------
+
+    # (reference, test) condition indices of the entries in the comparison combo box
+    comparison_pairs = []
+
+    def populate_comparison_combo():
+        '''
+        Fills the comparison combo box with every pair of the loaded conditions, and enables the comparison widgets
+        if there are conditions to compare
+        '''
+
+        comparison = viewer.comparison
+        widgets = [form.combo_comparison, form.doublespin_fc_threshold, form.check_fold_change]
+
+        for widget in widgets:
+            widget.blockSignals(True)
+
+        form.combo_comparison.clear()
+        del comparison_pairs[:]
+
+        if comparison is not None:
+            for i in range(len(comparison.conditions)):
+                for j in range(i + 1, len(comparison.conditions)):
+                    comparison_pairs.append((i, j))
+                    form.combo_comparison.addItem(comparison.conditions[j] + ' / ' + comparison.conditions[i])
+
+            if (comparison.reference, comparison.test) in comparison_pairs:
+                form.combo_comparison.setCurrentIndex(comparison_pairs.index((comparison.reference, comparison.test)))
+
+        form.doublespin_fc_threshold.setValue(viewer.fc_threshold)
+        form.check_fold_change.setChecked(viewer.show_fold_change)
+
+        for widget in widgets:
+            widget.setEnabled(comparison is not None)
+            widget.blockSignals(False)
+
+
+    def change_comparison():
+        '''
+        Callback for the comparison combo box. Recalculates the fold-changes between the chosen pair of conditions
+        '''
+
+        viewer.set_comparison_conditions(*comparison_pairs[form.combo_comparison.currentIndex()])
+        populate_xlink_table()
+        viewer.update()
+
+
+    def change_fc_threshold():
+        '''
+        Callback for the fold-change threshold. Only the xlinks which have crossed the threshold are redrawn
+        '''
+
+        changed = viewer.set_fold_change_threshold(form.doublespin_fc_threshold.value())
+
+        if viewer.show_fold_change:
+            viewer.redraw_xlinks(changed)
+
+
+    def check_fold_change_click():
+        viewer.set_show_fold_change(form.check_fold_change.isChecked())
+        viewer.update()
+
+#-------------------------------------------------------------------------
+
+    def apply_query():
+        '''
+        Callback for the query 'Apply' button. Restricts the table and displayed xlinks to those matching the
+        query, e.g. '3:100-300 7' shows xlinks between residues 100-300 of chain 3 and chain 7
+        '''
+
+        try:
+            viewer.set_query(form.line_edit_query.text())
+        except ValueError as e:
+            QtWidgets.QMessageBox.warning(dialog, 'PyXlinkViewer', str(e))
+            return
+
+        populate_xlink_table()
+        change_num_sat_viol()
+        update_threshold_curve(True)
+        viewer.update()
+
+#-------------------------------------------------------------------------
+
+    # the chain pair heatmap is created the first time it is asked for
+    chain_pair_dialog = []
+
+    def show_chain_pairs():
+        '''
+        Callback for the 'Chain pairs' button. Opens a window containing a heatmap of the number of satisfied
+        and violated xlinks between each pair of chains
+        '''
+
+        if not chain_pair_dialog:
+            pair_dialog = QtWidgets.QDialog(dialog)
+            pair_dialog.setWindowTitle('PyXlinkViewer - chain pairs')
+            pair_dialog.resize(500, 400)
+
+            layout = QtWidgets.QVBoxLayout(pair_dialog)
+            table = QtWidgets.QTableWidget(pair_dialog)
+            layout.addWidget(table)
+
+            button_export_network = QtWidgets.QPushButton('Export', pair_dialog)
+            button_export_network.clicked.connect(export_network)
+            layout.addWidget(button_export_network)
+
+            chain_pair_dialog.append((pair_dialog, table))
+
+        populate_chain_pair_table()
+        chain_pair_dialog[0][0].show()
+
+
+    def populate_chain_pair_table():
+        '''
+        Fills the chain pair heatmap. Each cell shows the satisfied/violated counts for the chain pair and is
+        shaded from the satisfied colour to the violated colour by the fraction of violated xlinks
+        '''
+
+        if not chain_pair_dialog:
+            return
+
+        table = chain_pair_dialog[0][1]
+        network = viewer.network
+
+        sat = network.chain_pair_matrix('sat')
+        viol = network.chain_pair_matrix('viol')
+
+        table.clear()
+        table.setRowCount(len(network.chains))
+        table.setColumnCount(len(network.chains))
+        table.setHorizontalHeaderLabels(network.chains)
+        table.setVerticalHeaderLabels(network.chains)
+
+        for i in range(len(network.chains)):
+            for j in range(len(network.chains)):
+
+                item = QtWidgets.QTableWidgetItem('{0}/{1}'.format(sat[i][j], viol[i][j]))
+                item.setTextAlignment(Qt.AlignCenter)
+
+                total = sat[i][j] + viol[i][j]
+                if total:
+                    frac = viol[i][j] / float(total)
+                    rgb = [(1. - frac) * s + frac * v for s, v in zip(viewer.satisfied_colour, viewer.violated_colour)]
+                    item.setBackground(QtGui.QColor.fromRgbF(rgb[0], rgb[1], rgb[2], 0.2 + 0.6 * min(1., total / 10.)))
+
+                table.setItem(i, j, item)
+
+
+    def export_network():
+        '''
+        Callback for the export button of the chain pair window. Saves the chain pair counts and residue degrees
+        '''
+
+        filename = getSaveFileNameWithExt(dialog, 'Save As...', filter='csv file (*.csv)')
+
+        if filename:
+            viewer.network.export(filename)
+
+#-------------------------------------------------------------------------
+
+    # the threshold curve window is created the first time it is asked for
+    threshold_curve_dialog = []
+
+    def show_threshold_curve():
+        '''
+        Callback for the 'Threshold curve' button. Opens a window plotting the fraction of xlinks satisfied against
+        the threshold. Clicking on the plot sets the threshold
+        '''
+
+        if not threshold_curve_dialog:
+            import Threshold_plot
+
+            curve_dialog = QtWidgets.QDialog(dialog)
+            curve_dialog.setWindowTitle('PyXlinkViewer - threshold curve')
+            curve_dialog.resize(560, 380)
+
+            layout = QtWidgets.QVBoxLayout(curve_dialog)
+            plot = Threshold_plot.Threshold_plot(curve_dialog)
+            plot.on_pick = form.doublespin_threshold.setValue
+            layout.addWidget(plot)
+
+            button_export_curve = QtWidgets.QPushButton('Export', curve_dialog)
+            button_export_curve.clicked.connect(export_threshold_curve)
+            layout.addWidget(button_export_curve)
+
+            threshold_curve_dialog.append((curve_dialog, plot))
+
+        update_threshold_curve(True)
+        threshold_curve_dialog[0][0].show()
+
+
+    def update_threshold_curve(bNew_distances=False):
+        '''
+        Updates the threshold curve window if it is open. The curve itself is only recalculated if the distances may
+        have changed
+        '''
+
+        if not threshold_curve_dialog:
+            return
+
+        plot = threshold_curve_dialog[0][1]
+        plot.set_threshold(viewer.threshold)
+
+        if bNew_distances or plot.curve is None:
+            plot.set_curve(Xlink_controller.sensitivity(Xlink_controller.snapshot(viewer)))
+
+
+    def export_threshold_curve():
+        '''
+        Callback for the export button of the threshold curve window. Saves the numbers of satisfied xlinks at each
+        threshold in csv format
+        '''
+
+        filename = getSaveFileNameWithExt(dialog, 'Save As...', filter='csv file (*.csv)')
+
+        if filename:
+            Xlink_controller.export_sensitivity([Xlink_controller.snapshot(viewer)], filename)
+
 #-------------------------------------------------------------------------
 
     def change_selected_object(item):
@@ -371,12 +784,158 @@ def make_dialog():
         
         viewer.set_obj(item.text())
 
+        # build the coordinate index of the object in the background, so it is ready when an xlink file is opened
+        viewer.prebuild_coord_index(item.text())
+
+
+    # list box item of each PyMOL object, so that objects can be added, removed and filtered without refilling the list
+    object_items = {}
+
+    def object_matches_filter(name):
+        '''
+        Returns whether an object name matches the filter text - either a part of the name, or a pattern with * and ?
+        wildcards
+        '''
+
+        text = form.line_edit_object_filter.text().strip().lower()
+
+        if '*' in text or '?' in text:
+            return fnmatch.fnmatchcase(name.lower(), text)
+
+        return text in name.lower()
+
+
+    def sync_object_list():
+        '''
+        Brings the objects list box up to date with the PyMOL objects - items are added for new objects and removed for
+        deleted ones, keeping the selection and scroll position. PyMOL doesn't signal when objects are created or
+        deleted, so this is called by the watch timer while the dialog is visible, and when it is shown
+        '''
+
+        # only molecules can have xlinks drawn on them, so the CGO objects drawn by the viewer (and any other objects
+        # which aren't molecules) aren't listed
+        names = [name for name in cmd.get_names('objects') if cmd.get_type(name) == 'object:molecule']
+
+        if len(names) == len(object_items) and all(name in object_items for name in names):
+            return
+
+        widget = form.list_select_object
+        widget.setUpdatesEnabled(False)
+
+        current = set(names)
+        for name in [name for name in object_items if name not in current]:
+            widget.takeItem(widget.row(object_items.pop(name)))
+
+        # the remaining items are in PyMOL's order, so each new object is inserted at its position in the names
+        for row, name in enumerate(names):
+            if name not in object_items:
+                item = QtWidgets.QListWidgetItem(name)
+                item.setHidden(not object_matches_filter(name))
+                widget.insertItem(row, item)
+                object_items[name] = item
+
+        widget.setUpdatesEnabled(True)
+
+    dialog.sync_object_list = sync_object_list
+
+
+    def filter_objects():
+        '''
+        Callback for the object filter line edit. Hides the objects which don't match the filter
+        '''
+
+        for name, item in object_items.items():
+            item.setHidden(not object_matches_filter(name))
+
+
+    def select_filtered_object():
+        '''
+        Called when return is pressed in the object filter - selects the first object which matches the filter
+        '''
+
+        widget = form.list_select_object
+
+        for row in range(widget.count()):
+            item = widget.item(row)
+
+            if not item.isHidden():
+                widget.setCurrentItem(item)
+                change_selected_object(item)
+                return
+
+
+    def watch_objects():
+        if dialog.isVisible():
+            sync_object_list()
+
+
+#-------------------------------------------------------------------------
+
+    def refresh_from_viewer():
+        '''
+        Sets the widgets from the current state of the viewer and fills the table, e.g. after a session containing
+        xlinks has been loaded. Signals are blocked so that the widget callbacks don't redraw the xlinks
+        '''
+
+        widgets = [form.doublespin_threshold, form.doublespin_width, form.doublespin_mono_size, form.check_satisfied,
+                   form.check_violated, form.check_inter, form.check_intra, form.check_mono, form.check_cull,
+                   form.combo_detail, form.combo_distance, form.combo_mono_mode, form.combo_interface,
+                   form.combo_uncertainty, form.doublespin_confidence]
+
+        for widget in widgets:
+            widget.blockSignals(True)
+
+        form.doublespin_threshold.setValue(viewer.threshold)
+        form.doublespin_width.setValue(viewer.radius)
+        form.doublespin_mono_size.setValue(viewer.mono_size)
+
+        form.check_satisfied.setChecked(viewer.show_satisied)
+        form.check_violated.setChecked(viewer.show_violated)
+        form.check_inter.setChecked(viewer.show_inter)
+        form.check_intra.setChecked(viewer.show_intra)
+        form.check_mono.setChecked(viewer.show_mono)
+        form.check_cull.setChecked(viewer.cull_to_view)
+
+        form.combo_detail.setCurrentIndex(['auto', 'cylinders', 'lines'].index(viewer.lod_mode))
+        form.combo_distance.setCurrentIndex(distance_modes.index(viewer.distance_mode))
+        form.combo_mono_mode.setCurrentIndex(mono_modes.index(viewer.mono_mode))
+        form.combo_interface.setCurrentIndex(interface_filters.index(viewer.interface_filter))
+        form.combo_uncertainty.setCurrentIndex(uncertainty_modes.index(viewer.uncertainty_mode))
+        form.doublespin_confidence.setValue(viewer.min_confidence)
+
+        for widget in widgets:
+            widget.blockSignals(False)
+
+        for frame, rgb in [(form.frame_satisfied_colour, viewer.satisfied_colour),
+                           (form.frame_violated_colour, viewer.violated_colour),
+                           (form.frame_mono_colour, viewer.mono_colour)]:
+            frame.setStyleSheet("QWidget { background-color: %s}" % QtGui.QColor.fromRgbF(*rgb).name())
+
+        form.line_edit_query.setText(viewer.query_text)
+        form.line_edit_equivalence.setText(','.join(sorted(set('='.join(g) for g in viewer.chain_equivalence.values()))))
+
+        sync_object_list()
+
+        if viewer.obj in object_items:
+            form.list_select_object.setCurrentItem(object_items[viewer.obj])
+
+        populate_comparison_combo()
+        populate_xlink_table()
+        change_num_sat_viol()
+        populate_chain_pair_table()
+        update_threshold_curve(True)
+
+    dialog.refresh_from_viewer = refresh_from_viewer
 
 #-------------------------------------------------------------------------
 
-    # initialise the viewer threshold and mono-size values in doublespin boxes - these are set in QtDesigner
-    viewer.set_threshold(form.doublespin_threshold.value())
-    viewer.set_mono_size(form.doublespin_mono_size.value())
+    # if the viewer already holds xlinks (restored from a session) the widgets are set from it at the end,
+    # otherwise initialise the viewer threshold and mono-size values in doublespin boxes - these are set in QtDesigner
+    bRestored = bool(viewer.num_xlinks() or viewer.obs_monos)
+
+    if not bRestored:
+        viewer.set_threshold(form.doublespin_threshold.value())
+        viewer.set_mono_size(form.doublespin_mono_size.value())
 
     # initialise the widgets
     form.check_satisfied.setChecked(True)
@@ -385,26 +944,20 @@ def make_dialog():
     form.check_intra.setChecked(True)
 
 
-    # stop object list box from resizing when objects are added
-    w = form.list_select_object
-    w.setFixedSize(149, 50)
-
     # fill the listbox with the current objects
-    objects = cmd.get_names()
-
-    for i, obj in enumerate(objects):
-        item = QtWidgets.QListWidgetItem(obj)
+    sync_object_list()
 
-        form.list_select_object.addItem(item)
-
-        if i == 0: #select the first item in the QListWidget
-            item.setSelected(True)
-            viewer.set_obj(item.text())
+    if form.list_select_object.count() and not bRestored: #select the first item in the QListWidget
+        item = form.list_select_object.item(0)
+        item.setSelected(True)
+        change_selected_object(item)
 
     form.list_select_object.setFocus()
 
     #call a function of clicking listbox item to update selected PyMOL object stored by viewer class
     form.list_select_object.itemClicked.connect(change_selected_object)
+    form.line_edit_object_filter.textChanged.connect(filter_objects)
+    form.line_edit_object_filter.returnPressed.connect(select_filtered_object)
 
     # initialise colours in for satisfied, violated, and mono-links
     form.frame_satisfied_colour.setStyleSheet("QWidget { background-color: %s}" % '#0000FF')  # initialise to blue
@@ -413,11 +966,19 @@ def make_dialog():
 
     # hook up the button callbacks
     form.button_open_xlink_file.clicked.connect(open_file)
+    form.button_compare.clicked.connect(open_comparison_files)
     form.button_close.clicked.connect(dialog.close)
     form.button_satisfied_colour.clicked.connect(change_satisfied_colour)
     form.button_violated_colour.clicked.connect(change_violated_colour)
     form.button_mono_colour.clicked.connect(change_mono_colour)
     form.button_export.clicked.connect(export)
+    form.button_chain_pairs.clicked.connect(show_chain_pairs)
+    form.button_placement.clicked.connect(check_placement)
+    form.button_threshold_curve.clicked.connect(show_threshold_curve)
+    form.button_sequence.clicked.connect(open_sequence_file)
+    form.button_query.clicked.connect(apply_query)
+    form.line_edit_query.returnPressed.connect(apply_query)
+    form.line_edit_equivalence.returnPressed.connect(change_chain_equivalence)
 
     # hook up the check box callbacks
     form.check_satisfied.clicked.connect(check_satisfied_click)
@@ -425,11 +986,36 @@ def make_dialog():
     form.check_inter.clicked.connect(check_inter_click)
     form.check_intra.clicked.connect(check_intra_click)
     form.check_mono.clicked.connect(check_mono_click)
+    form.check_cull.clicked.connect(check_cull_click)
+    form.check_fold_change.clicked.connect(check_fold_change_click)
 
     # hook up the check box callbacks
     form.doublespin_threshold.valueChanged.connect(change_threshold)
     form.doublespin_width.valueChanged.connect(change_width)
     form.doublespin_mono_size.valueChanged.connect(change_mono_size)
+    form.doublespin_fc_threshold.valueChanged.connect(change_fc_threshold)
+    form.doublespin_confidence.valueChanged.connect(change_min_confidence)
+
+    # hook up the combo box callbacks
+    form.combo_detail.currentIndexChanged.connect(change_detail)
+    form.combo_distance.currentIndexChanged.connect(change_distance_mode)
+    form.combo_mono_mode.currentIndexChanged.connect(change_mono_mode)
+    form.combo_interface.currentIndexChanged.connect(change_interface_filter)
+    form.combo_uncertainty.currentIndexChanged.connect(change_uncertainty_mode)
+    form.combo_comparison.currentIndexChanged.connect(change_comparison)
+
+    # check for coordinate changes and new or deleted objects once a second - the timer is kept on the dialog to avoid
+    # garbage collection
+    dialog.watch_timer = QtCore.QTimer(dialog)
+    dialog.watch_timer.timeout.connect(watch_coords)
+    dialog.watch_timer.timeout.connect(watch_objects)
+    dialog.watch_timer.start(1000)
+
+    if bRestored:
+        refresh_from_viewer()
+    else:
+        populate_comparison_combo()
+        populate_xlink_table()
 
 
     return dialog
@@ -0,0 +1,150 @@
+'''
+Bob Schiffrin
+
+bench_startup.py
+
+Measures how long the PyXlinkViewer plugin adds to PyMOL startup, and checks it against a time
+budget. Each measurement is made in a fresh Python process, as the cost being measured is mostly
+importing modules:
+
+- registration: importing the plugin and adding its session tasks and xlink_* commands, which is
+  what PyMOL does for every installed plugin at startup. The viewer, NumPy and Qt should not be
+  imported here, so the modules the plugin imports are also checked.
+
+- dialog (with --ui): creating the dialog's widgets from PyXlinkViewer.ui the first time the dialog
+  is opened, with and without the compiled .ui cache (see Ui_cache.py). This needs PyMOL's Qt.
+
+Run with the Python that PyMOL uses, e.g.
+
+python bench_startup.py
+python bench_startup.py --repeat 10 --budget 30 --ui
+
+The exit status is 1 if the median registration time is over the budget (in ms), or if any of the
+heavy modules were imported at registration.
+
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+PLUGIN_DIR = os.path.join(PACKAGE_DIR, 'PyXlinkViewer')
+
+# default budget for registering the plugin, in ms
+BUDGET_MS = 50.0
+
+# modules which must not be imported when the plugin is registered
+HEAVY_MODULES = ['numpy', 'BXlink_viewer', 'Xlink_controller', 'Xlink_session', 'pymol.Qt', 'PyQt5', 'PySide2']
+
+
+REGISTRATION_CODE = '''
+import json, sys, time
+sys.path.insert(0, {package_dir!r})
+from pymol import cmd
+
+before = set(sys.modules)
+start = time.perf_counter()
+
+import PyXlinkViewer
+PyXlinkViewer.register_hooks()
+
+elapsed = time.perf_counter() - start
+print(json.dumps({{'ms': elapsed * 1e3, 'modules': sorted(set(sys.modules) - before)}}))
+'''
+
+DIALOG_CODE = '''
+import json, os, sys, time
+sys.path.insert(0, {plugin_dir!r})
+from pymol.Qt import QtWidgets
+app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+import pymol.Qt
+import Ui_cache
+
+uifile = os.path.join({plugin_dir!r}, 'PyXlinkViewer.ui')
+binding = getattr(pymol.Qt, 'PYQT_NAME', None) or ''
+if {cold!r} and os.path.exists(Ui_cache.cache_filename(uifile, binding)):
+    os.remove(Ui_cache.cache_filename(uifile, binding))
+
+start = time.perf_counter()
+if {use_cache!r}:
+    Ui_cache.load_ui(uifile, QtWidgets.QDialog())
+else:
+    from pymol.Qt.utils import loadUi
+    loadUi(uifile, QtWidgets.QDialog())
+
+print(json.dumps({{'ms': (time.perf_counter() - start) * 1e3, 'modules': []}}))
+'''
+
+
+def run(code):
+    '''
+    Runs code in a new Python process, and returns the dictionary it prints
+    '''
+
+    output = subprocess.check_output([sys.executable, '-c', code], env=dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen')))
+
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+
+    return values[mid] if len(values) % 2 else 0.5 * (values[mid - 1] + values[mid])
+
+
+def measure(name, code, repeat):
+    '''
+    Runs code repeat times and prints the median and range of the times. Returns the median and the modules
+    imported by the first run
+    '''
+
+    results = [run(code) for i in range(repeat)]
+    times = [r['ms'] for r in results]
+
+    print('{0:<28} median {1:7.1f} ms   min {2:7.1f} ms   max {3:7.1f} ms'.format(name, median(times), min(times), max(times)))
+
+    return median(times), results[0]['modules']
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Measures the startup time of the PyXlinkViewer plugin')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs of each measurement')
+    parser.add_argument('--budget', type=float, default=BUDGET_MS, help='registration time budget in ms')
+    parser.add_argument('--ui', action='store_true', help='also measure loading the dialog from the .ui file')
+    args = parser.parse_args()
+
+    registration_ms, modules = measure('registration', REGISTRATION_CODE.format(package_dir=PACKAGE_DIR), args.repeat)
+
+    heavy = [m for m in modules if m in HEAVY_MODULES or any(m.startswith(h + '.') for h in HEAVY_MODULES)]
+    print('modules imported by the plugin: ' + ', '.join(m for m in modules if '.' not in m))
+
+    if args.ui:
+        measure('dialog, loadUi', DIALOG_CODE.format(plugin_dir=PLUGIN_DIR, cold=False, use_cache=False), args.repeat)
+        measure('dialog, compiling .ui', DIALOG_CODE.format(plugin_dir=PLUGIN_DIR, cold=True, use_cache=True), args.repeat)
+        measure('dialog, cached .ui', DIALOG_CODE.format(plugin_dir=PLUGIN_DIR, cold=False, use_cache=True), args.repeat)
+
+    bOk = True
+
+    if registration_ms > args.budget:
+        print('FAIL: registration took {0:.1f} ms, over the budget of {1:.1f} ms'.format(registration_ms, args.budget))
+        bOk = False
+
+    if heavy:
+        print('FAIL: registration imported ' + ', '.join(heavy))
+        bOk = False
+
+    if bOk:
+        print('OK: registration within the budget of {0:.1f} ms'.format(args.budget))
+
+    return 0 if bOk else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -22,11 +22,38 @@ or
 
 PyMOL>draw_xlink my_obj_name, A, 21, B, 27, [0.0,0.0,1.0], radius=0.6
 
+A whole list of xlinks can be drawn as a single object in one call with draw_xlinks.
+The xlinks are given as space separated <chain1>/<resid1>-<chain2>/<resid2> pairs,
+or as the name of a file in jwalk format. For example:
+
+PyMOL>draw_xlinks my_obj_name, A/100-A/400 A/21-B/27, green, radius=0.4
+
+PyMOL>draw_xlinks my_obj_name, my_xlinks.txt, [1.0,0.5,0.0]
+
+The coordinate and CGO building functions are shared with the PyXlinkViewer plugin,
+so the PyXlinkViewer directory must be next to the scripts directory.
+
 '''
 
+import os
+import re
+import sys
+
 from pymol.cgo import *
 from pymol import cmd
 
+# make the PyXlinkViewer modules available to this script - PyMOL's run command sets __script__ rather
+# than __file__ in some versions
+script_file = globals().get('__file__') or globals().get('__script__')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(script_file)), os.pardir, 'PyXlinkViewer'))
+
+from Coord_index import Coord_index
+from BJwalk_file_reader import BJwalk_file_reader
+import Xlink_geometry
+
+# an xlink given as <chain1>/<resid1>-<chain2>/<resid2> - residue numbers can be negative
+pair_pattern = re.compile(r'^(\w+)/(-?\w+)-(\w+)/(-?\w+)$')
+
 # Dictionary look of some common colours - can be expanded if required
 # Alternatively RGB values can be supplied to the draw_xlink function
 
@@ -50,6 +77,62 @@ colours_dict = {
     'olive': [0.5, 0.5, 0.0],
 }
 
+def parse_colour(colour):
+    '''
+    Returns the RGB values of a named colour from the dictionary, or of a colour given as
+    RGB values e.g. [0.0,0.0,1.0]
+    '''
+
+    if colour in colours_dict:
+        return colours_dict[colour]
+
+    try:
+        rgb_values = [float(x) for x in colour[1:-1].split(',')]
+        if len(rgb_values) == 3 and all(0 <= x <= 1 for x in rgb_values):
+            return rgb_values
+        else:
+            print('Invalid RGB format, using default colour')
+            return [1.0, 1.0, 1.0]  # Default to white
+    except:
+        print('Error parsing custom colour values, using default colour')
+        return [0.0, 0.0, 1.0]  # Default to blue
+
+
+def ca_coords(obj, chain, resid):
+    '''
+    Returns the coordinates of the CA atom of a residue, or None if it is not in the object
+    '''
+
+    # a minus sign has to be escaped in a residue selection
+    xyz = cmd.get_coords('obj {0} and chain {1} and resi {2} and name CA'.format(obj, chain, resid.replace('-', '\\-')))
+
+    if xyz is None or not len(xyz):
+        return None
+
+    return xyz[:1]
+
+
+def parse_pairs(text):
+    '''
+    Returns the list of ((chain1, resid1), (chain2, resid2)) residue pairs of space separated
+    <chain1>/<resid1>-<chain2>/<resid2> xlinks, and the list of any which could not be read
+    '''
+
+    pairs = []
+    bad_pairs = []
+
+    for pair in text.split():
+        match = pair_pattern.match(pair)
+
+        if match:
+            chain1, resid1, chain2, resid2 = match.groups()
+            pairs.append(((chain1, resid1), (chain2, resid2)))
+        else:
+            bad_pairs.append(pair)
+
+    return pairs, bad_pairs
+
+
 @cmd.extend
 def draw_xlink(obj, chain1, resid1, chain2, resid2, colour, radius=0.5):
     '''
@@ -58,49 +141,51 @@ def draw_xlink(obj, chain1, resid1, chain2, resid2, colour, radius=0.5):
     parameter can be a named colour from a dictionary or RGB values
     '''
 
-    # make text for selection of the ca atom of both residues in xlink
-    s1 = "obj " + obj + " and chain " + chain1 + " and resi " + resid1 + " and name CA" 
-    s2 = "obj " + obj + " and chain " + chain2 + " and resi " + resid2 + " and name CA"
-
-    # get a model for each of the selections
-    model1 = cmd.get_model(s1)
-    model2 = cmd.get_model(s2)
+    # get the x,y,z coordinates of the ca atoms of just the two residues
+    xyz1 = ca_coords(obj, chain1, str(resid1))
+    xyz2 = ca_coords(obj, chain2, str(resid2))
 
-    # get x,y,z coordinates of each ca atom 
-    x1 = model1.atom[0].coord[0]
-    y1 = model1.atom[0].coord[1]
-    z1 = model1.atom[0].coord[2]
-    x2 = model2.atom[0].coord[0]
-    y2 = model2.atom[0].coord[1]
-    z2 = model2.atom[0].coord[2]
+    if xyz1 is None or xyz2 is None:
+        print('Residue not found in ' + obj + ', xlink not drawn')
+        return
 
     # set the rgb values of the cylinder
-    if colour in colours_dict:
-        r1, g1, b1 = colours_dict[colour]
-        r2, g2, b2 = colours_dict[colour]
-    else:
-        try:
-            rgb_values = [float(x) for x in colour[1:-1].split(',')]
-            if len(rgb_values) == 3 and all(0 <= x <= 1 for x in rgb_values):
-                r1, g1, b1 = rgb_values
-                r2, g2, b2 = rgb_values
-            else:
-                print('Invalid RGB format, using default colour')
-                r1, g1, b1 = 1.0, 1.0, 1.0  # Default to blue
-                r2, g2, b2 = 1.0, 1.0, 1.0  # Default to blue
-        except:
-            print('Error parsing custom colour values, using default colour')
-            r1, g1, b1 = 0.0, 0.0, 1.0  # Default to blue
-            r2, g2, b2 = 0.0, 0.0, 1.0  # Default to blue
+    rgb = parse_colour(colour)
 
     # create the object and draw the cylinder - radius of the cylinder defaults to 0.5
-    xlink_obj = [CYLINDER, x1, y1, z1, x2, y2, z2, float(radius), r1, g1, b1, r2, g2, b2]
+    xlink_obj = Xlink_geometry.cylinder_cgo(xyz1, xyz2, float(radius), rgb)
     xlink_obj_name = f'{chain1}{resid1}_{chain2}{resid2}_custom'
     cmd.load_cgo(xlink_obj, xlink_obj_name)
 
     print('Done')
 
 
+@cmd.extend
+def draw_xlinks(obj, xlinks, colour, radius=0.5, name='xlinks_custom'):
+    '''
+    This takes in a list of xlinks, either as space separated <chain1>/<resid1>-<chain2>/<resid2>
+    pairs or the name of a jwalk format file, and draws a cylinder between the CA atoms of each
+    pair as a single object, fetching all of the coordinates at once
+    '''
+
+    if os.path.isfile(xlinks):
+        xls, monos = BJwalk_file_reader(xlinks).read()
+        pairs = [((xl.chain1, xl.resid1), (xl.chain2, xl.resid2)) for xl in xls]
+    else:
+        pairs, bad_pairs = parse_pairs(xlinks)
+
+        if bad_pairs:
+            print('Not drawn, expected <chain1>/<resid1>-<chain2>/<resid2>: ' + ' '.join(bad_pairs))
 
+    index = Coord_index(obj, atom_names=['CA'])
+    xyz1, found1 = index.get_coords([p[0] for p in pairs], 'CA')
+    xyz2, found2 = index.get_coords([p[1] for p in pairs], 'CA')
 
+    found = found1 & found2
+    if not found.all():
+        print('{0} xlinks have a residue not found in {1} and were not drawn'.format((~found).sum(), obj))
 
+    xlink_obj = Xlink_geometry.cylinder_cgo(xyz1[found], xyz2[found], float(radius), parse_colour(colour))
+    cmd.load_cgo(xlink_obj, name)
+
+    print('Done')